@@ -0,0 +1,45 @@
+"""
+Compare the size and load time of single file snapshots for each codec
+
+    python3 benchmarks/bench_compression.py [--repeat N] [--functions N]
+
+Writes a synthetic environment (see synthetic.py) with each codec in a
+temporary directory and reports the size of the file, the time to write it and
+the time to open it and load all components.  Times are the best of N runs.
+"""
+import argparse
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import envdiff
+import snapshot
+import synthetic
+
+def load_all(path):
+    source = snapshot.SnapshotFile(path)
+    for c in envdiff.COMPONENTS:
+        source.load(c)
+
+def main():
+    p = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    p.add_argument("--repeat", type=int, default=5)
+    p.add_argument("--functions", type=int, default=2000)
+    args = p.parse_args()
+
+    components = synthetic.environment(n_functions=args.functions)
+    print(f"{'codec':<8} {'size (KiB)':>12} {'ratio':>8} {'write (ms)':>12} {'load (ms)':>12}")
+    with tempfile.TemporaryDirectory() as tmpdir:
+        plain_size = None
+        for codec in [None] + sorted(snapshot.CODECS):
+            path = os.path.join(tmpdir, codec or "none")
+            write = synthetic.best_time(lambda: snapshot.write_snapshot(path, components, codec=codec), args.repeat)
+            load = synthetic.best_time(lambda: load_all(path), args.repeat)
+            size = os.path.getsize(path)
+            plain_size = plain_size or size
+            print(f"{codec or 'none':<8} {size/1024:>12.1f} {plain_size/size:>8.2f} {write*1000:>12.1f} {load*1000:>12.1f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""
+Compare computing the diff of two saved environments with taking it from the
+diff cache
+
+    python3 benchmarks/bench_diff_cache.py [--functions N] [--repeat N]
+
+Writes the environments of bench_gencode.py (a tenth of each component
+changed) as single files with digests and times building their
+ShellEnvironmentDiff and using it like env-diff-compare --format json and
+env-diff-gencode do: without a cache, with an empty cache (the diff is
+computed and stored) and with the diff in the cache.  Times are the best of N
+runs.
+"""
+import argparse
+import io
+import os
+import shutil
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import codegen
+import diskcache
+import envdiff
+import snapshot
+import bench_gencode
+import synthetic
+
+def write(path, components):
+    snapshot.write_snapshot(path, components)
+    components = dict(components, digests=envdiff.compute_digests(snapshot.SnapshotFile(path)))
+    snapshot.write_snapshot(path, components)
+
+def use(before, after, cache, config=None):
+    diff = envdiff.ShellEnvironmentDiff(before, after, config=config, cache=cache)
+    for _ in diff.records():
+        pass
+    codegen.gencode(diff, io.StringIO(), compact=True)
+    diff.save()
+    return diff
+
+def main():
+    p = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    p.add_argument("--functions", type=int, default=2000)
+    p.add_argument("--repeat", type=int, default=5)
+    args = p.parse_args()
+
+    before, after = bench_gencode.environments(args.functions)
+    config = codegen.diff_config()
+    with tempfile.TemporaryDirectory() as tmpdir:
+        paths = [os.path.join(tmpdir, "before"), os.path.join(tmpdir, "after")]
+        write(paths[0], before)
+        write(paths[1], after)
+        directory = os.path.join(tmpdir, "cache")
+        cache = diskcache.DiskCache(directory, envdiff.DEFAULT_DIFF_CACHE_SIZE)
+
+        print(f"{'diff':<14} {'time (ms)':>10}")
+        t = synthetic.best_time(lambda: use(*paths, None, config), args.repeat)
+        print(f"{'no cache':<14} {t*1000:>10.1f}")
+        t = synthetic.best_time(lambda: use(*paths, cache, config), args.repeat,
+                                setup=lambda: shutil.rmtree(directory, ignore_errors=True))
+        print(f"{'cache miss':<14} {t*1000:>10.1f}")
+        if not use(*paths, cache, config).cached:
+            print("FAILED: diff not found in the cache")
+            return 1
+        t = synthetic.best_time(lambda: use(*paths, cache, config), args.repeat)
+        size = sum(size for _, size, _ in cache.entries())
+        print(f"{'cache hit':<14} {t*1000:>10.1f}   (entry of {size/1024:.1f} KiB)")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,49 @@
+"""
+Compare the lookup of the display and comparison functions of variables
+
+    python3 benchmarks/bench_dispatch.py [--variables N] [--lists N] [--repeat N]
+
+Looks up the function of N changed variables among the colon lists of the
+config (plain names) and a few patterns, once by trying re.fullmatch() with
+each key in turn as env-diff-compare.py used to do and once with
+envdiff.NameIndex.  Times are the best of N runs.
+"""
+import argparse
+import os
+import re
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import envdiff
+import synthetic
+
+def scan(mapping, names):
+    for name in names:
+        for k in mapping:
+            if re.fullmatch(k, name):
+                break
+
+def indexed(mapping, names):
+    index = envdiff.NameIndex(mapping)
+    for name in names:
+        index.get(name)
+
+def main():
+    p = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    p.add_argument("--variables", type=int, default=5000)
+    p.add_argument("--lists", type=int, default=60)
+    p.add_argument("--repeat", type=int, default=5)
+    args = p.parse_args()
+
+    mapping = {'BASH_FUNC_[a-zA-Z_.-]*%%': 'exported_function', 'MY_.*_DIRS': 'colon_list'}
+    mapping.update({f"LIST_{i}_PATH": 'colon_list' for i in range(args.lists)})
+    names = [f"VAR_{i}" if i % 4 else f"LIST_{i % args.lists}_PATH" for i in range(args.variables)]
+
+    print(f"{'method':<10} {'time (ms)':>10}")
+    for label, func in (('scan', scan), ('index', indexed)):
+        t = synthetic.best_time(lambda: func(mapping, names), args.repeat)
+        print(f"{label:<10} {t*1000:>10.2f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+"""
+Compare the line diff of changed functions with difflib and linediff
+
+    python3 benchmarks/bench_function_diff.py [--functions N] [--lines N] [--repeat N]
+
+Changes a few lines in each of N synthetic functions of about --lines lines
+made of the usual repeated shell keywords and diffs every function with
+difflib.unified_diff() as env-diff-compare.py used to do and with
+linediff.unified_diff().  Times are the best of N runs.
+"""
+import argparse
+import difflib
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import linediff
+import synthetic
+
+def function_pair(rng, n_lines):
+    body = ["{ "]
+    while len(body) < n_lines:
+        var = f"_var{rng.randint(0, 20)}"
+        body += [f"    if [[ -n ${{{var}}} ]]; then", f"        {rng.choice(['echo', 'printf', 'local'])} \"${{{var}}}\";", "    fi;"]
+        if rng.random() < 0.2:
+            body += ["    for x in \"$@\"; do", "        shift;", "    done;"]
+    body.append("}")
+    changed = list(body)
+    for _ in range(rng.randint(1, 5)):
+        k = rng.randrange(1, len(changed) - 1)
+        if rng.random() < 0.5:
+            changed[k] = "        echo changed;"
+        else:
+            changed.insert(k, "    compopt -o nospace;")
+    return body, changed
+
+def main():
+    p = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    p.add_argument("--functions", type=int, default=300)
+    p.add_argument("--lines", type=int, default=200)
+    p.add_argument("--repeat", type=int, default=3)
+    args = p.parse_args()
+
+    rng = random.Random(0)
+    pairs = [function_pair(rng, args.lines) for _ in range(args.functions)]
+    print(f"{'method':<10} {'time (ms)':>10}")
+    for label, diff in (('difflib', difflib.unified_diff), ('linediff', linediff.unified_diff)):
+        t = synthetic.best_time(lambda: [list(diff(a, b)) for a, b in pairs], args.repeat)
+        print(f"{label:<10} {t*1000:>10.1f}")
+
+if __name__ == "__main__":
+    main()
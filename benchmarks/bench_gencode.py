@@ -0,0 +1,107 @@
+"""
+Compare the time bash takes to source the code of env-diff-gencode with and
+without --compact
+
+    python3 benchmarks/bench_gencode.py [--repeat N] [--functions N] [--check]
+
+Generates the code to go from one synthetic environment (see synthetic.py) to
+another where a tenth of each component has changed.  Each script is sourced
+by bash after the code setting up the initial environment and the time reported
+is the best of N runs measured by bash with EPOCHREALTIME.  The state of the
+shell after sourcing each script (declare -p, declare -f, shopt -p and trap -p)
+must be the same.  With --check, the exit code is 1 if it is not or if the
+compact code is not faster.  Most of the time goes to parsing the functions
+which is the same for both, use --functions 0 to see the rest.
+"""
+import argparse
+import io
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import codegen
+import envdiff
+import snapshot
+import synthetic
+
+# State of the shell after sourcing the code
+DUMP = "declare -p; declare -f; shopt -p; shopt -po; trap -p"
+
+def environments(n_functions, seed=0):
+    before = synthetic.environment(n_functions=n_functions, seed=seed, real_options=True)
+    after = synthetic.modified(before, seed=seed)
+    before['traps'] = {"EXIT": ":", "SIGINT": "echo interrupted"}
+    after['traps'] = {"EXIT": ":", "SIGUSR1": "echo signaled"}
+    return before, after
+
+def gencode(initial, final, compact=False):
+    output = io.StringIO()
+    codegen.gencode(envdiff.ShellEnvironmentDiff(initial, final, config=codegen.diff_config()), output, compact=compact)
+    return output.getvalue()
+
+def source_time(setup, script, repeat):
+    """
+    Best time in seconds of 'source script' in a shell where setup has been
+    sourced, measured by bash itself
+    """
+    code = f"source {setup}\nfor i in {{1..{repeat}}} ; do (start=$EPOCHREALTIME ; source {script} ; echo $start $EPOCHREALTIME) ; done\n"
+    result = bash(code)
+    return min(float(end) - float(start) for start, end in (l.split() for l in result.stdout.splitlines()))
+
+def bash(code):
+    return subprocess.run(["bash", "--norc", "--noprofile", "-c", code], env={'PATH': os.environ['PATH']},
+                          stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+
+def main():
+    p = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    p.add_argument("--repeat", type=int, default=5)
+    p.add_argument("--functions", type=int, default=2000)
+    p.add_argument("--check", action='store_true', help="Fail if the results differ or if the compact code is not faster")
+    args = p.parse_args()
+
+    before, after = environments(args.functions)
+    empty = {c: {} for c in before}
+    failures = []
+    with tempfile.TemporaryDirectory() as tmpdir:
+        paths = {}
+        for name, components in (('empty', empty), ('before', before), ('after', after)):
+            paths[name] = os.path.join(tmpdir, name)
+            snapshot.write_snapshot(paths[name], components)
+        setup = os.path.join(tmpdir, "setup.sh")
+        with open(setup, 'w') as f:
+            f.write(gencode(paths['empty'], paths['before'], compact=True))
+
+        print(f"{'code':<10} {'size (KiB)':>12} {'lines':>8} {'generate (ms)':>14} {'source (ms)':>12}")
+        # Both are written to the same path so that $_ and BASH_EXECUTION_STRING are the same
+        script = os.path.join(tmpdir, "diff.sh")
+        states = {}
+        times = {}
+        for label, compact in (('default', False), ('compact', True)):
+            start = time.perf_counter()
+            code = gencode(paths['before'], paths['after'], compact=compact)
+            generate = time.perf_counter() - start
+            with open(script, 'w') as f:
+                f.write(code)
+            result = bash(f"source {setup}\nsource {script}\n{DUMP}\n")
+            if result.stderr:
+                failures.append(f"{label}: errors while sourcing: {result.stderr[:500]}")
+            states[label] = result.stdout
+            times[label] = source_time(setup, script, args.repeat)
+            print(f"{label:<10} {len(code)/1024:>12.1f} {code.count(chr(10)):>8} {generate*1000:>14.1f} {times[label]*1000:>12.1f}")
+
+    if states['default'] != states['compact']:
+        failures.append("state of the shell differs between the default and compact code")
+    if times['compact'] >= times['default']:
+        failures.append("compact code is not faster to source")
+    for f in failures:
+        print(f"FAILED: {f}")
+    if args.check and failures:
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,44 @@
+"""
+Compare the diff of long reordered colon separated lists
+
+    python3 benchmarks/bench_list_diff.py [--elements N] [--repeat N]
+
+Takes a list of N directories, moves some of them to the front as a module
+load does, adds and removes a few, and compares the lists with the full
+difflib.unified_diff() that env-diff-compare.py used to show when the order
+changed and with linediff.ListDiff.  Times are the best of N runs.
+"""
+import argparse
+import difflib
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import linediff
+import synthetic
+
+def main():
+    p = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    p.add_argument("--elements", type=int, default=2000)
+    p.add_argument("--repeat", type=int, default=3)
+    args = p.parse_args()
+
+    rng = random.Random(0)
+    initial = [f"/opt/modules/{rng.choice(['lib', 'tool', 'app'])}{i}/bin" for i in range(args.elements)]
+    final = list(initial)
+    moved = rng.sample(final, args.elements // 20)
+    final = moved + [e for e in final if e not in set(moved)]
+    for _ in range(10):
+        del final[rng.randrange(len(final))]
+        final.insert(rng.randrange(len(final)), f"/new/{rng.random()}")
+
+    print(f"{'method':<10} {'time (ms)':>10}")
+    for label, func in (('difflib', lambda: list(difflib.unified_diff(initial, final, n=1000))),
+                        ('ListDiff', lambda: linediff.ListDiff(initial, final))):
+        t = synthetic.best_time(func, args.repeat)
+        print(f"{label:<10} {t*1000:>10.1f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""
+Compare sequential and concurrent loading of two saved environments
+
+    python3 benchmarks/bench_parallel_load.py [--functions N] [--latency MS] [--threads N] [--repeat N]
+
+Writes two synthetic environments (see synthetic.py) that differ in every
+component as directories with one file per function (the layout of older
+saves) and as stores (env-diff-snapshot add) and times computing their
+ShellEnvironmentDiff and loading all components with ENV_DIFF_LOAD_THREADS=1
+and with --threads threads.
+
+Local disks are too fast to show what happens on network filesystems so
+every file opened for reading waits --latency milliseconds first.  Times are
+the best of N runs.
+"""
+import argparse
+import builtins
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import envdiff
+import store
+import synthetic
+
+def write_directory(path, components):
+    """ Save components as a directory with one file per function """
+    os.makedirs(os.path.join(path, "functions"))
+    for c in ('env_vars', 'shell_vars', 'assoc_arrays', 'normal_arrays', 'traps'):
+        with open(os.path.join(path, f"{c}.json"), 'w') as f:
+            json.dump(components[c], f)
+    for c, filename in (('shopt', "shopt.txt"), ('shopt_set', "shopt_set.txt")):
+        with open(os.path.join(path, filename), 'w') as f:
+            f.writelines(f"{k} {v}\n" for k, v in components[c].items())
+    with open(os.path.join(path, "func_names.txt"), 'w') as f:
+        f.writelines(f"{name}\n" for name in components['functions'])
+    for name, lines in components['functions'].items():
+        with open(os.path.join(path, "functions", f"BASH_FUNC_{name}.bash"), 'w') as f:
+            f.write(f"{name} () \n" + '\n'.join(lines) + '\n')
+
+def load_diff(before, after, threads):
+    os.environ['ENV_DIFF_LOAD_THREADS'] = str(threads)
+    diff = envdiff.ShellEnvironmentDiff(before, after)
+    for c in envdiff.COMPONENTS:
+        getattr(diff, c).initial
+        getattr(diff, c).final
+
+def main():
+    p = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    p.add_argument("--functions", type=int, default=2000)
+    p.add_argument("--latency", type=float, default=1.0, help="Milliseconds added to each open() for reading")
+    p.add_argument("--threads", type=int, default=envdiff.DEFAULT_LOAD_THREADS)
+    p.add_argument("--repeat", type=int, default=3)
+    args = p.parse_args()
+
+    real_open = builtins.open
+    def slow_open(file, mode='r', *a, **kw):
+        if 'r' in mode and isinstance(file, str) and file.startswith(tmpdir):
+            time.sleep(args.latency / 1000)
+        return real_open(file, mode, *a, **kw)
+
+    print(f"{'layout':<12} {'sequential (ms)':>16} {f'{args.threads} threads (ms)':>16} {'speedup':>8}")
+    with tempfile.TemporaryDirectory() as tmpdir:
+        environments = [synthetic.environment(n_functions=args.functions, seed=seed) for seed in (0, 1)]
+        for i, components in enumerate(environments):
+            write_directory(os.path.join(tmpdir, f"dir{i}"), components)
+            store.Store(os.path.join(tmpdir, "store")).add(os.path.join(tmpdir, f"dir{i}"), f"env{i}")
+        layouts = {
+            'directory': [os.path.join(tmpdir, f"dir{i}") for i in (0, 1)],
+            'store': [os.path.join(tmpdir, "store", "snapshots", f"env{i}") for i in (0, 1)],
+        }
+        builtins.open = slow_open
+        try:
+            for layout, (before, after) in layouts.items():
+                sequential = synthetic.best_time(lambda: load_diff(before, after, 1), args.repeat)
+                concurrent = synthetic.best_time(lambda: load_diff(before, after, args.threads), args.repeat)
+                print(f"{layout:<12} {sequential*1000:>16.1f} {concurrent*1000:>16.1f} {sequential/concurrent:>8.2f}")
+        finally:
+            builtins.open = real_open
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""
+Measure the startup time of env-diff-compare.py
+
+    python3 benchmarks/bench_startup.py [--repeat N] [--check]
+
+Compares two small saved environments with env-diff-compare.py and reports the
+time it takes beyond starting the python interpreter, with and without a
+config file.  With --check, the exit code is 1 if that time is over BUDGET_MS
+or if the optional packages yaml and pygments were imported when they are not
+needed.  This is run by test_startup.sh.
+"""
+import argparse
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import snapshot
+import synthetic
+
+# Time allowed on top of the startup of the interpreter
+BUDGET_MS = 150
+
+def run_time(cmd, env, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run(cmd, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=False)
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+def imported_modules(cmd, env):
+    """ Names of the modules imported by cmd according to python -X importtime """
+    result = subprocess.run(cmd[:1] + ['-X', 'importtime'] + cmd[1:], env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    return {l.rsplit('|', 1)[1].strip() for l in result.stderr.splitlines() if l.startswith('import time:') and '|' in l}
+
+def main():
+    p = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    p.add_argument("--repeat", type=int, default=10)
+    p.add_argument("--check", action='store_true', help=f"Fail if over {BUDGET_MS} ms or if optional packages are imported")
+    args = p.parse_args()
+
+    failures = []
+    with tempfile.TemporaryDirectory() as tmpdir:
+        env = dict(os.environ, HOME=tmpdir, XDG_CACHE_HOME=os.path.join(tmpdir, "cache"))
+        env.pop('_env_diff_cmd', None)
+        before = synthetic.environment(n_vars=50, n_functions=50, n_arrays=5, seed=0)
+        after = synthetic.environment(n_vars=50, n_functions=50, n_arrays=5, seed=0)
+        after['env_vars']['NEW_VARIABLE'] = 'value'
+        snapshot.write_snapshot(os.path.join(tmpdir, "before"), before)
+        snapshot.write_snapshot(os.path.join(tmpdir, "after"), after)
+
+        interpreter = run_time([sys.executable, '-c', 'pass'], env, args.repeat)
+        compare = [sys.executable, os.path.join(ROOT, 'env-diff-compare.py'),
+                   os.path.join(tmpdir, "before"), os.path.join(tmpdir, "after")]
+        print(f"{'interpreter':<24} {interpreter*1000:8.1f} ms")
+
+        config_file = os.path.join(tmpdir, ".config", "env-diff.yml")
+        for label in ("no config file", "cached config file"):
+            if label == "cached config file":
+                os.makedirs(os.path.dirname(config_file))
+                shutil.copy(os.path.join(ROOT, "dot-config-env-diff.yml"), config_file)
+                # First run parses the file and fills the cache
+                subprocess.run(compare, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            t = run_time(compare, env, args.repeat)
+            overhead = (t - interpreter) * 1000
+            print(f"{label:<24} {t*1000:8.1f} ms ({overhead:+.1f} ms)")
+            if overhead > BUDGET_MS:
+                failures.append(f"{label}: {overhead:.1f} ms over the interpreter startup, budget is {BUDGET_MS} ms")
+            unwanted = {m for m in imported_modules(compare, env) if m.split('.')[0] in ('yaml', 'pygments')}
+            if unwanted:
+                failures.append(f"{label}: imported {', '.join(sorted(unwanted))}")
+
+    for f in failures:
+        print(f"FAILED: {f}")
+    if args.check and failures:
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
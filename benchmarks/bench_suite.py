@@ -0,0 +1,220 @@
+"""
+Time every stage of env-diff on synthetic environments of increasing sizes
+and check the times against stored baselines
+
+    python3 benchmarks/bench_suite.py [--size NAME ...] [--repeat N]
+                                      [--check] [--update] [--tolerance F]
+                                      [--vars N] [--arrays M] [--elements K]
+                                      [--functions F] [--lines L]
+                                      [--list-length N] [--traps N]
+
+For each size (see SIZES), a synthetic environment (see synthetic.py) is set
+up in bash and saved with env-diff-save, a tenth of each of its components is
+changed and the result is saved too.  The stages timed are
+
+    save      env-diff-save of the first environment, measured by bash
+    load      loading every component with ShellEnvironmentData
+    diff      ShellEnvironmentDiff and its records (env-diff-compare --format json)
+    compare   the report of env-diff-compare
+    gencode   gencode() --compact
+    source    sourcing the generated code, measured by bash
+
+Times are the best of N runs.  The caches of env-diff are disabled.  Giving any
+of the sizes on the command line times a size named 'custom' which has no
+baseline.
+
+The baselines are in baselines.json next to this script and --update replaces
+those of the sizes that were run.  With --check, the exit code is 1 if a stage
+takes more than TOLERANCE times its baseline or if the time of a stage grows
+more than TOLERANCE times as much as in the baselines from the smallest size
+to a larger one.  The second check catches scaling regressions on a machine
+that is faster or slower than the one where the baselines were measured.
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import codegen
+import envdiff
+import server
+import snapshot
+import synthetic
+
+BASELINES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines.json")
+STAGES = ['save', 'load', 'diff', 'compare', 'gencode', 'source']
+DEFAULT_TOLERANCE = 2.0
+
+# Arguments of synthetic.environment()
+SIZES = {
+    'small': dict(n_vars=100, n_arrays=10, array_size=10, n_functions=200, function_lines=10,
+                  list_length=10, n_traps=2),
+    'medium': dict(n_vars=300, n_arrays=60, array_size=50, n_functions=2000, function_lines=20,
+                   list_length=40, n_traps=4),
+    'large': dict(n_vars=1000, n_arrays=200, array_size=200, n_functions=8000, function_lines=30,
+                  list_length=200, n_traps=8),
+}
+
+def bash(code, env):
+    result = subprocess.run(["bash", "--norc", "--noprofile", "-c", code], env=env,
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"bash failed: {result.stderr[:500]}")
+    return result.stdout
+
+def bash_time(code, env):
+    """ Best time of the lines 'START END' printed by code """
+    return min(float(end) - float(start) for start, end in (l.split() for l in bash(code, env).splitlines()))
+
+def setup_code(path, components):
+    """ Write the code setting up components in bash to path """
+    empty = {c: {} for c in components}
+    with tempfile.TemporaryDirectory() as tmpdir:
+        snapshot.write_snapshot(os.path.join(tmpdir, "empty"), empty)
+        snapshot.write_snapshot(os.path.join(tmpdir, "env"), components)
+        diff = envdiff.ShellEnvironmentDiff(os.path.join(tmpdir, "empty"), os.path.join(tmpdir, "env"),
+                                            config=codegen.diff_config())
+        with open(path, 'w') as f:
+            codegen.gencode(diff, f, compact=True)
+    # gencode() only changes options that exist on both sides
+    with open(path, 'a') as f:
+        for component, command in (('shopt', 'shopt'), ('shopt_set', 'shopt -o')):
+            for value, flag in (('on', '-s'), ('off', '-u')):
+                options = [o for o, v in components[component].items() if v == value]
+                if options:
+                    f.write(f"{command} {flag} {' '.join(options)}\n")
+
+def load(path):
+    data = envdiff.ShellEnvironmentData(path)
+    data.prefetch(envdiff.COMPONENTS, envdiff.component_pool(envdiff.load_threads()))
+    for c in envdiff.COMPONENTS:
+        getattr(data, c)
+
+def records(before, after):
+    diff = envdiff.ShellEnvironmentDiff(before, after, config=codegen.diff_config())
+    for _ in diff.records():
+        pass
+
+def report(compare, before, after):
+    with contextlib.redirect_stdout(io.StringIO()):
+        if compare.run(['-F', os.devnull, before, after]) != 0:
+            raise RuntimeError("env-diff-compare failed")
+
+def gencode(before, after):
+    output = io.StringIO()
+    codegen.gencode(envdiff.ShellEnvironmentDiff(before, after, config=codegen.diff_config()), output, compact=True)
+    return output.getvalue()
+
+def run_size(params, repeat, tmpdir, env, compare):
+    """ Dictionary of the best time in ms of each stage """
+    before = synthetic.environment(seed=0, real_options=True, **params)
+    after = synthetic.modified(before, seed=1)
+    paths = {}
+    for name, components in (('before', before), ('after', after)):
+        setup_code(os.path.join(tmpdir, f"{name}.sh"), components)
+        paths[name] = os.path.join(tmpdir, f"{name}.saved")
+    cmd = os.path.join(ROOT, "env-diff-cmd.bash")
+
+    # The time keyword of bash measures the save because the variables of a
+    # loop would end up in the saved environment
+    times = {}
+    save = f"source {cmd}\nsource {tmpdir}/before.sh\nTIMEFORMAT=%3R\n"
+    save += f"rm -rf {paths['before']} ; {{ time env-diff-save {paths['before']} >/dev/null ; }} 2>&1\n" * repeat
+    times['save'] = min(float(t) for t in bash(save, env).split())
+    bash(f"source {cmd}\nsource {tmpdir}/after.sh\nTIMEFORMAT=%3R\nenv-diff-save {paths['after']} >/dev/null\n", env)
+
+    times['load'] = synthetic.best_time(lambda: load(paths['before']), repeat)
+    times['diff'] = synthetic.best_time(lambda: records(paths['before'], paths['after']), repeat)
+    times['compare'] = synthetic.best_time(lambda: report(compare, paths['before'], paths['after']), repeat)
+    times['gencode'] = synthetic.best_time(lambda: gencode(paths['before'], paths['after']), repeat)
+
+    script = os.path.join(tmpdir, "diff.sh")
+    with open(script, 'w') as f:
+        f.write(gencode(paths['before'], paths['after']))
+    source = (f"source {tmpdir}/before.sh\n"
+              f"for i in {{1..{repeat}}} ; do (start=$EPOCHREALTIME ; source {script} ; echo $start $EPOCHREALTIME) ; done\n")
+    times['source'] = bash_time(source, env)
+    return {stage: round(t * 1000, 2) for stage, t in times.items()}
+
+def check(results, baselines, tolerance):
+    """ List of failures of results compared to baselines """
+    failures = []
+    measured = [s for s in SIZES if s in results and s in baselines]
+    for size in measured:
+        for stage in STAGES:
+            if results[size][stage] > baselines[size][stage] * tolerance:
+                failures.append(f"{size} {stage}: {results[size][stage]:.1f} ms, baseline is {baselines[size][stage]:.1f} ms")
+    if len(measured) > 1:
+        smallest = measured[0]
+        for size in measured[1:]:
+            for stage in STAGES:
+                growth = results[size][stage] / results[smallest][stage]
+                expected = baselines[size][stage] / baselines[smallest][stage]
+                if growth > expected * tolerance:
+                    failures.append(f"{size} {stage}: {growth:.1f} times the time of {smallest}, "
+                                    f"{expected:.1f} times in the baselines")
+    return failures
+
+def main():
+    p = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    p.add_argument("--size", action='append', choices=list(SIZES), help="Size to run (default small and medium)")
+    p.add_argument("--repeat", type=int, default=5)
+    p.add_argument("--check", action='store_true', help="Fail if a stage is slower or scales worse than its baseline")
+    p.add_argument("--update", action='store_true', help="Store the times as the new baselines")
+    p.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE,
+                   help=f"Factor over the baselines that is a failure (default {DEFAULT_TOLERANCE})")
+    custom = p.add_argument_group("custom size")
+    for option, param in (("--vars", 'n_vars'), ("--arrays", 'n_arrays'), ("--elements", 'array_size'),
+                          ("--functions", 'n_functions'), ("--lines", 'function_lines'),
+                          ("--list-length", 'list_length'), ("--traps", 'n_traps')):
+        custom.add_argument(option, dest=param, type=int)
+    args = p.parse_args()
+
+    sizes = {s: SIZES[s] for s in (args.size or ['small', 'medium'])}
+    overrides = {k: v for k, v in vars(args).items() if k in SIZES['small'] and v is not None}
+    if overrides:
+        sizes = {'custom': dict(SIZES['medium'], **overrides)}
+
+    baselines = {}
+    if os.path.exists(BASELINES):
+        with open(BASELINES) as f:
+            baselines = json.load(f)
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmpdir:
+        env = {'PATH': os.environ['PATH'], 'HOME': tmpdir, 'ENV_DIFF_DIFF_CACHE': 'false'}
+        saved_environ = dict(os.environ)
+        os.environ.update(env, ENV_DIFF_HIGHLIGHT_CACHE='false')
+        try:
+            compare = server.load_script('env-diff-compare.py')
+            print(f"{'size':<8} " + ' '.join(f"{s + ' (ms)':>13}" for s in STAGES))
+            for size, params in sizes.items():
+                size_dir = os.path.join(tmpdir, size)
+                os.mkdir(size_dir)
+                results[size] = run_size(params, args.repeat, size_dir, env, compare)
+                print(f"{size:<8} " + ' '.join(f"{results[size][s]:>13.1f}" for s in STAGES), flush=True)
+        finally:
+            os.environ.clear()
+            os.environ.update(saved_environ)
+
+    failures = check(results, baselines, args.tolerance)
+    for f in failures:
+        print(f"FAILED: {f}")
+    if args.update:
+        baselines.update({s: t for s, t in results.items() if s in SIZES})
+        with open(BASELINES, 'w') as f:
+            json.dump(baselines, f, indent=2, sort_keys=True)
+            f.write('\n')
+    if args.check and failures:
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,66 @@
+"""
+Compare env-diff-compare --timeline with comparing each pair of adjacent
+environments separately
+
+    python3 benchmarks/bench_timeline.py [--snapshots N ...] [--functions N] [--repeat N]
+
+Writes a sequence of synthetic environments (see synthetic.py), each one with
+a twentieth of the components of the previous one changed, as single files
+with digests and times the history of all their entries with
+ShellEnvironmentTimeline of all of them and of each adjacent pair separately
+which loads the environments in the middle twice like running
+env-diff-compare on each pair.  The time per environment of the timeline
+should stay the same as the number of environments grows.  Times are the best
+of N runs and the diff cache is not used.
+"""
+import argparse
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import envdiff
+import snapshot
+import synthetic
+
+def write(path, components):
+    snapshot.write_snapshot(path, components)
+    components = dict(components, digests=envdiff.compute_digests(snapshot.SnapshotFile(path)))
+    snapshot.write_snapshot(path, components)
+
+def timeline(paths):
+    t = envdiff.ShellEnvironmentTimeline(paths)
+    for c, name in t.history():
+        if c == 'env_vars' and name == 'PATH':
+            t.element_history(c, name, ':')
+
+def pairs(paths):
+    for before, after in zip(paths, paths[1:]):
+        timeline([before, after])
+
+def main():
+    p = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    p.add_argument("--snapshots", type=int, action='append', help="Number of environments (default 2, 4, 8 and 16)")
+    p.add_argument("--functions", type=int, default=2000)
+    p.add_argument("--repeat", type=int, default=3)
+    args = p.parse_args()
+
+    counts = args.snapshots or [2, 4, 8, 16]
+    with tempfile.TemporaryDirectory() as tmpdir:
+        paths = []
+        components = synthetic.environment(n_functions=args.functions)
+        for k in range(max(counts)):
+            paths.append(os.path.join(tmpdir, f"S{k}"))
+            write(paths[-1], components)
+            components = synthetic.modified(components, fraction=0.05, seed=k)
+
+        print(f"{'snapshots':<10} {'timeline (ms)':>14} {'per snapshot':>13} {'pairs (ms)':>11}")
+        for n in counts:
+            t = synthetic.best_time(lambda: timeline(paths[:n]), args.repeat)
+            s = synthetic.best_time(lambda: pairs(paths[:n]), args.repeat)
+            print(f"{n:<10} {t*1000:>14.1f} {t*1000/n:>13.1f} {s*1000:>11.1f}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,129 @@
+"""
+Synthetic saved environments for benchmarks and the timing of their runs
+
+The sizes are those of a login shell on a cluster where a few module systems
+and function libraries have been loaded: a few hundred variables, some of them
+long colon separated lists, a few thousand functions and some arrays.
+"""
+import copy
+import random
+import time
+
+# Options that exist in bash for environments that are sourced by bash
+SHOPT = ["cdspell", "checkhash", "dotglob", "extglob", "globstar", "histappend",
+         "lithist", "nocaseglob", "nocasematch", "nullglob", "xpg_echo"]
+SHOPT_SET = ["allexport", "braceexpand", "errtrace", "functrace", "noclobber",
+             "notify", "pipefail"]
+SIGNALS = ["EXIT", "SIGINT", "SIGTERM", "SIGHUP", "SIGUSR1", "SIGUSR2", "SIGQUIT",
+           "SIGALRM", "SIGCHLD", "SIGCONT", "SIGPIPE", "SIGTSTP", "SIGWINCH"]
+
+def environment(n_vars=300, n_functions=2000, n_arrays=60, seed=0, array_size=None,
+                function_lines=None, list_length=None, n_traps=None, real_options=False):
+    """
+    Return a dictionary of components (see envdiff.COMPONENTS) of a synthetic
+    environment.  The same seed gives the same environment.
+
+    There are n_vars environment variables, one in ten being a colon separated
+    list of list_length elements, n_vars/3 shell variables, n_arrays normal
+    arrays of array_size elements, n_arrays/2 associative arrays of array_size
+    elements and n_functions functions of function_lines lines.  Sizes that
+    are None are random.  With n_traps, traps are set on that many signals
+    with commands that do nothing.  With real_options, the options are options
+    of bash so that the environment can be set up in bash.
+    """
+    rng = random.Random(seed)
+    words = [f"{p}{i}" for p in ("lib", "module", "tool", "path", "conf", "opt") for i in range(40)]
+
+    def size(n, low, high):
+        return n if n is not None else rng.randint(low, high)
+
+    def path_list(n):
+        return ':'.join('/' + '/'.join(rng.choices(words, k=rng.randint(2, 6))) for _ in range(n))
+
+    env_vars = {}
+    for i in range(n_vars):
+        if i % 10 == 0:
+            env_vars[f"PATH_LIKE_{i}"] = path_list(size(list_length, 5, 40))
+        else:
+            env_vars[f"VAR_{i}"] = ' '.join(rng.choices(words, k=rng.randint(1, 8)))
+    shell_vars = {f"_shell_var_{i}": str(rng.randint(0, 10**6)) for i in range(n_vars // 3)}
+
+    functions = {}
+    for i in range(n_functions):
+        body = ["{ "]
+        for _ in range(size(function_lines, 3, 40)):
+            body.append(f"    {rng.choice(words)} \"${{{rng.choice(words)}}}\" {' '.join(rng.choices(words, k=rng.randint(0, 6)))};")
+        body.append("}")
+        functions[f"{rng.choice(words)}_func_{i}"] = body
+
+    normal_arrays = {f"ARRAY_{i}": {str(k): rng.choice(words) for k in range(size(array_size, 0, 50))} for i in range(n_arrays)}
+    assoc_arrays = {f"ASSOC_{i}": {rng.choice(words) + str(k): path_list(2) for k in range(size(array_size, 0, 30))} for i in range(n_arrays // 2)}
+
+    if real_options:
+        shopt = {o: rng.choice(["on", "off"]) for o in SHOPT}
+        shopt['expand_aliases'] = 'off'
+        shopt_set = {o: rng.choice(["on", "off"]) for o in SHOPT_SET}
+    else:
+        shopt = {f"opt{i}": rng.choice(["on", "off"]) for i in range(50)}
+        shopt_set = {f"setopt{i}": rng.choice(["on", "off"]) for i in range(30)}
+    if n_traps is None:
+        traps = {"EXIT": "cleanup", "SIGINT": "echo interrupted"}
+    else:
+        traps = {s: f": {s.lower()}" for s in SIGNALS[:n_traps]}
+
+    return {
+        'env_vars': env_vars,
+        'shell_vars': shell_vars,
+        'assoc_arrays': assoc_arrays,
+        'normal_arrays': normal_arrays,
+        'shopt': shopt,
+        'shopt_set': shopt_set,
+        'functions': functions,
+        'traps': traps,
+    }
+
+def modified(components, fraction=0.1, seed=0):
+    """
+    Return a copy of components (see environment()) where a fraction of the
+    variables, functions and arrays are deleted or changed and half as many
+    are added.  A changed array loses a third of its elements and gets five
+    new ones.  The same fraction of options is flipped.
+    """
+    rng = random.Random(seed)
+    result = copy.deepcopy(components)
+    for component in ('env_vars', 'shell_vars', 'functions', 'normal_arrays', 'assoc_arrays'):
+        entries = result[component]
+        names = sorted(entries)
+        for name in rng.sample(names, int(len(names) * fraction)):
+            if rng.random() < 0.3:
+                del entries[name]
+            elif component == 'functions':
+                entries[name] = entries[name][:-1] + ["    echo changed;", "}"]
+            elif component.endswith('arrays'):
+                value = dict(entries[name])
+                for k in rng.sample(sorted(value), len(value) // 3):
+                    del value[k]
+                value.update({str(k): f"new{k}" for k in range(len(value), len(value) + 5)})
+                entries[name] = value
+            else:
+                entries[name] += ":changed"
+        for i in range(int(len(names) * fraction / 2)):
+            entries[f"new_{component}_{i}"] = components[component][names[i]]
+    for component in ('shopt', 'shopt_set'):
+        options = sorted(o for o in result[component] if o != 'expand_aliases')
+        for o in rng.sample(options, max(1, int(len(options) * fraction))):
+            result[component][o] = 'off' if result[component][o] == 'on' else 'on'
+    return result
+
+def best_time(func, repeat, setup=lambda: None):
+    """
+    Shortest time in seconds of repeat calls of func, setup being called
+    before each of them outside of the timing
+    """
+    best = float('inf')
+    for _ in range(repeat):
+        setup()
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
@@ -1,9 +1,10 @@
 import logging
 import shlib
+import envdiff
 
 # The config file is not read for code generation.  Only a hardcoded list of
 # variables.  We also ignore all _env_diff* variables.  The user has no say
-# in this.
+# in this.  See diff_config().
 special_vars = [
         "EPOCHSECONDS",
         "SECONDS",
@@ -32,34 +33,69 @@ special_vars = [
         "BASH_VERSINFO"
 ]
 
+def diff_config():
+    """
+    DiffConfig leaving out the special variables and the variables and
+    functions of env-diff itself for which no code is generated
+    """
+    variables = special_vars + ["_env_diff_*"]
+    return envdiff.DiffConfig({
+        'env_vars': variables,
+        'shell_vars': variables,
+        'normal_arrays': variables,
+        'assoc_arrays': variables,
+        'functions': ["_env-diff*", "env-diff*"],
+    })
+
 
 class ShCodeGenerator:
-    def __init__(self, output):
+    """
+    Writes the shell code to output.  The fragments are collected and written
+    all at once by flush().
+
+    With compact=True, the code is made faster to source: new arrays are
+    declared with a single compound assignment, changed arrays are updated
+    with one '+=(...)' and one 'unset', the shopt and set options and the
+    variables and functions to unset are grouped in one command each, and
+    the comments are left out.
+    """
+    def __init__(self, output, compact=False):
         self.output = output
+        self.compact = compact
+        self._parts = []
+
+    def write(self, code):
+        self._parts.append(code)
+
+    def flush(self):
+        self.output.write(''.join(self._parts))
+        self._parts = []
 
     def set_var(self, name: str, value: str):
-        if name.startswith("_env_diff_"):
-            logging.debug(f"Not unsetting variable {name} starting with '_env_diff_'")
-            return
-        if name in special_vars:
-            return
-        self.output.write(f"{name}={shlib.quote_arg(value)}\n")
+        self.write(f"{name}={shlib.quote_arg(value)}\n")
 
     def set_env_var(self, name, value):
-        if name in special_vars:
-            return
-        self.output.write(f"export {name}={shlib.quote_arg(value)}\n")
+        self.write(f"export {name}={shlib.quote_arg(value)}\n")
 
     def unexport_var(self, name):
-        self.output.write(f"export -n {name}\n")
+        self.write(f"export -n {name}\n")
+
+    def unexport_vars(self, names):
+        if self.compact:
+            if names:
+                self.write(f"export -n {' '.join(names)}\n")
+        else:
+            for name in names:
+                self.unexport_var(name)
 
     def set_func(self, name, value):
-        if name.startswith("_env-diff") or name.startswith("env-diff"):
-            logging.debug(f"Not setting env-diff function {name}")
-            return
-        self.output.write(name + "()")
-        self.output.write('\n'.join(value))
-        self.output.write('\n')
+        self.write(name + "()")
+        self.write('\n'.join(value))
+        self.write('\n')
+
+    def _compound(self, value):
+        """ Elements of value as they go in '(...)' """
+        return ' '.join(f"[{shlib.quote_arg(k)}]={shlib.quote_arg(v)}" for k, v in value)
 
     def change_array(self, name, i, f):
         """
@@ -88,92 +124,145 @@ class ShCodeGenerator:
            | <nothing>
            | $ alias x
            | bash: alias: x: not found
+
+        In compact mode, the keys are still set and unset one by one but with
+        one 'name+=(...)' and one 'unset' (or 'unalias') for all of them.
+        BASH_ALIASES keeps one assignment per key so that each one goes
+        through the alias code.
         """
-        if name in special_vars:
-            logging.debug(f"Array {name} cannot be changed, skipping")
+        d = envdiff.EnvComponentDiff(i, f)
+        changed = sorted(d.new | d.changed)
+        deleted = sorted(d.deleted)
+        if not self.compact:
+            for k in changed:
+                self.write(f"{name}[{k}]={shlib.quote_arg(f[k])}\n")
+            for k in deleted:
+                if name == "BASH_ALIASES":
+                    self.write(f"unalias {k}\n")
+                else:
+                    self.write(f"unset {name}[{k}]\n")
             return
-        new = set(f.keys()) - set(i.keys())
-        common = set(i.keys()).intersection(set(f.keys()))
-        changed = set(filter(lambda v: i[v] != f[v], common))
-
-        for k in sorted(new.union(changed)):
-            self.output.write(f"{name}[{k}]={shlib.quote_arg(f[k])}\n")
-        deleted = set(i.keys()) - set(f.keys())
-        for k in sorted(deleted):
-            if name == "BASH_ALIASES":
-                self.output.write(f"unalias {k}\n")
-            else:
-                self.output.write(f"unset {name}[{k}]\n")
 
-    def set_normal_array(self, name, value):
-        if name in special_vars:
-            logging.debug(f"Not setting special variable {name}")
+        if name == "BASH_ALIASES":
+            for k in changed:
+                self.write(f"{name}[{shlib.quote_arg(k)}]={shlib.quote_arg(f[k])}\n")
+            if deleted:
+                self.write(f"unalias {' '.join(shlib.quote_arg(k) for k in deleted)}\n")
             return
-        self.output.write(f"declare -a {name}\n")
+        if changed:
+            self.write(f"{name}+=({self._compound((k, f[k]) for k in changed)})\n")
+        if deleted:
+            self.write(f"unset {' '.join(shlib.quote_arg(f'{name}[{k}]') for k in deleted)}\n")
+
+    def set_normal_array(self, name, value):
         if isinstance(value, list):
             raise RuntimeError("This shouldn't happen because regular arrays are saved as dictionaries too")
-            for i,v in enumerate(sorted(value)):
-                self.output.write(f"{name}[i]={shlib.quote_arg(v)}\n")
-        elif isinstance(value, dict):
-            for k,v in sorted(value).items():
-                self.output.write(f"{name}[{k}]={shlib.quote_arg(v)}\n")
-        else:
+        elif not isinstance(value, dict):
             raise RuntimeError("Normal array value is not list or dict")
+        elements = sorted(value.items(), key=lambda kv: int(kv[0]))
+        if self.compact:
+            self.write(f"declare -ga {name}=({self._compound(elements)})\n")
+            return
+        self.write(f"declare -ga {name}\n")
+        for k,v in elements:
+            self.write(f"{name}[{k}]={shlib.quote_arg(v)}\n")
 
     def set_assoc_array(self, name, value):
         # Unset it first since the difference could be that a normal array
         # became an associative array.
         self.unset_var(name)
-        self.output.write(f"declare -A {name}\n")
-        for k,v in sorted(value).items():
-            self.output.write(f"{name}[{k}]={shlib.quote_arg(v)}\n")
+        if self.compact:
+            self.write(f"declare -gA {name}=({self._compound(sorted(value.items()))})\n")
+            return
+        self.write(f"declare -gA {name}\n")
+        for k,v in sorted(value.items()):
+            self.write(f"{name}[{k}]={shlib.quote_arg(v)}\n")
 
     def set_shopt_option(self, name, value):
         if value == "on":
-            self.output.write(f"shopt -s {name}\n")
+            self.write(f"shopt -s {name}\n")
         elif value == "off":
-            self.output.write(f"shopt -u {name}\n")
+            self.write(f"shopt -u {name}\n")
+
+    def set_shopt_options(self, options, flag=""):
+        """
+        Set the options of the dictionary options of names to 'on' or 'off'
+        with 'shopt -s' or 'shopt -u' (with flag 'o' for set options)
+        """
+        if not self.compact:
+            for name in sorted(options):
+                if options[name] == "on":
+                    self.write(f"shopt -s{flag} {name}\n")
+                elif options[name] == "off":
+                    self.write(f"shopt -u{flag} {name}\n")
+            return
+        for value, switch in (("on", "-s"), ("off", "-u")):
+            names = sorted(n for n, v in options.items() if v == value)
+            if names:
+                self.write(f"shopt {switch}{flag} {' '.join(names)}\n")
+
+    def save_shopt_option(self, name):
+        """
+        Remember the current state of a shopt option in the shell where the
+        code is sourced for when its final state is not known.
+        """
+        self.write(f"if shopt -q {name} ; then _env_diff_shopt_{name}=on ; else _env_diff_shopt_{name}=off ; fi\n")
+
+    def restore_shopt_option(self, name):
+        self.write(f"if [[ ${{_env_diff_shopt_{name}}} == on ]] ; then shopt -s {name} ; fi\n")
+        self.write(f"unset _env_diff_shopt_{name}\n")
 
     def set_set_option(self, name, value):
         if value == "on":
-            self.output.write(f"shopt -so {name}\n")
+            self.write(f"shopt -so {name}\n")
         elif value == "off":
-            self.output.write(f"shopt -uo {name}\n")
+            self.write(f"shopt -uo {name}\n")
 
     def set_trap(self, name, value):
-        self.output.write(f"trap -- {shlib.quote_arg(value)} {name}\n")
+        self.write(f"trap -- {shlib.quote_arg(value)} {name}\n")
 
     def unset_var(self, name):
-        if name.startswith("_env_diff_"):
-            logging.debug(f"Not unsetting variable {name} starting with '_env_diff_'")
-            return
-        if name in special_vars:
-            logging.debug(f"Not unsetting special variable {name}")
-            return
-        self.output.write(f"unset {name}\n")
+        self.write(f"unset {name}\n")
+
+    def unset_vars(self, names):
+        if self.compact:
+            if names:
+                self.write(f"unset {' '.join(names)}\n")
+        else:
+            for name in names:
+                self.unset_var(name)
 
     def unset_func(self, name):
-        if name.startswith("_env-diff") or name.startswith("env-diff"):
-            logging.debug(f"Not unsetting env-diff function {name}")
-            return
-        self.output.write(f"unset -f {name}\n")
+        self.write(f"unset -f {name}\n")
+
+    def unset_funcs(self, names):
+        if self.compact:
+            if names:
+                self.write(f"unset -f {' '.join(names)}\n")
+        else:
+            for name in names:
+                self.unset_func(name)
 
     def unset_trap(self, name):
-        self.output.write(f"trap - {name}\n")
+        self.write(f"trap - {name}\n")
 
     def comment(self, comment):
+        if self.compact:
+            return
         lines = comment.splitlines()
         for l in lines:
-            self.output.write(f"# {l}\n")
+            self.write(f"# {l}\n")
 
     def box(self, comment):
-        self.output.write('\n')
-        self.output.write(80*"#" + "\n")
+        if self.compact:
+            return
+        self.write('\n')
+        self.write(80*"#" + "\n")
         self.comment(comment)
-        self.output.write(80*"#" + "\n")
+        self.write(80*"#" + "\n")
 
 
-def gencode(diff, output):
+def gencode(diff, output, compact=False):
     """
     For the purposes of code generation, it is important to consider all
     components together because if the only difference is exporting a variable,
@@ -191,21 +280,29 @@ def gencode(diff, output):
     uses the *_moved() functions to unset a variable only if it doesn't move
     to another component.  And in the case of an environment variable moving
     to another component, we unexport it.
+
+    When the diff was computed for only some components, a variable moving to
+    a component that was not compared is seen as deleted.  The diff should be
+    computed with diff_config() so that no code is generated for the special
+    variables and for env-diff itself.
+
+    With compact=True, the code is written in the compact form of
+    ShCodeGenerator which is faster to source.
     """
 
     logging.debug("Generating code")
-    gen = ShCodeGenerator(output)
+    gen = ShCodeGenerator(output, compact=compact)
 
     gen.comment("Apply environment changes")
 
     gen.box("ENVIRONMENT VARIABLES")
     gen.comment("Deleted env vars")
-    for name in sorted(diff.env_vars.deleted):
-        if diff.deleted_env_var_moved(name):
-            output.write(f"# variable {name} is in another section, don't unset, just unexport\n")
-            gen.unexport_var(name)
-        else:
-            gen.unset_var(name)
+    deleted = sorted(diff.env_vars.deleted)
+    moved = [name for name in deleted if diff.deleted_env_var_moved(name)]
+    for name in moved:
+        gen.comment(f"variable {name} is in another section, don't unset, just unexport")
+    gen.unexport_vars(moved)
+    gen.unset_vars([name for name in deleted if name not in moved])
     gen.comment("New env vars")
     for name in sorted(diff.env_vars.new):
         gen.set_env_var(name, diff.env_vars.final[name])
@@ -215,9 +312,7 @@ def gencode(diff, output):
 
     gen.box("SHELL VARIABLES")
     gen.comment("Deleted variables")
-    for name in sorted(diff.shell_vars.deleted):
-        if not diff.deleted_shell_var_moved(name):
-            gen.unset_var(name)
+    gen.unset_vars([name for name in sorted(diff.shell_vars.deleted) if not diff.deleted_shell_var_moved(name)])
     gen.comment("New variables")
     for name in sorted(diff.shell_vars.new):
         gen.set_var(name, diff.shell_vars.final[name])
@@ -238,36 +333,40 @@ def gencode(diff, output):
         gen.change_array(name, diff.normal_arrays.initial[name], diff.normal_arrays.final[name])
 
     gen.box("ASSOC ARRAYS")
-    for name in sorted(diff.assoc_arrays.deleted):
-        if not diff.deleted_assoc_array_moved(name):
-            gen.unset_var(name)
+    gen.unset_vars([name for name in sorted(diff.assoc_arrays.deleted) if not diff.deleted_assoc_array_moved(name)])
     for name in sorted(diff.assoc_arrays.new):
         gen.set_assoc_array(name, diff.assoc_arrays.final[name])
     for name in sorted(diff.assoc_arrays.changed):
         gen.change_array(name, diff.assoc_arrays.initial[name], diff.assoc_arrays.final[name])
 
     gen.box("FUNCTIONS")
-    gen.comment("Option expand_aliases must be off for function part")
-    gen.comment("in case the name of the function is an alias")
-    gen.set_shopt_option("expand_aliases", "off")
-    for name in sorted(diff.functions.deleted):
-        gen.unset_func(name)
-    for name in sorted(diff.functions.new):
-        gen.comment(f"Setting function {name}")
-        gen.set_func(name, diff.functions.final[name])
-    for name in sorted(diff.functions.changed):
-        gen.set_func(name, diff.functions.final[name])
-    if diff.shopt.final['expand_aliases'] == 'on' and 'expand_aliases' not in diff.shopt.changed:
-        gen.set_shopt_option("expand_aliases", "on")
+    if 'functions' in diff.components:
+        gen.comment("Option expand_aliases must be off for function part")
+        gen.comment("in case the name of the function is an alias")
+        if 'shopt' not in diff.components:
+            gen.save_shopt_option("expand_aliases")
+        gen.set_shopt_option("expand_aliases", "off")
+        gen.unset_funcs(sorted(diff.functions.deleted))
+        for name in sorted(diff.functions.new):
+            gen.comment(f"Setting function {name}")
+            gen.set_func(name, diff.functions.final[name])
+        for name in sorted(diff.functions.changed):
+            gen.set_func(name, diff.functions.final[name])
+        if 'shopt' not in diff.components:
+            gen.restore_shopt_option("expand_aliases")
+        elif diff.shopt.final['expand_aliases'] == 'on' and 'expand_aliases' not in diff.shopt.changed:
+            gen.set_shopt_option("expand_aliases", "on")
 
     gen.box("Shopt options")
-    for opt in sorted(diff.shopt.changed):
-        gen.set_shopt_option(opt, diff.shopt.final[opt])
+    gen.set_shopt_options({opt: diff.shopt.final[opt] for opt in diff.shopt.changed})
 
     gen.box("Set options")
-    for opt in sorted(diff.shopt_set.changed):
-        gen.set_set_option(opt, diff.shopt_set.final[opt])
+    gen.set_shopt_options({opt: diff.shopt_set.final[opt] for opt in diff.shopt_set.changed}, flag="o")
 
     gen.box("TRAPS")
+    for name in sorted(diff.traps.deleted):
+        gen.unset_trap(name)
     for name in sorted(diff.traps.changed.union(diff.traps.new)):
         gen.set_trap(name, diff.traps.final[name])
+
+    gen.flush()
@@ -0,0 +1,145 @@
+"""
+Saved environments stored as the difference with a previous one
+
+A delta holds only the entries that were added, deleted or changed relative to
+its base environment in the sense of envdiff.EnvComponentDiff:
+
+    envdiff-delta VERSION
+    {"base": PATH, "components": {COMPONENT: DIGEST},
+     "changes": {COMPONENT: {"set": {NAME: VALUE}, "deleted": [NAME]}}}
+
+PATH is relative to the directory containing the delta if the base was given
+as a relative path.  Only the digests of components are stored, those of
+entries are computed from the digests of the base (see envdiff.compute_digests)
+and the changes.  The base can itself be a delta.  Loading a component
+loads it from the base and applies the changes so the length of a chain of
+deltas is limited by max_depth().  When saving a delta would make the chain
+longer than that, a complete snapshot is written instead.
+"""
+import json
+import os
+
+import envdiff
+import snapshot
+
+MAGIC = b"envdiff-delta"
+VERSION = 1
+DEFAULT_MAX_DEPTH = 16
+
+def max_depth():
+    """ Maximum number of deltas in a chain (ENV_DIFF_MAX_DELTA_DEPTH) """
+    try:
+        return int(os.environ.get('ENV_DIFF_MAX_DELTA_DEPTH', DEFAULT_MAX_DEPTH))
+    except ValueError:
+        raise ValueError(f"ENV_DIFF_MAX_DELTA_DEPTH must be an integer, not '{os.environ['ENV_DIFF_MAX_DELTA_DEPTH']}'")
+
+class DeltaFile:
+    """
+    Read access to an environment saved as a delta.  The depth is the number of
+    deltas between this one and the environment that was given to
+    open_snapshot().
+    """
+    def __init__(self, path, depth=0):
+        if depth >= max_depth():
+            raise envdiff.EnvDiffError(path, f"its base: more than {max_depth()} deltas in the chain (see ENV_DIFF_MAX_DELTA_DEPTH)")
+        self.path = path
+        self.depth = depth
+        with open(path, 'rb') as f:
+            magic, _, version = f.readline().rstrip(b'\n').partition(b' ')
+            if magic != MAGIC or not version.isdigit():
+                raise envdiff.EnvDiffError(path, "delta header")
+            if int(version) > VERSION:
+                raise envdiff.EnvDiffError(path, f"support for delta version {int(version)} (this version of env-diff reads up to {VERSION})")
+            try:
+                contents = json.loads(f.read())
+            except ValueError:
+                raise envdiff.EnvDiffError(path, "delta contents")
+        self.base_path = os.path.join(os.path.dirname(path), contents['base'])
+        self.changes = contents['changes']
+        self.component_digests = contents['components']
+        self._digests = False
+        self._base = None
+
+    def base(self):
+        if self._base is None:
+            self._base = envdiff.open_snapshot(self.base_path, depth=self.depth + 1)
+        return self._base
+
+    def chain_length(self):
+        """ Number of deltas in the chain starting with this one """
+        base = self.base()
+        return 1 + (base.chain_length() if isinstance(base, DeltaFile) else 0)
+
+    def digests(self):
+        if self._digests is False:
+            self._digests = None
+            base = self.base().digests()
+            if base is not None:
+                entries = {}
+                for c in envdiff.COMPONENTS:
+                    entries[c] = dict(base['entries'][c])
+                    for name in self.changes[c]['deleted']:
+                        del entries[c][name]
+                    entries[c].update({name: envdiff.digest(envdiff.canonical_json(value))
+                                       for name, value in self.changes[c]['set'].items()})
+                self._digests = {'components': self.component_digests, 'entries': entries}
+        return self._digests
+
+    def load(self, component):
+        # The base may cache what it returns
+        value = dict(self.base().load(component))
+        changes = self.changes[component]
+        for name in changes['deleted']:
+            del value[name]
+        value.update(changes['set'])
+        return value
+
+
+def write_delta(source_path, base_path, path):
+    """
+    Write the environment saved at source_path as a delta relative to the one
+    saved at base_path.  If that would make a chain longer than max_depth(), a
+    complete snapshot is written instead.  Return True if a delta was written.
+    """
+    base = envdiff.open_snapshot(base_path)
+    if isinstance(base, DeltaFile) and base.chain_length() + 1 > max_depth():
+        snapshot.pack(source_path, path)
+        return False
+
+    diff = envdiff.ShellEnvironmentDiff(envdiff.ShellEnvironmentData(base_path), envdiff.ShellEnvironmentData(source_path))
+    source = envdiff.open_snapshot(source_path)
+    changes = {}
+    for c in envdiff.COMPONENTS:
+        d = getattr(diff, c)
+        changed = d.new | d.changed
+        changes[c] = {
+            'set': {name: d.final[name] for name in sorted(changed)},
+            'deleted': sorted(d.deleted),
+        }
+
+    if not os.path.isabs(base_path):
+        base_path = os.path.relpath(base_path, os.path.dirname(path) or '.')
+    contents = {
+        'base': base_path,
+        'components': (source.digests() or envdiff.compute_digests(source))['components'],
+        'changes': changes,
+    }
+    tmp = f"{path}.tmp{os.getpid()}"
+    try:
+        with open(tmp, 'wb') as f:
+            f.write(MAGIC + f" {VERSION}\n".encode('utf-8'))
+            f.write(json.dumps(contents, separators=(',', ':')).encode('utf-8'))
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+        raise
+    return True
+
+
+def compact(path, codec=None):
+    """
+    Replace the delta at path by a complete snapshot of the same environment.
+    Deltas using it as their base are not affected.
+    """
+    snapshot.pack(path, path, codec=codec)
@@ -0,0 +1,106 @@
+"""
+Size bounded cache of files in ~/.cache/env-diff
+
+Each entry is a file named by its key, a hexadecimal digest, in a
+subdirectory named by the first two characters of the key.  Entries are
+written to a temporary file that is renamed into place so that processes
+writing the same entry at the same time and processes reading it never see
+a partial file.  Reading an entry updates its modification time and when
+the entries written by a process may have made the cache bigger than its
+maximum size, close() removes the least recently used entries until the cache
+is at three quarters of its maximum size.
+"""
+import os
+
+def cache_home():
+    """ Directory of the caches of env-diff ($XDG_CACHE_HOME/env-diff) """
+    return os.path.join(os.environ.get('XDG_CACHE_HOME') or os.path.expanduser("~/.cache"), "env-diff")
+
+class DiskCache:
+    def __init__(self, directory, max_size):
+        self.directory = directory
+        self.max_size = max_size
+        self.written = 0
+
+    def path(self, key):
+        return os.path.join(self.directory, key[:2], key[2:])
+
+    def get(self, key):
+        """ Contents of the entry key or None """
+        path = self.path(key)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except OSError:
+            return None
+        try:
+            os.utime(path)
+        except OSError:
+            # Removed by another process since it was read
+            pass
+        return data
+
+    def put(self, key, data: bytes):
+        path = self.path(key)
+        tmp = f"{path}.tmp{os.getpid()}"
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(tmp, 'wb') as f:
+                f.write(data)
+            os.replace(tmp, path)
+            self.written += len(data)
+        except OSError:
+            # The cache is only an optimization
+            try:
+                os.unlink(tmp)
+            except OSError:
+                pass
+
+    def entries(self):
+        """ List of (mtime, size, path) of all entries """
+        result = []
+        try:
+            shards = os.scandir(self.directory)
+        except OSError:
+            return result
+        with shards:
+            for shard in shards:
+                if not shard.is_dir():
+                    continue
+                with os.scandir(shard.path) as files:
+                    for f in files:
+                        if '.tmp' in f.name:
+                            continue
+                        try:
+                            st = f.stat()
+                        except OSError:
+                            continue
+                        result.append((st.st_mtime, st.st_size, f.path))
+        return result
+
+    def evict(self):
+        """
+        Remove the least recently used entries if the cache is bigger than its
+        maximum size.  Return the number of entries removed.
+        """
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        if total <= self.max_size:
+            return 0
+        removed = 0
+        for _, size, path in sorted(entries):
+            if total <= self.max_size * 3 // 4:
+                break
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+            total -= size
+            removed += 1
+        return removed
+
+    def close(self):
+        """ Evict entries if something was written """
+        if self.written:
+            self.written = 0
+            self.evict()
@@ -0,0 +1,24 @@
+"""
+Run one of the python scripts of env-diff through the server started with
+'env-diff-server start' or directly if the server is not running.
+
+    env-diff-client.py SCRIPT ARGS...
+"""
+import os
+import sys
+
+import server
+
+def main():
+    if len(sys.argv) < 2 or os.path.basename(sys.argv[1]) not in server.SCRIPTS:
+        print(f"usage: {sys.argv[0]} {{{','.join(server.SCRIPTS)}}} ARGS...", file=sys.stderr)
+        return 2
+    script = os.path.join(server.ROOT, os.path.basename(sys.argv[1]))
+    argv = [script] + sys.argv[2:]
+    status = server.run(os.path.basename(script), argv)
+    if status is server.NOT_HANDLED:
+        os.execv(sys.executable, [sys.executable] + argv)
+    return status
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -34,12 +34,21 @@ _env-diff-short_help(){
 
 		OPTIONS
 		    --list-diff             Use diff for list comparison
+		    --list-format FORMAT    Show lists as 'changes' (default), 'set'
+		                            or 'diff' (the default used to be 'set')
 		    --no-ignore             Bypass ignoring of variables
 		    -F CONFIG FILE          Use alternate config file
+		    --only COMPONENTS       Only compare some components (ex: env,functions)
+		    --format FORMAT         Output 'text' (default), 'json' or 'ndjson'
 		    --keep-tmpdir           Do not delete temp dir after running
 		    --local-tmpdir          Create temp dir in PWD
+		    --capture MODE          Capture variables with 'compgen' (default)
+		                            or 'declare'
+		    --parallel              Convert saved components concurrently
 		    --help                  Display manpage for env-diff
 		    --show-function-bodies  Show code of modified/added functions
+		    --timings FILE          Write the time of each phase to FILE as
+		                            JSON and a summary on stderr
 		    -h                      Display this help text and exit
 	EOF
 }
@@ -63,6 +72,10 @@ env-diff(){
     local _env_diff_cat=""
     local _env_diff_mkdir=""
     local _env_diff_jq_length_str=""
+    local _env_diff_capture=${ENV_DIFF_CAPTURE:-compgen}
+    local _env_diff_parallel=${ENV_DIFF_PARALLEL:-false}
+    local _env_diff_timings=${ENV_DIFF_TIMINGS:-}
+    local _env_diff_timings_log=${_env_diff_timings_log:-}
     local _env_diff_the_cmd
 
     if ! _env-diff-setup ; then
@@ -72,12 +85,18 @@ env-diff(){
     while [[ "$1" == -* ]] ; do
         case "$1" in
             --list-diff) _env_diff_compare_args+=(--list-diff); shift ;;
+            --list-format) _env_diff_compare_args+=(--list-format $2); shift ; shift ;;
             --no-ignore) _env_diff_compare_args+=(--no-ignore); shift ;;
             -F)          _env_diff_compare_args+=(-F $2); shift ; shift ;;
+            --only)      _env_diff_compare_args+=(--only $2); shift ; shift ;;
+            --format)    _env_diff_compare_args+=(--format $2); shift ; shift ;;
             --keep-tmpdir) _env_diff_keep_tmpdir=true ; shift ;;
             --local-tmpdir) _env_diff_local_tmpdir=true ; shift ;;
+            --capture) _env_diff_capture=$2 ; shift ; shift ;;
+            --parallel) _env_diff_parallel=true ; shift ;;
             --help) man ${_env_diff_root}/manpages/env-diff.1 ; return 0 ;;
             --show-function-bodies) _env_diff_compare_args+=(--show-function-bodies) ; shift ;;
+            --timings) _env_diff_timings=$2 ; shift ; shift ;;
             -h) _env-diff-short_help ; return 0 ;;
             --) shift ; break ;;
             *) _env_diff_log ERROR "unknown argument '$1'"
@@ -95,7 +114,9 @@ env-diff(){
     fi
     _env_diff_log INFO "tmpdir in '${_env_diff_tmpdir}'"
 
+    _env-diff-timings_start || return 1
     _env-diff-internal
+    _env-diff-timings_finish
 
     if ! ${_env_diff_keep_tmpdir} ; then
         local cmd=(rm -rf "${_env_diff_tmpdir}")
@@ -107,7 +128,7 @@ env-diff(){
 env-diff-gencode(){
     if [[ $1 == -h ]] ; then
         cat <<-EOF
-			usage: ${FUNCNAME[0]} [-h|--help] [--debug] [--output FILE] BEFORE AFTER
+			usage: ${FUNCNAME[0]} [-h|--help] [--debug] [--output FILE] [--only COMPONENTS] [--store STORE] [--compact] [--timings FILE] BEFORE AFTER
 
 			    Generate shell code to go from environment BEFORE to environment AFTER
 			    where BEFORE and AFTER are directories created with env-diff-save.
@@ -118,6 +139,11 @@ env-diff-gencode(){
 			    --help            Show manpage
 			    --debug           Set log level to debug
 			    --output FILE     Set ouput to FILE (default is STDOUT)
+			    --only COMPONENTS Only generate code for some components
+			                      (ex: env,functions)
+			    --store STORE     BEFORE and AFTER are names of snapshots in STORE
+			    --compact         Generate code that is faster to source
+			    --timings FILE    Write the time of each phase to FILE
 		EOF
         return
     elif [[ $1 == --help ]] ; then
@@ -126,13 +152,13 @@ env-diff-gencode(){
     fi
 
     local _env_diff_cmd=env-diff-gencode
-    env _env_diff_cmd=${_env_diff_cmd} python3 ${_env_diff_root}/env-diff-generate-code.py "$@"
+    _env-diff-python env-diff-generate-code.py "$@"
 }
 
 env-diff-load(){
     if [[ $1 == -h ]] ; then
         cat <<-EOF
-			usage: ${FUNCNAME[0]} [-h|--help] [--debug] DIR
+			usage: ${FUNCNAME[0]} [-h|--help] [--debug] [--direct] DIR
 
 			    Load environment DIR where DIR is a saved environment created
 			    with env-diff-save
@@ -142,6 +168,9 @@ env-diff-load(){
 			    -h                Print short help
 			    --help            Show manpage
 			    --debug           Set log level to debug
+			    --direct          Source DIR/restore.bash written by
+			                      'env-diff-save --restore DIR' without
+			                      running python3
 		EOF
         return
     elif [[ $1 == --help ]] ; then
@@ -149,6 +178,32 @@ env-diff-load(){
         return
     fi
     local _env_diff_cmd=env-diff-load
+    local _env_diff_timings=${ENV_DIFF_TIMINGS:-}
+    local _env_diff_timings_log=${_env_diff_timings_log:-}
+
+    _env-diff-timings_start || return 1
+    _env-diff-load_from "$@"
+    local _env_diff_status=$?
+    _env-diff-timings_finish
+    return ${_env_diff_status}
+}
+
+_env-diff-load_from(){
+    # restore.bash uses ${NAME@a} and 'local -' of bash 4.4
+    if [[ $1 == --direct ]] && (( BASH_VERSINFO[0] * 100 + BASH_VERSINFO[1] < 404 )) ; then
+        shift
+        _env_diff_log WARNING "bash 4.4 or newer is needed to source '$1/restore.bash', generating the code to load '$1' instead"
+    elif [[ $1 == --direct ]] ; then
+        shift
+        if [[ ! -f "$1/restore.bash" ]] ; then
+            _env_diff_log ERROR "No '$1/restore.bash': save the environment with 'env-diff-save --restore $1'"
+            return 1
+        fi
+        _env-diff-timings begin source
+        source "$1/restore.bash"
+        _env-diff-timings end source
+        return
+    fi
 
     local _env_diff_tmpdir=$(mktemp -d tmp.env-diff-load.XXXXXX) || return 1
     _env_diff_log INFO "Using tmpdir=${_env_diff_tmpdir} to save current environment"
@@ -160,8 +215,12 @@ env-diff-load(){
         _env_diff_log DEBUG "sourcing ${_env_diff_tmpdir}/to_source"
         source ${_env_diff_tmpdir}/to_source
     else
-        env-diff-gencode "${_env_diff_tmpdir}/current" "$1" > ${_env_diff_tmpdir}/to_source
+        _env-diff-timings begin gencode
+        env-diff-gencode --compact "${_env_diff_tmpdir}/current" "$1" > ${_env_diff_tmpdir}/to_source
+        _env-diff-timings end gencode
+        _env-diff-timings begin source
         source ${_env_diff_tmpdir}/to_source
+        _env-diff-timings end source
         _env_diff_log INFO "Deleting tmpdir=${_env_diff_tmpdir}"
         rm -rf "${_env_diff_tmpdir}"
     fi
@@ -176,23 +235,29 @@ _env-diff-internal(){
     if ! (
         # Save initial info inside the same subshell as where we run the command
         # for variables like BASHPID and BASH_SUBSHELL to be the same
+        _env-diff-timings begin save_before
         ${_env_diff_mkdir} ${_env_diff_tmpdir}/before || return 1
         if ! _env-diff-save_all_info ${_env_diff_tmpdir}/before ; then
             _env_diff_log ERROR "saving initial info"
             return 1
         fi
+        _env-diff-timings end save_before
 
         _env_diff_log INFO "Running command '${_env_diff_the_cmd[*]}'"
+        _env-diff-timings begin command
         # See Notes/eval-command/ about why we don't just do 'eval "$@"'
         if ! eval "${_env_diff_the_cmd[@]}" ; then
             _env_diff_log INFO "Command '${_env_diff_the_cmd[*]}' returned non-zero return code"
         fi
+        _env-diff-timings end command
 
+        _env-diff-timings begin save_after
         ${_env_diff_mkdir} -p ${_env_diff_tmpdir}/after || return 1
         if ! _env-diff-save_all_info ${_env_diff_tmpdir}/after ; then
             _env_diff_log ERROR "saving final info"
             return 1
         fi
+        _env-diff-timings end save_after
 
         #
         # Deactivate the exit trap (only affects this subshell).  Normally
@@ -208,12 +273,50 @@ _env-diff-internal(){
 
     ) ; then return 1 ; fi
 
-    if ! ${_env_diff_python3} ${_env_diff_root}/env-diff-compare.py \
+    _env-diff-timings begin compare
+    if ! _env-diff-python env-diff-compare.py \
             "${_env_diff_compare_args[@]}" \
             "${_env_diff_tmpdir}/before" "${_env_diff_tmpdir}/after" ; then
         _env_diff_log ERROR "in python comparison script"
         return 1
     fi
+    _env-diff-timings end compare
+}
+
+env-diff-snapshot(){
+    local _env_diff_cmd=env-diff-snapshot
+    if [[ $1 == --help ]] ; then
+        man ${_env_diff_root}/manpages/env-diff-snapshot.1
+        return
+    fi
+    env _env_diff_cmd=${_env_diff_cmd} python3 ${_env_diff_root}/env-diff-snapshot.py "$@"
+}
+
+env-diff-server(){
+    local _env_diff_cmd=env-diff-server
+    if [[ $1 == --help ]] ; then
+        man ${_env_diff_root}/manpages/env-diff-server.1
+        return
+    fi
+    env _env_diff_cmd=${_env_diff_cmd} python3 ${_env_diff_root}/env-diff-server.py "$@"
+}
+
+################################################################################
+# Run the python script $1 of env-diff with the arguments ${@:2}.  With
+# ENV_DIFF_SERVER=true, it is run by the server started with
+# 'env-diff-server start' if there is one and directly otherwise.
+################################################################################
+_env-diff-python(){
+    local _env_diff_script=$1 ; shift
+    # Without the _env-diff-timings_exec that 'env' could not run
+    local _env_diff_python=${_env_diff_python3:-python3}
+    _env_diff_python=${_env_diff_python##* }
+    _env-diff-timings exec python3 ${BASHPID}
+    if [[ ${ENV_DIFF_SERVER:-false} == true ]] ; then
+        env _env_diff_cmd=${_env_diff_cmd} _env_diff_timings_log=${_env_diff_timings_log:-} ${_env_diff_python} ${_env_diff_root}/env-diff-client.py ${_env_diff_script} "$@"
+    else
+        env _env_diff_cmd=${_env_diff_cmd} _env_diff_timings_log=${_env_diff_timings_log:-} ${_env_diff_python} ${_env_diff_root}/${_env_diff_script} "$@"
+    fi
 }
 
 env-diff-compare(){
@@ -222,7 +325,7 @@ env-diff-compare(){
         man ${_env_diff_root}/manpages/env-diff-compare.1
         return
     fi
-    env _env_diff_cmd=${_env_diff_cmd} python3 ${_env_diff_root}/env-diff-compare.py "$@"
+    _env-diff-python env-diff-compare.py "$@"
 }
 
 _env-diff-setup(){
@@ -262,6 +365,67 @@ _env-diff-setup(){
     )
 }
 
+################################################################################
+# Timings of the phases with 'env-diff --timings FILE' or ENV_DIFF_TIMINGS=FILE
+# (see timings.py).  The functions that can be timed declare the locals
+# _env_diff_timings, the trace to write, and _env_diff_timings_log, the log of
+# the events which the functions they call inherit.  Only the outermost one
+# creates the log and writes the trace so the env-diff-save run by
+# env-diff-load is part of its trace.
+#
+# The variables of env-diff are saved with the environment so the start of a
+# phase cannot be kept in a variable: 'begin' and 'end' are separate events.
+# External programs are counted by running them through
+# _env-diff-timings_exec.  Times come from EPOCHREALTIME which needs BASH 5.
+################################################################################
+_env-diff-timings_start(){
+    if [[ -n ${_env_diff_timings_log} ]] ; then
+        # The trace is written by the caller
+        _env_diff_timings=""
+    elif [[ -n ${_env_diff_timings} ]] ; then
+        if ! _env_diff_timings_log=$(mktemp) ; then
+            _env_diff_log ERROR "Could not create the log of timings"
+            return 1
+        fi
+    else
+        return 0
+    fi
+    local -n nameref
+    for nameref in _env_diff_python3 _env_diff_sort _env_diff_comm _env_diff_jq _env_diff_cut _env_diff_cat _env_diff_mkdir ; do
+        if [[ -n ${nameref:-} && ${nameref} != _env-diff-timings_exec* ]] ; then
+            nameref="_env-diff-timings_exec ${nameref}"
+        fi
+    done
+}
+
+################################################################################
+# Add the event $1 (begin, end or exec) for $2 to the log with the optional
+# field $3: the PID of the background job for begin and of the shell for exec
+################################################################################
+_env-diff-timings(){
+    if [[ -n ${_env_diff_timings_log:-} ]] ; then
+        printf "%s\t%s\t%s\t%s\n" "$1" "$2" "${EPOCHREALTIME}" "${3:-}" >> "${_env_diff_timings_log}"
+    fi
+}
+
+_env-diff-timings_exec(){
+    _env-diff-timings exec "${1##*/}" ${BASHPID}
+    "$@"
+}
+
+################################################################################
+# Write the trace and its summary if this function created the log
+################################################################################
+_env-diff-timings_finish(){
+    if [[ -z ${_env_diff_timings} ]] ; then
+        return 0
+    fi
+    local _env_diff_python=${_env_diff_python3:-python3}
+    ${_env_diff_python##* } ${_env_diff_root}/env-diff-snapshot.py timings --command "${_env_diff_cmd}" \
+        "${_env_diff_timings_log}" "${_env_diff_timings}"
+    rm -f "${_env_diff_timings_log}"
+}
+
 env-diff-save(){
     # Declarations must be followed by `=""` so that the test '[[ -v .... ]]'
     # will say that it the variable is declared
@@ -274,23 +438,44 @@ env-diff-save(){
     local _env_diff_cat=""
     local _env_diff_mkdir=""
     local _env_diff_jq_length_str=""
+    local _env_diff_capture=${ENV_DIFF_CAPTURE:-compgen}
+    local _env_diff_parallel=${ENV_DIFF_PARALLEL:-false}
+    local _env_diff_single_file=false
+    local _env_diff_store=""
+    local _env_diff_base=""
+    local _env_diff_compress=""
+    local _env_diff_restore=false
+    local _env_diff_timings=${ENV_DIFF_TIMINGS:-}
+    local _env_diff_timings_log=${_env_diff_timings_log:-}
 
     if ! _env-diff-setup ; then
         return 1
     fi
 
-    if [[ "$1" == -h ]] ; then
-        cat <<-EOF
-			${FUNCNAME[0]} DIR
+    while [[ "$1" == -* ]] ; do
+        case "$1" in
+            -h)
+                cat <<-EOF
+					${FUNCNAME[0]} [--capture MODE] [--parallel] [--single-file] [--compress CODEC] [--restore] DIR
+					${FUNCNAME[0]} [--capture MODE] [--parallel] --store STORE NAME
+					${FUNCNAME[0]} [--capture MODE] [--parallel] --base PREV FILE
 
-			Save all info for use by env-diff-compare.
-			Run \`env-diff-save --help\` for more information
-		EOF
-        return 0
-    elif [[ "$1" == --help ]] ; then
-        man ${_env_diff_root}/manpages/env-diff-save.1
-        return 0
-    fi
+					Save all info for use by env-diff-compare.
+					Run \`env-diff-save --help\` for more information
+				EOF
+                return 0 ;;
+            --help) man ${_env_diff_root}/manpages/env-diff-save.1 ; return 0 ;;
+            --capture) _env_diff_capture=$2 ; shift ; shift ;;
+            --parallel) _env_diff_parallel=true ; shift ;;
+            --single-file) _env_diff_single_file=true ; shift ;;
+            --store) _env_diff_store=$2 ; shift ; shift ;;
+            --base) _env_diff_base=$2 ; shift ; shift ;;
+            --compress) _env_diff_compress=$2 ; _env_diff_single_file=true ; shift ; shift ;;
+            --restore) _env_diff_restore=true ; shift ;;
+            --) shift ; break ;;
+            *) _env_diff_log ERROR "unknown argument '$1'" ; return 1 ;;
+        esac
+    done
 
     if (( $# != 1 )) ; then
         ${FUNCNAME[0]} -h
@@ -298,26 +483,158 @@ env-diff-save(){
         return 1
     fi
 
+    case "${_env_diff_compress}" in
+        ""|gzip|zlib|lzma|bz2) ;;
+        *) _env_diff_log ERROR "Unknown codec '${_env_diff_compress}': valid codecs are gzip, zlib, lzma and bz2"
+           return 1 ;;
+    esac
+
+    if ${_env_diff_restore} && [[ -n ${_env_diff_store}${_env_diff_base} || ${_env_diff_single_file} == true ]] ; then
+        _env_diff_log ERROR "Option --restore only works when saving to a directory"
+        return 1
+    fi
+    if ${_env_diff_restore} && (( BASH_VERSINFO[0] * 100 + BASH_VERSINFO[1] < 404 )) ; then
+        _env_diff_log WARNING "Option --restore needs bash 4.4 or newer, '$1/restore.bash' is not written and 'env-diff-load --direct $1' will generate the code to load it"
+        _env_diff_restore=false
+    fi
+
+    _env-diff-timings_start || return 1
+    _env-diff-timings begin save
+    _env-diff-save_to "$1"
+    local _env_diff_status=$?
+    _env-diff-timings end save
+    _env-diff-timings_finish
+    return ${_env_diff_status}
+}
+
+################################################################################
+# Save to $1 according to the options of env-diff-save
+################################################################################
+_env-diff-save_to(){
+    if [[ -n ${_env_diff_store} ]] ; then
+        if [[ -n ${_env_diff_base} ]] ; then
+            _env_diff_log ERROR "Options --store and --base cannot be used together"
+            return 1
+        fi
+        _env-diff-save_converted add "${_env_diff_store}" "$1"
+        return
+    fi
+
     if [[ -e "$1" ]] ; then
         _env_diff_log ERROR "Cannot create save directory '$1': already exists"
         return 1
     fi
 
+    if [[ -n ${_env_diff_base} ]] ; then
+        _env-diff-save_converted delta "${_env_diff_base}" "$1"
+        return
+    fi
+
+    if [[ -n ${_env_diff_compress} ]] ; then
+        _env-diff-save_converted pack "$1" --compress "${_env_diff_compress}"
+        return
+    elif ${_env_diff_single_file} ; then
+        _env-diff-save_converted pack "$1"
+        return
+    fi
+
     if ! mkdir "$1" ; then
         _env_diff_log ERROR "Could not create directory '$1'"
         return 1
     fi
 
-    _env-diff-save_all_info "$1"
+    _env-diff-save_all_info "$1" || return 1
+    if ${_env_diff_restore} ; then
+        _env-diff-timings begin restore
+        _env-diff-save_restore "$1" > "$1/restore.bash" || return 1
+        _env-diff-timings end restore
+    fi
+}
+
+################################################################################
+# Save everything to a temporary directory in TMPDIR and convert it with
+# 'env-diff-snapshot.py $1 TMPDIR ${@:2}':
+# - pack FILE [--compress CODEC]: Write the single file FILE.  Only the final file is created
+#   where the user asked which matters when that is a shared filesystem where
+#   creating files is slow.
+# - add STORE NAME: Add the snapshot NAME to the store STORE
+# - delta BASE FILE: Write the single file FILE with only what changed
+#   relative to BASE
+################################################################################
+_env-diff-save_converted(){
+    local _env_diff_save_dir
+    if ! _env_diff_save_dir=$(mktemp -d) ; then
+        _env_diff_log ERROR "Could not create temporary directory"
+        return 1
+    fi
+    local _env_diff_status=0
+    if ! _env-diff-save_all_info "${_env_diff_save_dir}" ; then
+        _env_diff_status=1
+    else
+        _env-diff-timings begin convert
+        if ! ${_env_diff_python3} ${_env_diff_root}/env-diff-snapshot.py "$1" "${_env_diff_save_dir}" "${@:2}" ; then
+            _env_diff_log ERROR "Could not convert saved environment with 'env-diff-snapshot $*'"
+            _env_diff_status=1
+        fi
+        _env-diff-timings end convert
+    fi
+    rm -rf "${_env_diff_save_dir}"
+    return ${_env_diff_status}
 }
 
 ################################################################################
 # Saving all info to files inside $1.
 ################################################################################
 _env-diff-save_all_info(){
+    case "${_env_diff_parallel}" in
+        true|false) ;;
+        *) _env_diff_log ERROR "ENV_DIFF_PARALLEL must be 'true' or 'false', not '${_env_diff_parallel}'"
+           return 1 ;;
+    esac
+    _env-diff-timings begin variables
+    case "${_env_diff_capture}" in
+        compgen) _env-diff-save_vars_compgen "$1" || return 1 ;;
+        declare) _env-diff-save_vars_declare "$1" || return 1 ;;
+        *) _env_diff_log ERROR "Unknown capture mode '${_env_diff_capture}'"
+           return 1 ;;
+    esac
+    _env-diff-timings end variables
+
+    # Functions, options and traps are dumped by builtins redirected to files
+    # in this shell.  They are never run as background jobs because those are
+    # subshells where traps are reset.
+
+    # Save all functions as a single stream (see _env-diff-functions_dump)
+    _env-diff-timings begin functions
+    _env-diff-functions_dump > $1/functions.bash || return 1
+    _env-diff-timings end functions
+
+    # Save shell options
+    _env-diff-timings begin options
+    shopt > $1/shopt.txt || return 1
+    shopt -o > $1/shopt_set.txt || return 1
+    _env-diff-timings end options
+
+    # Traps: `trap -p` without arguments prints every trap that is set on the
+    # special BASH conditions (ERR, EXIT, DEBUG, RETURN) and on signals as
+    #     trap -- 'COMMAND' SIGNAL
+    # which is parsed by envdiff.py.  Redirecting the builtin to a file does
+    # not create a subshell.
+    _env-diff-timings begin traps
+    trap -p > $1/traps.txt || return 1
+    _env-diff-timings end traps
+}
+
+################################################################################
+# Capture mode 'compgen': Get lists of names with compgen and dump each kind of
+# variable to JSON with jq.
+################################################################################
+_env-diff-save_vars_compgen(){
+    _env-diff-timings begin names
     compgen -v | ${_env_diff_sort} >$1/all_vars.txt || return 1
     compgen -e | ${_env_diff_sort} >$1/env_vars.txt || return 1
-    compgen -A arrayvar | ${_env_diff_sort} >$1/arrays.txt || return 1# includes associative arrays
+    # includes associative arrays in BASH 5
+    compgen -A arrayvar | ${_env_diff_sort} >$1/arrays.txt || return 1
     declare -A | ${_env_diff_cut} -d ' ' -f 3 | ${_env_diff_cut} -d = -f 1 | ${_env_diff_sort} > $1/assoc_arrays.txt || return 1
 
     # Shell variables = all_vars - env_vars - array_vars - assoc_arrays
@@ -335,164 +652,468 @@ _env-diff-save_all_info(){
     # associative arrays in case arrays.txt includes associative ones.
     # I.E. this line is necessary in BASH5 but not in BASH4
     ${_env_diff_comm} -23 $1/arrays.txt $1/assoc_arrays.txt > $1/normal_arrays.txt || return 1
+    _env-diff-timings end names
 
-    # Dump all variables to JSON
-    ${_env_diff_python3} -c "import os,json ; print(json.dumps(dict(os.environ)))" >$1/env_vars.json || return 1
-    <$1/shell_vars.txt _env-diff-shell_vars_to_json > $1/shell_vars.json || return 1
-    <$1/assoc_arrays.txt _env-diff-assoc_arrays_to_json > $1/assoc_arrays.json || return 1
-    <$1/normal_arrays.txt _env-diff-assoc_arrays_to_json > $1/normal_arrays.json || return 1
+    # Dump the values of shell variables and arrays as NUL delimited strings.
+    # This is done by functions of this shell with redirections rather than on
+    # the left side of pipes so that no subshell is involved and variables like
+    # BASHPID and BASH_SUBSHELL have the values of the shell being saved.
+    _env-diff-timings begin dump
+    <$1/env_vars.txt _env-diff-shell_vars_dump > $1/env_vars.nul || return 1
+    <$1/shell_vars.txt _env-diff-shell_vars_dump > $1/shell_vars.nul || return 1
+    <$1/assoc_arrays.txt _env-diff-arrays_dump > $1/assoc_arrays.nul || return 1
+    <$1/normal_arrays.txt _env-diff-arrays_dump > $1/normal_arrays.nul || return 1
+    _env-diff-timings end dump
 
-    # Save all functions to individual files
-    ${_env_diff_mkdir} "$1/functions" || return 1
-    compgen -A function | ${_env_diff_sort} > $1/func_names.txt || return 1
-    local f
-    while read f ; do
-        declare -f ${f} > $1/functions/BASH_FUNC_${f}.bash || return 1
-    done < $1/func_names.txt
+    # Convert everything to JSON.  These conversions only read files and don't
+    # depend on each other so they can run concurrently.
+    _env-diff-run_jobs "$1" \
+        _env-diff-env_vars_to_json \
+        _env-diff-shell_vars_to_json \
+        _env-diff-assoc_arrays_to_json \
+        _env-diff-normal_arrays_to_json
+}
 
-    # Save shell options
-    shopt > $1/shopt.txt || return 1
-    shopt -o > $1/shopt_set.txt || return 1
+################################################################################
+# Call each function given after the directory $1 with $1 as argument.  If
+# _env_diff_parallel is true, the functions run as concurrent background jobs
+# and we wait on all of them.  Either way, return 1 if any of them failed.
+#
+# The jobs are started from a subshell so that an interactive shell with job
+# control does not print messages about them.
+################################################################################
+_env-diff-run_jobs(){
+    local _env_diff_dir=$1 ; shift
+    local _env_diff_job
+    if ! ${_env_diff_parallel} ; then
+        for _env_diff_job in "$@" ; do
+            _env-diff-timings begin ${_env_diff_job#_env-diff-}
+            ${_env_diff_job} "${_env_diff_dir}" || return 1
+            _env-diff-timings end ${_env_diff_job#_env-diff-}
+        done
+        return 0
+    fi
 
-    # Traps
-    _env-diff-traps_to_json >$1/traps.json
+    (
+        local -a pids=()
+        local pid status=0
+        for _env_diff_job in "$@" ; do
+            {
+                _env-diff-timings begin ${_env_diff_job#_env-diff-} ${BASHPID}
+                ${_env_diff_job} "${_env_diff_dir}" || exit 1
+                _env-diff-timings end ${_env_diff_job#_env-diff-}
+            } &
+            pids+=($!)
+        done
+        for pid in "${pids[@]}" ; do
+            if ! wait ${pid} ; then
+                status=1
+            fi
+        done
+        exit ${status}
+    )
+}
+
+################################################################################
+# Capture mode 'declare': Dump all variables with a single `declare -p` which
+# is parsed by envdiff.py.  No subprocesses are created no matter how many
+# variables there are.
+#
+# Without arguments, `declare -p` lists variables whose value is computed on
+# expansion (BASHPID, RANDOM, ...) without their value.  Dumping them again by
+# name gives their value and the parser keeps the last declaration of a name.
+# Some of them may not exist in older versions of BASH so errors are ignored.
+################################################################################
+_env_diff_dynamic_vars=(
+    BASHPID BASH_ARGC BASH_ARGV0 BASH_COMMAND BASH_SUBSHELL COMP_WORDBREAKS
+    DIRSTACK EPOCHREALTIME EPOCHSECONDS FUNCNAME GROUPS HISTCMD LINENO
+    PIPESTATUS RANDOM SECONDS SRANDOM
+)
+_env-diff-save_vars_declare(){
+    declare -p > $1/declare.txt || return 1
+    declare -p "${_env_diff_dynamic_vars[@]}" >> $1/declare.txt 2>/dev/null
+    return 0
+}
+
+################################################################################
+# Write each function as a NUL followed by its name on a line and the output
+# of `declare -f NAME`.  Bash strings cannot contain NUL bytes so envdiff.py
+# can split the stream on them even when a body has a here-document with a
+# line that looks like the header of another function.
+################################################################################
+_env-diff-functions_dump(){
+    local _env_diff_function
+    local -a _env_diff_functions
+    mapfile -t _env_diff_functions < <(compgen -A function)
+    for _env_diff_function in "${_env_diff_functions[@]}" ; do
+        printf '\0%s\n' "${_env_diff_function}"
+        declare -f "${_env_diff_function}" || return 1
+    done
+}
+
+################################################################################
+# Write the name and value of each shell variable listed on STDIN as NUL
+# delimited strings.
+################################################################################
+_env-diff-shell_vars_dump(){
+    local _env_diff_shell_var
+    while read _env_diff_shell_var ; do
+        printf "%s\0%s\0" "${_env_diff_shell_var}" "${!_env_diff_shell_var}"
+    done
+}
+
+################################################################################
+# Write the contents of each array listed on STDIN as NUL delimited triples
+# NAME KEY VALUE.  Each array starts with the triple NAME '' '' so that empty
+# arrays are also saved.  An empty key cannot otherwise occur since BASH
+# refuses empty subscripts.
+#
+# The dump ends with 'END' rather than a NUL because jq 1.6 drops trailing
+# empty strings when splitting which would lose the last empty array or the
+# last empty value.
+################################################################################
+_env-diff-arrays_dump(){
+    local _env_diff_name _env_diff_key
+    while read _env_diff_name ; do
+        if [[ "${_env_diff_name}" == "" ]] ; then
+            continue
+        fi
+        local -n _env_diff_ref=${_env_diff_name}
+        printf "%s\0\0\0" "${_env_diff_name}"
+        for _env_diff_key in "${!_env_diff_ref[@]}" ; do
+            printf "%s\0%s\0%s\0" "${_env_diff_name}" "${_env_diff_key}" "${_env_diff_ref[${_env_diff_key}]}"
+        done
+    done
+    printf "END"
+}
+
+################################################################################
+# Convert the dump of environment variables to JSON.  The values come from the
+# shell being saved because the environment of python3 also has what its
+# launcher and python itself add (LC_CTYPE, PATH of a version manager, ...).
+# Only the exported functions, which the shell does not list as variables, are
+# taken from the environment of python3 as BASH_FUNC_name%% variables.
+################################################################################
+_env-diff-env_vars_to_json(){
+    ${_env_diff_python3} -c '
+import json, os, re, sys
+with open(sys.argv[1], "rb") as f:
+    fields = f.read().decode("utf-8", "backslashreplace").split("\0")
+env_vars = dict(zip(fields[0:-1:2], fields[1::2]))
+env_vars.update((n, v) for n, v in os.environ.items() if re.fullmatch(r"BASH_FUNC_.*%%", n))
+print(json.dumps(env_vars))' $1/env_vars.nul >$1/env_vars.json
 }
 
 ################################################################################
-# Save all shell variables as JSON.  Code for JQ was found in this answer on
-# stack overflow https://stackoverflow.com/a/44792751/5795941
+# Convert the dump of shell variables to JSON.  Code for JQ was found in this
+# answer on stack overflow https://stackoverflow.com/a/44792751/5795941
 #
 # Because the splitting behavior is dependant on the version, we use (length-1)
 # or (length) based on the version: length for versions below 1.7 and (length-1)
-# for versions equal to or above 1.7.  The _env_diff_jq_length_str variable
-# is used for all 3 functions that use jq.
+# for versions equal to or above 1.7.
 #
 # I left a comment on the linked answer
 ################################################################################
 _env-diff-shell_vars_to_json(){
-    local _env_diff_shell_var
-    while read _env_diff_shell_var ; do
-        printf "%s\0%s\0" "${_env_diff_shell_var}" "${!_env_diff_shell_var}"
-    done | ${_env_diff_jq} -Rs 'split("\u0000")
+    <$1/shell_vars.nul ${_env_diff_jq} -Rs 'split("\u0000")
                     | . as $a
                     | reduce range(0;'${_env_diff_jq_length_str}'/2) as $i
-                     ({}; . + {($a[2*$i]): ($a[2*$i + 1])})'
+                     ({}; . + {($a[2*$i]): ($a[2*$i + 1])})' > $1/shell_vars.json
 }
 
 ################################################################################
-# Dump all associative arrays to a single JSON object.
-# Keys are array identifiers and values are the associative arrays themseles
-# converted to JSON.
+# Convert a dump of arrays to a single JSON object where keys are array
+# identifiers and values are the arrays themselves as JSON objects.  Normal
+# arrays are saved as objects too, their indices being the keys.
+#
+# The final 'END' is not part of any triple so dividing the length by 3 and
+# rounding down gives the number of triples.
 ################################################################################
+_env-diff-arrays_to_json(){
+    ${_env_diff_jq} -Rs 'split("\u0000")
+        | . as $a
+        | reduce range(0;(length/3)|floor) as $i
+          ({}; if $a[3*$i + 1] == "" then .[$a[3*$i]] += {}
+               else .[$a[3*$i]][$a[3*$i + 1]] = $a[3*$i + 2] end)'
+}
+
 _env-diff-assoc_arrays_to_json(){
-    printf "{\n"
-    local first=true
-    local name
-    while read name ; do
-        if [[ "${name}" == "" ]] ; then
+    <$1/assoc_arrays.nul _env-diff-arrays_to_json > $1/assoc_arrays.json
+}
+
+_env-diff-normal_arrays_to_json(){
+    <$1/normal_arrays.nul _env-diff-arrays_to_json > $1/normal_arrays.json
+}
+
+################################################################################
+# Restore artifact for 'env-diff-load --direct'.  With 'env-diff-save
+# --restore DIR', the shell being saved also writes DIR/restore.bash which
+# makes the shell sourcing it match the saved one without python3: what is
+# not in the save is removed by comparing with the lists given by compgen and
+# everything else is set with one declaration per variable and single
+# export, shopt and declare -f commands.  Like the code of env-diff-gencode, it
+# leaves alone the special variables (same as special_vars in codegen.py) and
+# the variables and functions of env-diff, removes aliases with unalias and
+# defines functions with expand_aliases off.
+################################################################################
+_env_diff_special_vars=(
+    EPOCHSECONDS SECONDS EPOCHREALTIME COLUMNS LINES RANDOM HISTCMD BASHPID SRANDOM
+    BASH_SOURCE BASH_LINENO BASH_ARGC BASH_ARGV BASH_CMDS FUNCNAME
+    PS1
+    BASHOPTS EUID PPID SHELLOPTS UID BASH_VERSINFO
+)
+# Variables neither set nor unset by restore.bash.  BASH_ALIASES is restored
+# through the aliases.
+_env_diff_restore_protected=(
+    "${_env_diff_special_vars[@]}" "${_env_diff_dynamic_vars[@]}"
+    _ BASH_ALIASES BASH_EXECUTION_STRING BASH_REMATCH
+)
+
+################################################################################
+# Write the restore artifact of this shell on STDOUT.  Only builtins are used
+# and the values are read by this shell, the subshells of '< <(compgen ...)'
+# only list names.
+################################################################################
+_env-diff-save_restore(){
+    local _env_diff_name _env_diff_key _env_diff_attrs
+    local -a _env_diff_names _env_diff_vars=() _env_diff_assigned=() _env_diff_exported=() _env_diff_trapped
+    local -a _env_diff_functions=() _env_diff_shopt_on=() _env_diff_shopt_off=() _env_diff_set_on=() _env_diff_set_off=()
+    local -A _env_diff_skip=()
+
+    # Options are read first because nounset is turned off below.  Options
+    # login_shell and restricted_shell cannot be changed and setting the
+    # compat options would set BASH_COMPAT.
+    mapfile -t _env_diff_names < <(compgen -A shopt)
+    for _env_diff_name in "${_env_diff_names[@]}" ; do
+        case ${_env_diff_name} in
+            login_shell|restricted_shell|compat*) ;;
+            *) if shopt -q ${_env_diff_name} ; then
+                   _env_diff_shopt_on+=("${_env_diff_name}")
+               else
+                   _env_diff_shopt_off+=("${_env_diff_name}")
+               fi ;;
+        esac
+    done
+    mapfile -t _env_diff_names < <(compgen -A setopt)
+    for _env_diff_name in "${_env_diff_names[@]}" ; do
+        if shopt -qo ${_env_diff_name} ; then
+            _env_diff_set_on+=("${_env_diff_name}")
+        else
+            _env_diff_set_off+=("${_env_diff_name}")
+        fi
+    done
+
+    # Declared variables without a value are unbound for 'set -u'
+    local -
+    set +u
+    for _env_diff_name in "${_env_diff_restore_protected[@]}" ; do
+        _env_diff_skip[${_env_diff_name}]=1
+    done
+
+    # Attributes of each variable without 'x' or '-' for the ones that must
+    # be left alone: protected, readonly and namerefs.
+    mapfile -t _env_diff_names < <(compgen -v)
+    for _env_diff_name in "${_env_diff_names[@]}" ; do
+        if [[ ${_env_diff_name} == _env_diff_* ]] ; then
+            continue
+        fi
+        _env_diff_attrs=${!_env_diff_name@a}
+        if [[ -n ${_env_diff_skip[${_env_diff_name}]-} || ${_env_diff_attrs} == *r* || -R ${_env_diff_name} ]] ; then
+            _env_diff_vars+=("[${_env_diff_name}]=-")
             continue
         fi
-        local -n ref=${name}
-        # Ensure no comma after the last element by putting one before
-        # each element except the first one
-        if ! ${first} ; then
-            printf ","
+        if [[ ${_env_diff_attrs} == *x* ]] ; then
+            _env_diff_exported+=("${_env_diff_name}")
+            _env_diff_attrs=${_env_diff_attrs//x}
         fi
-        printf "\n    \"%s\": " "${name}"
-        for k in "${!ref[@]}" ; do
-            printf "%s\0%s\0" "${k}" "${ref[$k]}"
-        done | ${_env_diff_jq} -Rs 'split("\u0000")
-                        | . as $a
-                        | reduce range(0;(length/2)-0.5) as $i
-                        ({}; . + {($a[2*$i]): ($a[2*$i + 1])})'
-        # The lenght/2 - 0.5 does what I want for any version of JQ.  For 1.7+
-        # the length will be say 7 for an assoc array with 3 key-value pairs
-        # and 7/2 - 0.5 will be 3 so $i will do 0,1,2.
-        # And for jq 1.6-, the length will be 6 and 6/2 - 0.5 will be 2.5 and
-        # because of how it works in JQ, because 2.5 is greater than 2, the
-        # index 2 will be included in the iteration so $i will also do 0,1,2.
-        # I'm not sure how JQ works, but this is how I make sense of why
-        # (length/2)-0.5 works for both versions.
-        first=false
+        _env_diff_vars+=("[${_env_diff_name}]=${_env_diff_attrs}")
+        _env_diff_assigned+=("${_env_diff_name}")
+    done
+
+    mapfile -t _env_diff_names < <(compgen -A function)
+    for _env_diff_name in "${_env_diff_names[@]}" ; do
+        if [[ ${_env_diff_name} != _env[-_]diff* && ${_env_diff_name} != env-diff* ]] ; then
+            _env_diff_functions+=("${_env_diff_name}")
+        fi
+    done
+
+    _env-diff-restore_trapped "$(trap -p)"
+
+    echo "# Environment saved by env-diff-save, load it with 'env-diff-load --direct DIR'"
+    declare -f _env-diff-restore_delete _env-diff-restore_trapped
+    echo "declare -gA _env_diff_restore_vars=(${_env_diff_vars[*]})"
+    _env-diff-restore_names exported "${_env_diff_exported[@]}"
+    _env-diff-restore_names functions "${_env_diff_functions[@]}"
+    _env-diff-restore_names aliases "${!BASH_ALIASES[@]}"
+    _env-diff-restore_names traps "${_env_diff_trapped[@]}"
+    echo "_env-diff-restore_delete"
+
+    # Variables
+    for _env_diff_name in "${_env_diff_assigned[@]}" ; do
+        _env_diff_attrs=${!_env_diff_name@a}
+        _env_diff_attrs=${_env_diff_attrs//x}
+        case ${_env_diff_attrs} in
+            *[aA]*)
+                local -n _env_diff_ref=${_env_diff_name}
+                printf "declare -g%s %s=(" "${_env_diff_attrs}" "${_env_diff_name}"
+                for _env_diff_key in "${!_env_diff_ref[@]}" ; do
+                    printf "[%q]=%q " "${_env_diff_key}" "${_env_diff_ref[${_env_diff_key}]}"
+                done
+                printf ")\n"
+                ;;
+            "") printf "%s=%q\n" "${_env_diff_name}" "${!_env_diff_name}" ;;
+            *) printf "declare -g%s %s=%q\n" "${_env_diff_attrs}" "${_env_diff_name}" "${!_env_diff_name}" ;;
+        esac
+    done
+    if (( ${#_env_diff_exported[@]} )) ; then
+        echo "export ${_env_diff_exported[*]}"
+    fi
+
+    # Aliases are set one at a time through BASH_ALIASES
+    for _env_diff_key in "${!BASH_ALIASES[@]}" ; do
+        printf "BASH_ALIASES[%q]=%q\n" "${_env_diff_key}" "${BASH_ALIASES[${_env_diff_key}]}"
     done
-    printf "}"
+
+    # Functions are read with expand_aliases off in case their name is an
+    # alias.  The shopt options that follow set it to its saved value.
+    echo "shopt -u expand_aliases"
+    if (( ${#_env_diff_functions[@]} )) ; then
+        declare -f "${_env_diff_functions[@]}"
+    fi
+
+    _env-diff-restore_options -s "${_env_diff_shopt_on[@]}"
+    _env-diff-restore_options -u "${_env_diff_shopt_off[@]}"
+    _env-diff-restore_options -so "${_env_diff_set_on[@]}"
+    _env-diff-restore_options -uo "${_env_diff_set_off[@]}"
+
+    trap -p
+    echo "unset -v _env_diff_restore_vars _env_diff_restore_exported _env_diff_restore_functions _env_diff_restore_aliases _env_diff_restore_traps"
 }
 
 ################################################################################
-# Dump all normal arrays to JSON:
-# Keys are array identifiers and values are the arrays themselves as JSON arrays
+# Set the array _env_diff_trapped of the caller to the signals of the output
+# of 'trap -p' given in $1.  Commands are single quoted with their quotes
+# written '\'' so removing the quoted strings and the escaped quotes from left
+# to right leaves 'trap -- SIGNAL' for each trap.  Outside of the quoted
+# strings, a backslash is always followed by a quote.  Unlike [[ =~ ]], the
+# expansions do not set BASH_REMATCH in the shell being restored.
 ################################################################################
-_env-diff-normal_arrays_to_json(){
-    printf "{\n"
-    local first=true
-    local name
-    while read name ; do
-        local -n ref=${name}
-        if ! ${first} ; then
-            printf ","
+_env-diff-restore_trapped(){
+    local _env_diff_text=$1 _env_diff_before _env_diff_word
+    while [[ ${_env_diff_text} == *\'* ]] ; do
+        _env_diff_before=${_env_diff_text%%\'*}
+        _env_diff_text=${_env_diff_text#*\'}
+        if [[ ${_env_diff_before} == *\\ ]] ; then
+            _env_diff_before=${_env_diff_before%\\}
+        else
+            _env_diff_text=${_env_diff_text#*\'}
+        fi
+        _env_diff_text=${_env_diff_before}${_env_diff_text}
+    done
+    _env_diff_trapped=()
+    for _env_diff_word in ${_env_diff_text} ; do
+        if [[ ${_env_diff_word} != trap && ${_env_diff_word} != -- ]] ; then
+            _env_diff_trapped+=("${_env_diff_word}")
         fi
-        printf "\n    \"%s\": " "${name}"
-        for v in "${ref[@]}" ; do
-            printf "%s\0" "${v}"
-        done | ${_env_diff_jq} -Rs 'split("\u0000")
-                       | . as $a
-                       | reduce range(0;'${_env_diff_jq_length_str}') as $i
-                         ([] ; . + ([$a[$i]]))'
-        first=false
     done
-    printf "}"
 }
 
 ################################################################################
-# Save traps to JSON.  Save the special bash only traps ERR, EXIT, DEBUG, RETURN
-# and save all the traps for UNIX signals from signals.h.  Since these numbers
-# are not the same on all systems but they seem to always be sequencial, we just
-# check signals starting at 1 and incrementing by 1 until the trap command
-# returns a non-zero exit code.
+# Write the declaration of the associative array _env_diff_restore_$1 whose
+# keys are the other arguments
 ################################################################################
-_env-diff-traps_to_json(){
-    local t s
-    {
-        for s in ERR EXIT DEBUG RETURN ; do
-            t="$(trap -p $s)"
-            if [[ "${t}" == "" ]] ; then
-                continue
-            fi
-            eval arr=("${t}")
-            if (( ${#arr[@]} == 4 )) ; then
-                printf "%s\0%s\0" "${arr[3]}" "${arr[2]}"
-            else
-                echo "env-diff: ERROR: Could not extract trap for signal '${s}'" >&2
-                return 1
-            fi
-        done
+_env-diff-restore_names(){
+    local _env_diff_keys=""
+    if (( $# > 1 )) ; then
+        printf -v _env_diff_keys "[%q]=1 " "${@:2}"
+    fi
+    echo "declare -gA _env_diff_restore_$1=(${_env_diff_keys})"
+}
 
-        # Traps for the signals from signal.h
-        # We could use `for t in $(trap -l | sed 's/) [^ \t]*/\n/g') ; do...`
-        # but assuming there are no gaps in signal numbers, just going until
-        # trap returns non-zero is simple
-        local n=1
-        while true ; do
-            if ! t="$(trap -p ${n} 2>/dev/null)"; then
-                # printf "Breaking at number ${n}" >&2
-                break
-            fi
-            ((n++))
-            if [[ "${t}" == "" ]] ; then
-                continue
-            fi
-            eval arr=("${t}")
-            if (( ${#arr[@]} == 4 )) ; then
-                printf "%s\0%s\0" "${arr[3]}" "${arr[2]}"
-            else
-                echo "env-diff: ERROR: Could extract trap for signal '${n}'" >&2
-                return 1
-            fi
-        done
-    } | ${_env_diff_jq} -Rs 'split("\u0000")
-                       | . as $a
-                       | reduce range(0;'${_env_diff_jq_length_str}'/2) as $i
-                         ({}; . + {($a[2*$i]): ($a[2*$i + 1])})'
+################################################################################
+# Write 'shopt $1' for the options given by the other arguments if there are
+# any.  Without names, shopt would list the options instead of setting them.
+################################################################################
+_env-diff-restore_options(){
+    if (( $# > 1 )) ; then
+        echo "shopt $*"
+    fi
+}
+
+################################################################################
+# Remove from this shell what is not in the environment being restored by a
+# restore.bash which gives it in the associative arrays
+#     _env_diff_restore_vars       NAME -> attributes without 'x' ('-' for
+#                                  variables that must be left alone)
+#     _env_diff_restore_exported   NAME -> 1
+#     _env_diff_restore_functions  NAME -> 1
+#     _env_diff_restore_aliases    NAME -> 1
+#     _env_diff_restore_traps      SIGNAL -> 1
+# Variables with other attributes are unset so that they can be declared
+# again.  The variables and functions of env-diff are left alone.  This
+# function is copied in each restore.bash so that it can be sourced by itself.
+################################################################################
+_env-diff-restore_delete(){
+    local -
+    set +u
+    local _env_diff_name _env_diff_attrs
+    local -a _env_diff_names _env_diff_unset=() _env_diff_unexport=() _env_diff_trapped
+    mapfile -t _env_diff_names < <(compgen -v)
+    for _env_diff_name in "${_env_diff_names[@]}" ; do
+        if [[ ${_env_diff_name} == _env_diff_* || ${_env_diff_restore_vars[${_env_diff_name}]-} == - ]] ; then
+            continue
+        fi
+        _env_diff_attrs=${!_env_diff_name@a}
+        if [[ ${_env_diff_attrs} == *r* ]] ; then
+            continue
+        elif [[ -z ${_env_diff_restore_vars[${_env_diff_name}]+set} || ${_env_diff_attrs//x} != "${_env_diff_restore_vars[${_env_diff_name}]}" ]] ; then
+            _env_diff_unset+=("${_env_diff_name}")
+        elif [[ ${_env_diff_attrs} == *x* && -z ${_env_diff_restore_exported[${_env_diff_name}]-} ]] ; then
+            _env_diff_unexport+=("${_env_diff_name}")
+        fi
+    done
+    if (( ${#_env_diff_unset[@]} )) ; then
+        unset -v "${_env_diff_unset[@]}"
+    fi
+    if (( ${#_env_diff_unexport[@]} )) ; then
+        export -n "${_env_diff_unexport[@]}"
+    fi
+
+    _env_diff_unset=()
+    mapfile -t _env_diff_names < <(compgen -A function)
+    for _env_diff_name in "${_env_diff_names[@]}" ; do
+        if [[ ${_env_diff_name} != _env[-_]diff* && ${_env_diff_name} != env-diff* && -z ${_env_diff_restore_functions[${_env_diff_name}]-} ]] ; then
+            _env_diff_unset+=("${_env_diff_name}")
+        fi
+    done
+    if (( ${#_env_diff_unset[@]} )) ; then
+        unset -f "${_env_diff_unset[@]}"
+    fi
+
+    # Unsetting keys of BASH_ALIASES does not remove the aliases
+    _env_diff_unset=()
+    mapfile -t _env_diff_names < <(compgen -a)
+    for _env_diff_name in "${_env_diff_names[@]}" ; do
+        if [[ -z ${_env_diff_restore_aliases[${_env_diff_name}]-} ]] ; then
+            _env_diff_unset+=("${_env_diff_name}")
+        fi
+    done
+    if (( ${#_env_diff_unset[@]} )) ; then
+        unalias "${_env_diff_unset[@]}"
+    fi
+
+    # The traps of DEBUG and RETURN, and of ERR without 'set -E', are not
+    # seen and cannot be reset in a function
+    _env_diff_unset=()
+    _env-diff-restore_trapped "$(trap -p)"
+    for _env_diff_name in "${_env_diff_trapped[@]}" ; do
+        if [[ -z ${_env_diff_restore_traps[${_env_diff_name}]-} ]] ; then
+            _env_diff_unset+=("${_env_diff_name}")
+        fi
+    done
+    if (( ${#_env_diff_unset[@]} )) ; then
+        trap - "${_env_diff_unset[@]}"
+    fi
 }
 
 source ${_env_diff_root}/env-diff-completion.bash
@@ -1,31 +1,19 @@
 import os
 import json
 import sys
-import difflib
-import re
 import argparse
+import functools
+import contextlib
 import envdiff
 import envdifflogging
+import diskcache
 import logging
+import timings
 
-envdifflogging.configureLogging()
-
-have_yaml = False
-try:
-    import yaml
-    have_yaml = True
-except:
-    logging.warning(f"The python package 'pyyaml' could not be imported.  It can be installed with `python3 -m pip install [--user] pyyaml`.  No config file will be loaded (see 'env-diff --help' for more info)")
-    pass
-
-try:
-    import pygments
-    import pygments.formatters
-    import pygments.lexers.shell
-    import pygments.styles
-    import pygments.token
-except:
-    pass
+# Nothing is done when this file is imported and the optional packages pyyaml
+# and pygments are only imported when they are needed: pyyaml when the config
+# file has changed since it was last parsed and pygments when a function body
+# is displayed.  See benchmarks/bench_startup.py.
 
 DESCRIPTION = """
     Report the difference caused on the shell environment by a command.
@@ -46,101 +34,347 @@ DESCRIPTION = """
 """
 comparison_functions = {}
 display_functions = {}
-ignored_variables = set()
-ignored_normal_arrays = set()
-ignored_assoc_arrays = set()
+# Built from the dictionaries above by setup_function_dictionnaries()
+comparison_index = None
+display_index = None
+comparators = {}
+diff_config = envdiff.DiffConfig()
 colon_lists = set()
 space_lists = set()
-def get_args():
-    global ignored_variables
-    global ignored_normal_arrays
-    global ignored_assoc_arrays
+args = None
+
+class ConfigError(Exception):
+    pass
+
+def components_arg(value):
+    try:
+        return envdiff.parse_components(value)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+
+def get_args(argv=None):
+    global diff_config
     global colon_lists
     global space_lists
+    global comparators
 
     if '_env_diff_cmd' in os.environ:
         sys.argv[0] = os.environ['_env_diff_cmd']
     p = argparse.ArgumentParser()
-    p.add_argument("--list-diff", action='store_true')
+    p.add_argument("--list-format", choices=['changes', 'set', 'diff'], default='changes',
+                   help="Show added, removed, moved and duplicated elements of lists with their positions (changes), the elements added and removed as sets (set) or a diff of the elements (diff)")
+    p.add_argument("--list-diff", dest='list_format', action='store_const', const='diff', help="Same as --list-format diff")
     p.add_argument("--no-ignore", action='store_true')
     p.add_argument("-F", dest="config_file", default=os.path.expanduser("~/.config/env-diff.yml"), help="Select alternate config file")
     p.add_argument("--show-function-bodies", action='store_true', help="Show bodies of new functions")
     p.add_argument("--debug", help="Set log level to debug", action='store_true')
+    p.add_argument("--only", type=components_arg, metavar="COMPONENTS", default=list(envdiff.COMPONENTS),
+                   help="Comma separated list of components to compare (env,shell,assoc,normal,arrays,vars,shopt,set,functions,traps)")
+    p.add_argument("--store", metavar="STORE", help="Initial and final are names of snapshots in the store STORE")
+    p.add_argument("--format", choices=['text', 'json', 'ndjson'], default='text',
+                   help="Colored report (text), a JSON document (json) or one JSON object per line for each change (ndjson)")
+    p.add_argument("--timings", metavar="FILE", default=os.environ.get('ENV_DIFF_TIMINGS'),
+                   help="Write the time of each phase to FILE as JSON and a summary on stderr")
+    p.add_argument("--timeline", action='store_true',
+                   help="Show at which step of the sequence of environments INITIAL FINAL MORE... each entry changed")
     p.add_argument("initial", help="Initial environment created with env-diff-save")
     p.add_argument("final", help="Final environment created with env-diff-save")
-    args = p.parse_args()
-
-    # TODO: As described in main(): Move all this to the __init__() of
-    # ShellEnvironmentDiff
-    if os.path.isfile(args.config_file) and have_yaml:
-        with open(args.config_file) as f:
-            config = yaml.safe_load(f)
-    else:
-        config = {}
+    p.add_argument("more", nargs='*', help="Environments following FINAL with --timeline")
+    args = p.parse_args(argv)
+    if args.more and not args.timeline:
+        p.error("more than two environments can only be compared with --timeline")
+    timings.start(args.timings)
+
+    if args.store is not None:
+        import store
+        try:
+            args.initial = store.Store(args.store).snapshot_path(args.initial)
+            args.final = store.Store(args.store).snapshot_path(args.final)
+            args.more = [store.Store(args.store).snapshot_path(s) for s in args.more]
+        except ValueError as e:
+            p.error(str(e))
+    args.snapshots = [args.initial, args.final] + args.more
+
+    with timings.phase("config"):
+        config = load_config(args.config_file)
 
     colon_lists = set(config['colon_lists']) if 'colon_lists' in config \
         else set(['PATH'])
     space_lists = set(config['space_lists']) if 'space_lists' in config \
         else set()
+    comparators = dict(config.get('comparators') or {})
 
-    if args.no_ignore:
-        ignored_variables = set()
-        ignored_normal_arrays = set()
-        ignored_assoc_arrays = set()
-    else:
-        ignored_variables = set(config['ignored_variables']) if 'ignored_variables' in config \
-            else set(['BASHPID', 'BASH_SUBSHELL', 'EPOCHREALTIME',
-                     'EPOCHSECONDS', 'RANDOM', 'SRANDOM', 'SECONDS'])
-        ignored_normal_arrays = set(config['ignored_normal_arrays']) if 'ignored_normal_arrays' in config \
-            else set(['BASH_LINENO'])
-        ignored_assoc_arrays = set(config['ignored_assoc_arrays']) if 'ignored_assoc_arrays' in config \
-            else set()
+    diff_config = envdiff.DiffConfig() if args.no_ignore else envdiff.DiffConfig.from_config(config)
 
     return args
 
-args = get_args()
+def config_cache_path(config_file):
+    import hashlib
+    key = hashlib.sha1(os.path.abspath(config_file).encode('utf-8', 'surrogateescape')).hexdigest()
+    return os.path.join(diskcache.cache_home(), f"config-{key}.json")
+
+@functools.lru_cache(maxsize=None)
+def _load_config(config_file, mtime_ns, size):
+    """
+    Parse the YAML config file through a JSON copy of its contents in
+    ~/.cache/env-diff that is used as long as the modification time and size
+    of the file don't change.  The JSON copy is faster to load than importing
+    yaml and parsing the file.
+    """
+    cache_path = config_cache_path(config_file)
+    try:
+        with open(cache_path) as f:
+            cached = json.load(f)
+        if cached['mtime_ns'] == mtime_ns and cached['size'] == size:
+            return cached['config']
+    except (OSError, ValueError, KeyError):
+        pass
+
+    try:
+        import yaml
+    except ImportError:
+        logging.warning(f"The python package 'pyyaml' could not be imported.  It can be installed with `python3 -m pip install [--user] pyyaml`.  No config file will be loaded (see 'env-diff --help' for more info)")
+        return {}
+    with open(config_file) as f:
+        config = yaml.safe_load(f) or {}
+
+    tmp = f"{cache_path}.{os.getpid()}"
+    try:
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        with open(tmp, 'w') as f:
+            json.dump({'mtime_ns': mtime_ns, 'size': size, 'config': config}, f)
+        os.replace(tmp, cache_path)
+    except (OSError, TypeError, ValueError):
+        # The cache is only an optimization and some YAML values like dates
+        # have no JSON equivalent.
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+    return config
+
+def load_config(config_file):
+    """
+    Dictionary from the YAML config file or {} if it does not exist
+    """
+    try:
+        st = os.stat(config_file)
+    except OSError:
+        return {}
+    return _load_config(config_file, st.st_mtime_ns, st.st_size)
 
 
-def main():
+def main(argv=None):
     """
     Perform the entire set of comparisons
     """
+    global args
+    envdifflogging.configureLogging()
+    args = get_args(argv)
     setup_function_dictionnaries(display_functions, comparison_functions)
-    # TODO: Use envdiff.ShellEnvironmentDiff:
-    # - Make all these compare_*() functions methods of the class
-    # - Give the class's __init__() method a config argument
-    #   - The getargs gets the config file path and the __init__()
-    #     method of the class sets attributes for the ignored variables
-    #     and colon lists and son on
-    # - This file would be more like the new env-diff-generate-code.py
-    before = envdiff.ShellEnvironmentData(args.initial)
-    after = envdiff.ShellEnvironmentData(args.final)
-    compare_variables(before.env_vars, after.env_vars, env=True)
-    compare_variables(before.shell_vars, after.shell_vars, env=False)
-    compare_associative_arrays(before.assoc_arrays, after.assoc_arrays)
-    compare_normal_arrays(before.normal_arrays, after.normal_arrays)
-    compare_shell_options(before.shopt, after.shopt, from_set=False)
-    compare_shell_options(before.shopt_set, after.shopt_set, from_set=True)
-    compare_shell_functions(before.functions, after.functions, args.show_function_bodies)
-    compare_traps(before.traps, after.traps)
-
-def compare_variables(i: dict,f: dict, env):
+    # Components are loaded when they have changes to look at so the ones
+    # that are not selected with --only or that are identical are never read.
+    # A diff of the same environments that was already computed is taken
+    # from the cache and the environments are not loaded at all.
+    # With --timeline, each environment is loaded once for the diffs with the
+    # one before it and the one after it.
+    with timings.phase("diff"):
+        if args.timeline:
+            diff = envdiff.ShellEnvironmentTimeline(args.snapshots, components=args.only, config=diff_config,
+                                                    cache=envdiff.diff_cache())
+        else:
+            diff = envdiff.ShellEnvironmentDiff(args.initial, args.final, components=args.only, config=diff_config,
+                                                cache=envdiff.diff_cache())
+    if args.format != 'text':
+        with timings.phase("report"):
+            if args.timeline:
+                write_timeline(diff, sys.stdout, ndjson=(args.format == 'ndjson'))
+            else:
+                write_records(diff, sys.stdout, ndjson=(args.format == 'ndjson'))
+        diff.save()
+        return
+    with contextlib.redirect_stdout(TextRenderer(sys.stdout)) as out:
+        try:
+            with timings.phase("report"):
+                if args.timeline:
+                    compare_timeline(diff)
+                else:
+                    compare_all(diff)
+            diff.save()
+        finally:
+            out.flush()
+            if get_highlight_cache.cache_info().currsize and get_highlight_cache() is not None:
+                get_highlight_cache().close()
+
+def compare_all(diff):
+    comparisons = {
+        'env_vars': lambda: compare_variables(diff.env_vars, env=True),
+        'shell_vars': lambda: compare_variables(diff.shell_vars, env=False),
+        'assoc_arrays': lambda: compare_associative_arrays(diff.assoc_arrays),
+        'normal_arrays': lambda: compare_normal_arrays(diff.normal_arrays),
+        'shopt': lambda: compare_shell_options(diff.shopt, from_set=False),
+        'shopt_set': lambda: compare_shell_options(diff.shopt_set, from_set=True),
+        'functions': lambda: compare_shell_functions(diff.functions, args.show_function_bodies),
+        'traps': lambda: compare_traps(diff.traps),
+    }
+    for component in args.only:
+        with timings.phase(f"report {component}"):
+            comparisons[component]()
+
+class TextRenderer:
+    """
+    File object for sys.stdout collecting the many small writes of print() in
+    a buffer written to stream in large blocks.  Without it, each line of the
+    report would be a separate write when the output is a terminal.
+    """
+    def __init__(self, stream, size=1 << 16):
+        self.stream = stream
+        self.size = size
+        self.parts = []
+        self.length = 0
+
+    def write(self, text):
+        self.parts.append(text)
+        self.length += len(text)
+        if self.length >= self.size:
+            self.flush()
+        return len(text)
+
+    def flush(self):
+        if self.parts:
+            self.stream.write(''.join(self.parts))
+            self.parts = []
+            self.length = 0
+        self.stream.flush()
+
+def write_records(diff, stream, ndjson=False):
+    """
+    Write the changes of diff (see ShellEnvironmentDiff.records()) as one
+    JSON object per line if ndjson or as a JSON document
+        {"initial": DIR, "final": DIR, "changes": [RECORD, ...]}
+    Records are written as they are generated so the whole report is never
+    in memory.
+    """
+    if not ndjson:
+        stream.write(f'{{"initial":{json.dumps(args.initial)},"final":{json.dumps(args.final)},"changes":[')
+    separator = '' if ndjson else '\n'
+    for r in diff.records():
+        add_list_changes(r)
+        stream.write(separator + json.dumps(r))
+        separator = '\n' if ndjson else ',\n'
+    stream.write('\n' if ndjson else '\n]}\n')
+
+def add_list_changes(record):
+    """
+    Add the changes of the elements (see linediff.ListDiff) to the record of a
+    changed variable that is a colon or space separated list
+    """
+    if record['kind'] != 'changed' or record['component'] not in ('env_vars', 'shell_vars'):
+        return
+    separator = list_separators.get(comparison_index.get(record['name']))
+    if separator is None:
+        return
+    import linediff
+    d = linediff.ListDiff(record['old'].split(separator), record['new'].split(separator))
+    record['separator'] = separator
+    record['added'] = [{'position': j, 'value': e} for j, e in d.added]
+    record['removed'] = [{'position': i, 'value': e} for i, e in d.removed]
+    record['moved'] = [{'value': e, 'from': i, 'to': j} for e, i, j in d.moved]
+    record['duplicated'] = [{'value': e, 'positions': p} for e, p in d.duplicated]
+
+################################################################################
+# Timeline of a sequence of environments (--timeline)
+################################################################################
+# Titles of the components in the text report of the timeline
+TIMELINE_TITLES = {
+    'env_vars': 'ENVIRONMENT VARIABLES',
+    'shell_vars': 'SHELL VARIABLES',
+    'assoc_arrays': 'ASSOCIATIVE ARRAY VARIABLES',
+    'normal_arrays': 'NORMAL ARRAY VARIABLES',
+    'shopt': 'SHELL OPTIONS',
+    'shopt_set': 'SHELL OPTIONS (SET)',
+    'functions': 'SHELL FUNCTIONS',
+    'traps': 'TRAPS',
+}
+TIMELINE_COLORS = {'new': '32', 'added': '32', 'deleted': '31', 'removed': '31', 'changed': '33'}
+
+def timeline_entries(timeline):
+    """
+    Generate a dictionary for each entry that changed in the timeline (see
+    envdiff.ShellEnvironmentTimeline) in the order of the components and names:
+
+        {"component": COMPONENT, "name": NAME, "history": [{"snapshot": K, "kind": KIND}, ...]}
+
+    Variables that are colon or space separated lists also have the history of
+    their elements:
+
+        "separator": SEPARATOR, "elements": [{"value": ELEMENT, "history": [...]}, ...]
+
+    where the kind of the changes of elements is "added" or "removed".
+    """
+    history = timeline.history()
+    names = {}
+    for c, name in history:
+        names.setdefault(c, []).append(name)
+    for c in args.only:
+        for name in sorted(names.get(c, [])):
+            entry = {'component': c, 'name': name,
+                     'history': [{'snapshot': k, 'kind': kind} for k, kind in history[(c, name)]]}
+            separator = list_separators.get(comparison_index.get(name)) if c in ('env_vars', 'shell_vars') else None
+            if separator is not None:
+                entry['separator'] = separator
+                entry['elements'] = [{'value': e, 'history': [{'snapshot': k, 'kind': kind} for k, kind in steps]}
+                                     for e, steps in timeline.element_history(c, name, separator).items()]
+            yield entry
+
+def write_timeline(timeline, stream, ndjson=False):
+    """
+    Write the entries of timeline_entries() as one JSON object per line if
+    ndjson or as a JSON document
+        {"snapshots": [DIR, ...], "entries": [ENTRY, ...]}
+    """
+    if not ndjson:
+        stream.write(f'{{"snapshots":{json.dumps(args.snapshots)},"entries":[')
+    separator = '' if ndjson else '\n'
+    for entry in timeline_entries(timeline):
+        stream.write(separator + json.dumps(entry))
+        separator = '\n' if ndjson else ',\n'
+    stream.write('\n' if ndjson else '\n]}\n')
+
+def format_history(history):
+    """ 'new in S1, changed in S3' for the history of an entry or element """
+    return ', '.join(f"\033[{TIMELINE_COLORS[h['kind']]}m{h['kind']} in S{h['snapshot']}\033[0m" for h in history)
+
+def compare_timeline(timeline):
+    """
+    Print the steps of the timeline at which each entry changed
+    """
+    print("\033[1m================= TIMELINE ================\033[0m")
+    for k, snapshot in enumerate(args.snapshots):
+        print(f"S{k}: {snapshot}")
+    component = None
+    for entry in timeline_entries(timeline):
+        if entry['component'] != component:
+            component = entry['component']
+            print(f"\033[1m================= {TIMELINE_TITLES[component]} ================\033[0m")
+        print(f"\033[1m{entry['name']}\033[0m: {format_history(entry['history'])}")
+        for e in entry.get('elements', []):
+            value = e['value'] if e['value'] else '\033[4m(empty)\033[0m'
+            print(f"    {value}: {format_history(e['history'])}")
+
+def compare_variables(d: envdiff.EnvComponentDiff, env):
     """
     Compare sets of shell or environment variables.
     """
-    # TODO: Same for all the other compare_*() functions: base them on
-    #       EnvomponentDiff so I don't have to repeat this new, deleted,
-    #       common, changed stuff at the top of each of them
-    new = set(f.keys()) - set(i.keys())
-    deleted = set(i.keys()) - set(f.keys())
-    common = set(i.keys()).intersection(set(f.keys())) - set(ignored_variables)
-    changed = list(sorted(filter(lambda v: i[v] != f[v], common)))
-
-    if new or deleted or changed:
-        if env:
-            print("\033[1m================= ENVIRONMENT VARIABLES ================\033[0m")
-        else:
-            print("\033[1m================= SHELL VARIABLES ================\033[0m")
+    new, deleted, changed = d.new, d.deleted, sorted(d.changed)
+    if not (new or deleted or changed):
+        return
+    i, f = d.initial, d.final
+
+    if env:
+        print("\033[1m================= ENVIRONMENT VARIABLES ================\033[0m")
+    else:
+        print("\033[1m================= SHELL VARIABLES ================\033[0m")
 
     if new:
         print('\033[4;32mNew variables\033[0m')
@@ -155,25 +389,18 @@ def compare_variables(i: dict,f: dict, env):
     if changed:
         print('\033[4;33mModified variables\033[0m')
         for var in changed:
-            for k in comparison_functions:
-                if re.fullmatch(k, var):
-                    compare_func = comparison_functions[k]
-                    break
-            else:
-                compare_func = lambda n,i,f: print(f"{n}:\n\tOLD: {i}\n\tNEW: {f}")
-            compare_func(var, i[var], f[var])
+            comparison_index.get(var, compare_single_variable)(var, i[var], f[var])
 
-def compare_associative_arrays(i: dict,f: dict):
+def compare_associative_arrays(d: envdiff.EnvComponentDiff):
     """
     Print differences between the sets of associative arrays before and after
     """
-    new = set(f.keys()) - set(i.keys())
-    deleted = set(i.keys()) - set(f.keys())
-    common = set(i.keys()).intersection(set(f.keys())) - ignored_assoc_arrays
-    changed = list(sorted(filter(lambda v: i[v] != f[v], common)))
+    new, deleted, changed = d.new, d.deleted, sorted(d.changed)
+    if not (new or deleted or changed):
+        return
+    i, f = d.initial, d.final
 
-    if new or deleted or changed:
-        print("\033[1m================= ASSOCIATIVE ARRAY VARIABLES ================\033[0m")
+    print("\033[1m================= ASSOCIATIVE ARRAY VARIABLES ================\033[0m")
 
     if new:
         print('\033[4;32mNew Associative Arrays\033[0m')
@@ -192,13 +419,8 @@ def compare_associative_arrays(i: dict,f: dict):
 
 def compare_single_associative_array(name: str, i: dict, f:dict):
     print(f"\033[33m  {name}\033[0m")
-    initial_keys = set(i.keys())
-    final_keys = set(f.keys())
-
-    new = final_keys - initial_keys
-    deleted = initial_keys - final_keys
-    common = initial_keys.intersection(final_keys)
-    changed = list(sorted(filter(lambda v: i[v] != f[v], common)))
+    d = envdiff.EnvComponentDiff(i, f)
+    new, deleted, changed = d.new, d.deleted, sorted(d.changed)
     if new:
         print(f"\033[33m    New keys\033[0m")
         for k in new:
@@ -218,7 +440,7 @@ def compare_single_associative_array(name: str, i: dict, f:dict):
 
 
 
-def compare_normal_arrays(i: dict, f:dict):
+def compare_normal_arrays(d: envdiff.EnvComponentDiff):
     """
     Print differences between the sets of normal arrays before
     This is the exact same code as the one for associative arrays
@@ -226,15 +448,12 @@ def compare_normal_arrays(i: dict, f:dict):
     I'm leaving it like because I intend to display new arrays
     and compare modified ones in in different ways in the future.
     """
-    new = set(f.keys()) - set(i.keys())
-    deleted = set(i.keys()) - set(f.keys())
-    common = set(i.keys()).intersection(set(f.keys())) - ignored_normal_arrays
-    # common = {v for v in common if not v.startswith("_env_diff")}
-    logging.debug(f"ignored_normal_arrays = '{ignored_normal_arrays}'")
-    changed = sorted(filter(lambda v: i[v] != f[v], common))
+    new, deleted, changed = d.new, d.deleted, sorted(d.changed)
+    if not (new or deleted or changed):
+        return
+    i, f = d.initial, d.final
 
-    if new or deleted or changed:
-        print("\033[1m================= NORMAL ARRAY VARIABLES ================\033[0m")
+    print("\033[1m================= NORMAL ARRAY VARIABLES ================\033[0m")
 
     if new:
         print('\033[4;32mNew Normal Arrays\033[0m')
@@ -259,15 +478,16 @@ def compare_normal_arrays(i: dict, f:dict):
                 print(f"Final   {var}: {as_normal_array(final)}")
 
 
-def compare_shell_options(i: dict, f: dict, from_set=False):
+def compare_shell_options(d: envdiff.EnvComponentDiff, from_set=False):
     """
     Print differences between shell options
     """
-    if set(i.keys()) != set(f.keys()):
-        print(set(i.keys()).difference(set(f.keys())))
+    if d.new or d.deleted:
+        print(d.deleted)
     changes = []
-    for k in i:
-        if i[k] != f[k]:
+    if d.changed:
+        i, f = d.initial, d.final
+        for k in sorted(d.changed):
             changes.append(f"{k}: {i[k]} -> {f[k]}")
     if changes:
         if from_set:
@@ -277,17 +497,25 @@ def compare_shell_options(i: dict, f: dict, from_set=False):
         print('\n'.join(changes))
 
 
-def compare_shell_functions(i: dict, f: dict, show_new_defs=True):
+def compare_shell_functions(d: envdiff.EnvComponentDiff, show_new_defs=True):
     """
     Compare sets of shell functions
     """
-    new = set(f.keys()) - set(i.keys())
-    deleted = set(i.keys()) - set(f.keys())
-    common = set(i.keys()).intersection(set(f.keys()))
-    changed = sorted(filter(lambda v: i[v] != f[v], common))
-
-    if new or deleted or changed:
-        print("\033[1m================= SHELL FUNCTIONS ================\033[0m")
+    new, deleted, changed = d.new, d.deleted, sorted(d.changed)
+    if not (new or deleted or changed):
+        return
+    i, f = d.initial, d.final
+    # Functions whose body is the same under a new name
+    renamed = d.renamed()
+    new = new - set(renamed.values())
+    deleted = deleted - set(renamed)
+
+    print("\033[1m================= SHELL FUNCTIONS ================\033[0m")
+
+    if renamed:
+        print('\033[4;36mRenamed functions\033[0m')
+        for func in sorted(renamed):
+            print(f"{func}() -> {renamed[func]}()")
 
     if new:
         print('\033[4;32mNew functions\033[0m')
@@ -311,17 +539,16 @@ def compare_shell_functions(i: dict, f: dict, show_new_defs=True):
                 diff_compare(i[func], f[func])
 
 
-def compare_traps(i: dict, f: dict):
+def compare_traps(d: envdiff.EnvComponentDiff):
     """
     Compare sets of shell functions
     """
-    new = set(f.keys()) - set(i.keys())
-    deleted = set(i.keys()) - set(f.keys())
-    common = set(i.keys()).intersection(set(f.keys()))
-    changed = sorted(filter(lambda v: i[v] != f[v], common))
+    new, deleted, changed = d.new, d.deleted, sorted(d.changed)
+    if not (new or deleted or changed):
+        return
+    i, f = d.initial, d.final
 
-    if new or deleted or changed:
-        print("\033[1m================= TRAPS ================\033[0m")
+    print("\033[1m================= TRAPS ================\033[0m")
 
     if new:
         print('\033[4;32mNew traps\033[0m')
@@ -343,13 +570,13 @@ def compare_traps(i: dict, f: dict):
 # Display and comparison functions for individual variables, arrays and functions
 ################################################################################
 def display_single_variable(name, value):
-    for k in display_functions:
-        if re.fullmatch(k, name):
-            display_func = display_functions[k]
-            break
-    else:
-        display_func = lambda n,v: print(f"\033[1m{n}\033[0m={v}")
-    display_func(name, value)
+    display_index.get(name, display_plain_variable)(name, value)
+
+def display_plain_variable(name, value):
+    print(f"\033[1m{name}\033[0m={value}")
+
+def compare_single_variable(name, initial_value, final_value):
+    print(f"{name}:\n\tOLD: {initial_value}\n\tNEW: {final_value}")
 
 def compare_colon_lists(name, initial_value, final_value):
     initial_list = initial_value.split(':')
@@ -382,45 +609,111 @@ def display_python_list(name, elements):
 
 
 def color_full_diff(before, after):
+    import linediff
     diff_colors = {'+': '\033[32m', ' ': '', '-': '\033[31m', '?': '\033[36m'}
-    for l in difflib.unified_diff(before, after, fromfile="before", tofile="after", n=1000):
-        if l.startswith('+++') or l.startswith('---') or l.startswith('@@'):
-            continue
+    for l in linediff.unified_diff(before, after, n=max(len(before), len(after))):
         color = diff_colors.get(l[0],'')
         yield f"{color}{l.rstrip()}\033[0m"
 
 def compare_python_lists(name, initial_list, final_list, show_kept=False):
-    initial_set = set(initial_list)
-    final_set = set(final_list)
-    new = set(final_list) - set(initial_list)
-    deleted = set(initial_list) - set(final_list)
-    common = set(initial_list).intersection(set(final_list))
     indent = '        '
-    if args.list_diff:
+    if args.list_format == 'diff':
         print(')')
         print('    ' + '\n    '.join(map(str.rstrip, list(color_full_diff(
                 [ s if s else "(empty)" for s in initial_list ],
                 [ s if s else "(empty)" for s in final_list ]
         )))))
-    else:
+        return
+
+    import linediff
+    d = linediff.ListDiff(initial_list, final_list)
+    if args.list_format == 'set':
+        initial_set = set(initial_list)
+        final_set = set(final_list)
         print(' using set comparison)')
-        if new:
+        if final_set - initial_set:
             print('    ADDED:')
-            print('\n'.join([f'{indent}{e}' for e in new]))
-        if common and show_kept:
+            print('\n'.join([f'{indent}{e}' for e in final_set - initial_set]))
+        if show_kept and initial_set & final_set:
             print('    KEPT:')
-            print('\n'.join([f'{indent}{e}' for e in common]))
-        if deleted:
+            print('\n'.join([f'{indent}{e}' for e in initial_set & final_set]))
+        if initial_set - final_set:
             print('    REMOVED:')
-            print('\n'.join([f'{indent}{e}' for e in deleted]))
+            print('\n'.join([f'{indent}{e}' for e in initial_set - final_set]))
         if initial_list != final_list and (initial_set == final_set):
-            print('(before and after are the same as sets.  Comparing with diff')
-            print('    ' + '\n    '.join(map(str.rstrip, list(color_full_diff(
-                    [ s if s else "(empty)" for s in initial_list ],
-                    [ s if s else "(empty)" for s in final_list ]
-            )))))
+            print('(before and after are the same as sets but the order changed)')
+            print_list_changes(d, moves_only=True)
+        return
+
+    print(')')
+    print_list_changes(d)
+
+def print_list_changes(d, moves_only=False):
+    """
+    Print the elements of a linediff.ListDiff with their positions (indices in
+    the list before and after)
+    """
+    indent = '        '
+    def element(e):
+        return e if e else '\033[4m(empty)\033[0m'
+    if d.added and not moves_only:
+        print('    ADDED:')
+        print('\n'.join(f'{indent}\033[32m[{j}] {element(e)}\033[0m' for j, e in d.added))
+    if d.removed and not moves_only:
+        print('    REMOVED:')
+        print('\n'.join(f'{indent}\033[31m[{i}] {element(e)}\033[0m' for i, e in d.removed))
+    if d.moved:
+        print('    MOVED:')
+        print('\n'.join(f'{indent}\033[33m[{i} -> {j}] {element(e)}\033[0m' for e, i, j in d.moved))
+    if d.duplicated and not moves_only:
+        print('    DUPLICATED:')
+        print('\n'.join(f'{indent}\033[36m[{", ".join(map(str, p))}] {element(e)}\033[0m' for e, p in d.duplicated))
+
+################################################################################
+# Registry of the ways of comparing and displaying variables.  The section
+# 'comparators' of the config file maps names or regular expressions of
+# variables to the name of a registered kind or to 'MODULE:FUNCTION' for a
+# python function called like compare_single_variable():
+#
+#     comparators:
+#       JAVA_OPTS: space_list
+#       MY_.*_DIRS: colon_list
+#       MY_VERSION: mymodule:compare_versions
+#
+# Other kinds can be added with register_comparator() by such a module.
+################################################################################
+registered_comparators = {}
+
+def register_comparator(kind, compare, display=None):
+    """
+    Make kind usable in the 'comparators' section of the config file.  The
+    function compare(name, initial_value, final_value) prints the changes of
+    a modified variable and display(name, value) prints a new or deleted one.
+    """
+    registered_comparators[kind] = (compare, display)
+
+def lookup_comparator(kind):
+    """ Functions (compare, display) for kind """
+    if kind in registered_comparators:
+        return registered_comparators[kind]
+    module_name, sep, function_name = kind.partition(':')
+    if not sep:
+        raise ValueError(f"Unknown comparator '{kind}', valid kinds are {', '.join(registered_comparators)} or MODULE:FUNCTION")
+    import importlib
+    try:
+        module = importlib.import_module(module_name)
+    except ImportError as e:
+        raise ValueError(f"Could not import comparator '{kind}': {e}")
+    # The module may register kinds of its own when imported
+    if kind in registered_comparators:
+        return registered_comparators[kind]
+    if not hasattr(module, function_name):
+        raise ValueError(f"Unknown comparator '{kind}': module '{module_name}' has no function '{function_name}'")
+    return getattr(module, function_name), None
 
 def setup_function_dictionnaries(display, comparison):
+    global comparison_index
+    global display_index
     comparison_functions['BASH_FUNC_[a-zA-Z_.-]*%%'] = compare_exported_bash_func
     for n in colon_lists:
         comparison[n] = compare_colon_lists
@@ -428,46 +721,113 @@ def setup_function_dictionnaries(display, comparison):
     for n in space_lists:
         comparison[n] = compare_space_lists
         display[n] = display_space_list
+    for n, kind in comparators.items():
+        try:
+            compare_func, display_func = lookup_comparator(kind)
+        except ValueError as e:
+            raise ConfigError(f"{args.config_file}: comparators: {n}: {e}")
+        comparison[n] = compare_func
+        if display_func is not None:
+            display[n] = display_func
+    comparison_index = envdiff.NameIndex(comparison)
+    display_index = envdiff.NameIndex(display)
 
 def compare_exported_bash_func(name, before, after):
     print(name)
     diff_compare(before.splitlines(), after.splitlines())
 
+# Separator of the elements of variables compared as lists for the JSON output
+list_separators = {compare_colon_lists: ':', compare_space_lists: ' '}
+
+register_comparator('colon_list', compare_colon_lists, display_colon_list)
+register_comparator('space_list', compare_space_lists, display_space_list)
+register_comparator('exported_function', compare_exported_bash_func)
+register_comparator('plain', compare_single_variable, display_plain_variable)
+
 def diff_compare(before, after, indent=''):
+    import linediff
     diff_colors = {'+': '\033[32m', ' ': '', '-': '\033[31m', '?': '\033[36m'}
     def diff():
-        for l in difflib.unified_diff(before, after, fromfile="before", tofile="after"):
-            if l.startswith('+++') or l.startswith('---') or l.startswith('@@'):
-                continue
-            color = '\033[1;34m' \
-                    if l.startswith('+++') or l.startswith('---') or l.startswith('@@') \
-                    else diff_colors.get(l[0],'')
+        for l in linediff.unified_diff(before, after):
+            color = diff_colors.get(l[0],'')
             yield f"{color}{l.rstrip()}\033[0m"
     print(indent + ('\n'+indent).join(diff()))
 
-if 'pygments' in sys.modules:
-    def get_formatter():
-        styles = list(pygments.styles.get_all_styles())
-        style = 'default'
-        # Solarized light is for light background but I tried it on dark background
-        # and it looks great
-        potential_styles = ['solarized-light', 'vim', 'monokai', 'arduino',
-                            'emacs', 'native', 'lovelace', 'paraiso-dark',
-                            'rainbow_dash', 'rrt', 'perldoc', 'solarized-dark',
-                            'sas', 'stata-dark', 'dracula', 'colorful']
-        for s in potential_styles:
-            if s in styles:
-                style = s
-                break
-        return pygments.formatters.Terminal256Formatter(style=style)
+# Solarized light is for light background but I tried it on dark background
+# and it looks great
+POTENTIAL_STYLES = ['solarized-light', 'vim', 'monokai', 'arduino',
+                    'emacs', 'native', 'lovelace', 'paraiso-dark',
+                    'rainbow_dash', 'rrt', 'perldoc', 'solarized-dark',
+                    'sas', 'stata-dark', 'dracula', 'colorful']
 
+def get_formatter():
+    import pygments.formatters
+    import pygments.styles
+    import pygments.util
+    # Looking up styles by name rather than listing them with get_all_styles()
+    # avoids scanning the metadata of every installed package for plugins.
+    for s in POTENTIAL_STYLES:
+        try:
+            return pygments.formatters.Terminal256Formatter(style=pygments.styles.get_style_by_name(s))
+        except pygments.util.ClassNotFound:
+            pass
+    return pygments.formatters.Terminal256Formatter(style='default')
+
+@functools.lru_cache(maxsize=None)
+def get_pygments_highlighter():
+    import pygments
+    import pygments.lexers.shell
     lexer = pygments.lexers.shell.BashLexer()
     fmt = get_formatter()
-    def highlight(code):
-        return pygments.highlight(code, lexer=lexer, formatter=fmt)
-else:
-    def highlight(code):
-        return code
+    return lambda code: pygments.highlight(code, lexer=lexer, formatter=fmt)
+
+DEFAULT_HIGHLIGHT_CACHE_SIZE = 32 << 20
+
+@functools.lru_cache(maxsize=None)
+def get_highlight_cache():
+    """
+    DiskCache of highlighted function bodies or None if it is disabled with
+    ENV_DIFF_HIGHLIGHT_CACHE=false.  ENV_DIFF_HIGHLIGHT_CACHE_SIZE is its
+    maximum size in bytes.
+    """
+    if os.environ.get('ENV_DIFF_HIGHLIGHT_CACHE', 'true') == 'false':
+        return None
+    try:
+        size = int(os.environ.get('ENV_DIFF_HIGHLIGHT_CACHE_SIZE', DEFAULT_HIGHLIGHT_CACHE_SIZE))
+    except ValueError:
+        logging.warning(f"ENV_DIFF_HIGHLIGHT_CACHE_SIZE must be a number of bytes, not '{os.environ['ENV_DIFF_HIGHLIGHT_CACHE_SIZE']}'")
+        size = DEFAULT_HIGHLIGHT_CACHE_SIZE
+    return diskcache.DiskCache(os.path.join(diskcache.cache_home(), "highlight"), size)
+
+@functools.lru_cache(maxsize=None)
+def get_highlighter():
+    """
+    Function coloring shell code with pygments or returning it unchanged if
+    pygments is not installed.  Highlighted code is kept in a cache on disk
+    so that pygments is only used for code it has not colored before.
+    """
+    try:
+        import pygments
+    except ImportError:
+        return lambda code: code
+    cache = get_highlight_cache()
+    if cache is None:
+        return get_pygments_highlighter()
+    import hashlib
+    # The output only depends on these and the code
+    prefix = f"{pygments.__version__}\0Terminal256Formatter\0{','.join(POTENTIAL_STYLES)}\0".encode('utf-8')
+    def highlight_cached(code):
+        key = hashlib.sha1(prefix + code.encode('utf-8', 'surrogateescape')).hexdigest()
+        data = cache.get(key)
+        if data is not None:
+            return data.decode('utf-8', 'surrogateescape')
+        result = get_pygments_highlighter()(code)
+        cache.put(key, result.encode('utf-8', 'surrogateescape'))
+        return result
+    return highlight_cached
+
+def highlight(code):
+    return get_highlighter()(code)
 
 """ Functions operating on dictionaries with integer keys """
 def is_contiguous_array(d):
@@ -487,9 +847,23 @@ def as_sparse_array(d):
     of the bash builtin `delcare -p` """
     return '(' + ' '.join([f"[{k}]='{v}'" for k,v in sorted(d.items())]) + ')'
 
-if __name__ == "__main__":
+def run(argv=None):
+    """
+    Run main() and return the exit code
+    """
     try:
-        main()
+        main(argv)
     except FileNotFoundError as e:
-        sys.exit(1)
-        pass
+        return 1
+    except envdiff.EnvDiffError as e:
+        logging.error(f"'{e.directory}' does not appear to be a saved environment created with env-diff-save: missing {e.filename}")
+        return 1
+    except ConfigError as e:
+        logging.error(str(e))
+        return 1
+    finally:
+        timings.finish('env-diff-compare')
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(run())
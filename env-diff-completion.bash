@@ -29,21 +29,45 @@ _env_diff_compare_options=(
     -h
     --show-function-bodies
     --list-diff
+    --list-format
     -F
+    --only
+    --format
     --debug
+    --timings
 )
 _env_diff_cmd_options=(
+    --capture
+    --parallel
 )
 _env_diff_cmd_arg_options=(
     -F
+    --capture
+    --only
+    --timings
 )
 _env_diff_gencode_options=(
     --help
     --debug
+    --output
+    --only
+    --store
+    --compact
+    --timings
 )
 _env_diff_load_options=(
     --help
     --debug
+    --direct
+)
+_env_diff_snapshot_commands=(
+    pack
+    digest
+    add
+    gc
+    delta
+    compact
+    timings
 )
 _env_diff_is_arg_option(){
     local o
@@ -123,7 +147,7 @@ _env_diff_compare(){
     _init_completion || return
 
     if [[ ${cur} == -* ]] ; then
-        COMPREPLY=( $(compgen -W "${_env_diff_options[*]} ${_env_diff_compare_options[*]}" -- ${cur}) )
+        COMPREPLY=( $(compgen -W "${_env_diff_options[*]} ${_env_diff_compare_options[*]} --store --timeline" -- ${cur}) )
     fi
     _filedir -d
 }
@@ -158,7 +182,20 @@ _env_diff_load(){
     _filedir -d
 }
 
+_env_diff_snapshot(){
+    local cur prev words cword
+    _init_completion || return
+
+    if ((cword == 1)) ; then
+        COMPREPLY=( $(compgen -W "${_env_diff_snapshot_commands[*]} --help --debug" -- ${cur}) )
+        return
+    fi
+    _filedir
+}
+
 complete -F _env_diff env-diff
 complete -o default -F _env_diff_compare env-diff-compare
 complete -o default -F _env_diff_gencode env-diff-gencode
 complete -o default -F _env_diff_load env-diff-load
+complete -o default -F _env_diff_snapshot env-diff-snapshot
+complete -W "start stop status serve --socket --debug --help" env-diff-server
@@ -10,8 +10,15 @@ import sys
 import envdifflogging
 import logging
 import os
+import timings
 
-def get_args():
+def components_arg(value):
+    try:
+        return envdiff.parse_components(value)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+
+def get_args(argv=None):
     if '_env_diff_cmd' in os.environ:
         sys.argv[0] = os.environ['_env_diff_cmd']
     p = argparse.ArgumentParser(description=__doc__)
@@ -23,14 +30,35 @@ def get_args():
     p.add_argument("final", help="Final environment directory from env-diff-save")
     p.add_argument("--output", "-o", type=pathlib.Path)
     p.add_argument("--debug", action='store_true', help="Set log level to DEBUG")
-    args = p.parse_args()
+    p.add_argument("--store", metavar="STORE", help="Initial and final are names of snapshots in the store STORE")
+    p.add_argument("--only", type=components_arg, metavar="COMPONENTS",
+                   help="Comma separated list of components to generate code for (env,shell,assoc,normal,arrays,vars,shopt,set,functions,traps)")
+    p.add_argument("--compact", action='store_true',
+                   help="Generate code that is faster to source: whole arrays, grouped commands and no comments")
+    p.add_argument("--timings", metavar="FILE", default=os.environ.get('ENV_DIFF_TIMINGS'),
+                   help="Write the time of each phase to FILE as JSON and a summary on stderr")
+    args = p.parse_args(argv)
+
+    if args.store is not None:
+        import store
+        try:
+            args.initial = store.Store(args.store).snapshot_path(args.initial)
+            args.final = store.Store(args.store).snapshot_path(args.final)
+        except ValueError as e:
+            p.error(str(e))
 
     return args
 
-def main():
-    args = get_args()
+def main(argv=None):
+    args = get_args(argv)
     envdifflogging.configureLogging(level=(logging.INFO if not args.debug else logging.DEBUG))
+    timings.start(args.timings)
+    try:
+        return generate(args)
+    finally:
+        timings.finish('env-diff-gencode')
 
+def generate(args):
     try:
         import codegen
     except ModuleNotFoundError as e:
@@ -45,15 +73,21 @@ def main():
     else:
         output = open(args.output, 'w')
 
+    # Components are loaded when they are used so errors can also come from
+    # generating the code.
     try:
-        ed = envdiff.ShellEnvironmentDiff(args.initial, args.final)
+        with timings.phase("diff"):
+            ed = envdiff.ShellEnvironmentDiff(args.initial, args.final, components=args.only, config=codegen.diff_config(),
+                                              cache=envdiff.diff_cache())
+        with timings.phase("gencode"):
+            codegen.gencode(ed, output, compact=args.compact)
+        ed.save()
     except FileNotFoundError as e:
         logging.error(f"No saved environment at '{e.filename}': {e}")
         return 1
     except envdiff.EnvDiffError as e:
         logging.error(f"The directory '{e.directory}' does not appear to be a saved environment created with env-diff-save: missing '{e.filename}'")
         return 1
-    codegen.gencode(ed, output)
 
 if __name__ == "__main__":
     sys.exit(main())
@@ -0,0 +1,106 @@
+"""
+Manage the resident process that runs env-diff-compare.py and
+env-diff-generate-code.py for the shell functions when ENV_DIFF_SERVER=true
+"""
+
+import argparse
+import logging
+import os
+import signal
+import socket
+import sys
+import time
+
+import envdifflogging
+import server
+
+def get_args():
+    if '_env_diff_cmd' in os.environ:
+        sys.argv[0] = os.environ['_env_diff_cmd']
+    p = argparse.ArgumentParser(description=__doc__)
+    p.add_argument("--debug", action='store_true', help="Set log level to DEBUG")
+    p.add_argument("--socket", default=server.socket_path(), help="Path of the socket (default %(default)s)")
+    p.add_argument("command", choices=['start', 'stop', 'status', 'serve'],
+                   help="'serve' runs the server in the foreground")
+    return p.parse_args()
+
+def running(path):
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+        return True
+    except OSError:
+        return False
+    finally:
+        sock.close()
+
+def start(path):
+    """
+    Start the server in the background, detached from the terminal, and wait
+    for its socket to accept connections.
+    """
+    if running(path):
+        logging.info(f"Server already running on {path}")
+        return 0
+    if os.fork() == 0:
+        os.setsid()
+        if os.fork() != 0:
+            os._exit(0)
+        os.makedirs(os.path.dirname(path), mode=0o700, exist_ok=True)
+        log = os.open(path + ".log", os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o600)
+        devnull = os.open(os.devnull, os.O_RDONLY)
+        os.dup2(devnull, 0)
+        os.dup2(log, 1)
+        os.dup2(log, 2)
+        configure_server_logging()
+        try:
+            server.serve(path)
+        finally:
+            os._exit(0)
+    for _ in range(100):
+        if running(path):
+            logging.info(f"Server listening on {path}")
+            return 0
+        time.sleep(0.05)
+    logging.error(f"Server did not start, see {path}.log")
+    return 1
+
+def stop(path):
+    try:
+        with open(path + ".pid") as f:
+            pid = int(f.read())
+    except FileNotFoundError:
+        logging.info("Server is not running")
+        return 0
+    os.kill(pid, signal.SIGTERM)
+    return 0
+
+def configure_server_logging():
+    # The root logger is left alone for the scripts run by the children
+    handler = logging.StreamHandler(sys.stderr)
+    handler.setFormatter(logging.Formatter("[{asctime} env-diff-server {levelname}] {message}", style='{'))
+    server.logger.addHandler(handler)
+    server.logger.setLevel(logging.INFO)
+    server.logger.propagate = False
+
+def main():
+    args = get_args()
+    envdifflogging.configureLogging(level=(logging.INFO if not args.debug else logging.DEBUG))
+
+    if args.command == 'start':
+        return start(args.socket)
+    elif args.command == 'stop':
+        return stop(args.socket)
+    elif args.command == 'status':
+        if running(args.socket):
+            print(f"Server listening on {args.socket}")
+            return 0
+        print("Server is not running")
+        return 1
+    elif args.command == 'serve':
+        configure_server_logging()
+        server.serve(args.socket)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,108 @@
+"""
+Manage environments saved with env-diff-save
+"""
+
+import argparse
+import logging
+import os
+import sys
+
+import delta
+import envdiff
+import envdifflogging
+import snapshot
+import store
+import timings
+
+def get_args():
+    if '_env_diff_cmd' in os.environ:
+        sys.argv[0] = os.environ['_env_diff_cmd']
+    p = argparse.ArgumentParser(description=__doc__)
+    p.add_argument("--debug", action='store_true', help="Set log level to DEBUG")
+    sub = p.add_subparsers(dest='command', metavar='COMMAND', required=True)
+
+    pack = sub.add_parser("pack", help="Convert a saved environment to a single file")
+    pack.add_argument("source", help="Environment saved with env-diff-save")
+    pack.add_argument("output", help="Single file to create")
+    pack.add_argument("--compress", choices=sorted(snapshot.CODECS), metavar="CODEC",
+                      help=f"Compress components with CODEC ({', '.join(sorted(snapshot.CODECS))})")
+
+    digest = sub.add_parser("digest", help="Write the digests of the components of a saved environment")
+    digest.add_argument("source", help="Directory created by env-diff-save")
+
+    add = sub.add_parser("add", help="Add a saved environment to a store")
+    add.add_argument("source", help="Environment saved with env-diff-save")
+    add.add_argument("store", help="Directory of the store (created if needed)")
+    add.add_argument("name", help="Name of the snapshot in the store")
+
+    gc = sub.add_parser("gc", help="Remove objects of a store that no snapshot references")
+    gc.add_argument("store", help="Directory of the store")
+    gc.add_argument("--grace", type=int, default=3600, metavar="SECONDS",
+                    help="Keep unreferenced objects written less than SECONDS ago (default 3600)")
+
+    d = sub.add_parser("delta", help="Write a saved environment as the difference with another one")
+    d.add_argument("source", help="Environment saved with env-diff-save")
+    d.add_argument("base", help="Saved environment that the delta is relative to")
+    d.add_argument("output", help="Delta file to create")
+
+    compact = sub.add_parser("compact", help="Replace a delta by a complete single file")
+    compact.add_argument("delta", help="Delta file created with env-diff-save --base")
+    compact.add_argument("--compress", choices=sorted(snapshot.CODECS), metavar="CODEC",
+                         help=f"Compress components with CODEC ({', '.join(sorted(snapshot.CODECS))})")
+
+    t = sub.add_parser("timings", help="Write the trace of a log of timings (used by the bash functions)")
+    t.add_argument("log", help="Log of the events of the phases (see timings.py)")
+    t.add_argument("trace", help="JSON file to create")
+    t.add_argument("--command", dest='command_name', default="env-diff", help="Command that was timed")
+
+    return p.parse_args()
+
+def main():
+    args = get_args()
+    envdifflogging.configureLogging(level=(logging.INFO if not args.debug else logging.DEBUG))
+
+    try:
+        if args.command == 'pack':
+            if os.path.exists(args.output):
+                logging.error(f"Cannot create '{args.output}': already exists")
+                return 1
+            snapshot.pack(args.source, args.output, codec=args.compress)
+        elif args.command == 'digest':
+            if not os.path.isdir(args.source):
+                logging.error(f"'{args.source}' is not a directory created by env-diff-save")
+                return 1
+            envdiff.write_digests(args.source)
+        elif args.command == 'add':
+            store.Store(args.store).add(args.source, args.name)
+        elif args.command == 'delta':
+            if os.path.exists(args.output):
+                logging.error(f"Cannot create '{args.output}': already exists")
+                return 1
+            if not delta.write_delta(args.source, args.base, args.output):
+                logging.info(f"Chain of deltas from '{args.base}' is {delta.max_depth()} long, saved complete environment instead")
+        elif args.command == 'compact':
+            if not isinstance(envdiff.open_snapshot(args.delta), delta.DeltaFile):
+                logging.error(f"'{args.delta}' is not a delta")
+                return 1
+            delta.compact(args.delta, codec=args.compress)
+        elif args.command == 'timings':
+            timings.write_trace(timings.trace(timings.read_log(args.log), args.command_name), args.trace)
+        elif args.command == 'gc':
+            kept, removed = store.Store(args.store).gc(grace=args.grace)
+            logging.info(f"Removed {removed} objects, kept {kept}")
+    except FileExistsError as e:
+        logging.error(f"Cannot create '{e.filename}': already exists")
+        return 1
+    except ValueError as e:
+        logging.error(e)
+        return 1
+    except FileNotFoundError as e:
+        logging.error(f"No saved environment at '{e.filename}': {e}")
+        return 1
+    except envdiff.EnvDiffError as e:
+        logging.error(f"'{e.directory}' does not appear to be a saved environment created with env-diff-save: missing {e.filename}")
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,90 +1,881 @@
 import os
+import re
 import json
+import shlex
 import sys
 import logging
 import envdifflogging
+import timings
 
 class EnvDiffError(Exception):
     def __init__(self, directory, filename):
         self.directory = directory
         self.filename = filename
     def __str__(self):
-        return f"The directory {self.directory} is missing {self.filename}"
+        return f"The saved environment {self.directory} is missing {self.filename}"
 
+# Components of a saved environment.  They are the attributes of
+# ShellEnvironmentData and ShellEnvironmentDiff.
+COMPONENTS = [
+    'env_vars',
+    'shell_vars',
+    'assoc_arrays',
+    'normal_arrays',
+    'shopt',
+    'shopt_set',
+    'functions',
+    'traps',
+]
 
-class ShellEnvironmentData:
+# Short names accepted by parse_components() for the --only option
+COMPONENT_NAMES = {
+    'env': ['env_vars'],
+    'shell': ['shell_vars'],
+    'assoc': ['assoc_arrays'],
+    'normal': ['normal_arrays'],
+    'arrays': ['assoc_arrays', 'normal_arrays'],
+    'vars': ['env_vars', 'shell_vars', 'assoc_arrays', 'normal_arrays'],
+    'shopt': ['shopt'],
+    'set': ['shopt_set'],
+    'functions': ['functions'],
+    'traps': ['traps'],
+}
+
+def parse_components(selectors: str):
     """
-    Class ShellEnvironmentData holds the all the data saved into the temp files
+    Convert a comma separated list of component names like 'env,functions' to
+    the list of the corresponding components in the order of COMPONENTS.  Both
+    the short names of COMPONENT_NAMES and the names in COMPONENTS are
+    accepted.
+    """
+    selected = set()
+    for s in selectors.split(','):
+        s = s.strip()
+        if s in COMPONENTS:
+            selected.add(s)
+        elif s in COMPONENT_NAMES:
+            selected.update(COMPONENT_NAMES[s])
+        else:
+            raise ValueError(f"Unknown component '{s}', valid names are {', '.join(COMPONENT_NAMES)}")
+    return [c for c in COMPONENTS if c in selected]
+
+_name_re = re.compile(r'[A-Za-z_][A-Za-z0-9_]*')
+
+class NameIndex:
+    """
+    Lookup of the value associated with the first key of a dictionary that a
+    variable name matches with re.fullmatch().  Keys that are plain variable
+    names are looked up in a dictionary and consecutive patterns are combined
+    into a single regular expression compiled once so that the cost of a
+    lookup does not grow with the number of keys.  Patterns with groups or
+    global flags like (?i) are compiled on their own since combining them
+    would change the numbers of their groups or the flags of the others.
+    Plain names take precedence over patterns.
+    """
+    def __init__(self, mapping: dict):
+        self.exact = {}
+        # (regex, values) tried in order where values are those of the
+        # patterns combined in regex
+        self.regexes = []
+        combined = []
+        for key, value in mapping.items():
+            if _name_re.fullmatch(key):
+                self.exact[key] = value
+                continue
+            pattern = re.compile(key)
+            if pattern.groups or pattern.flags & ~re.UNICODE:
+                self._combine(combined)
+                combined = []
+                self.regexes.append((pattern, [value]))
+            else:
+                combined.append((key, value))
+        self._combine(combined)
+
+    def _combine(self, patterns):
+        # Each pattern is wrapped in a named group so that the match tells
+        # which one matched.  Alternatives are tried in order which gives the
+        # same result as trying the patterns one by one.
+        if patterns:
+            regex = re.compile('|'.join(f'(?P<_p{n}>{k})' for n, (k, _) in enumerate(patterns)))
+            self.regexes.append((regex, [v for _, v in patterns]))
+
+    def get(self, name, default=None):
+        if name in self.exact:
+            return self.exact[name]
+        for regex, values in self.regexes:
+            m = regex.fullmatch(name)
+            if m:
+                return values[int(m.lastgroup[2:])] if len(values) > 1 else values[0]
+        return default
+
+
+################################################################################
+# Parsing of the output of `declare -p`.  The capture mode 'declare' of
+# env-diff-save dumps all variables with this single builtin instead of
+# listing them with compgen and converting each one to JSON with jq.
+#
+# Values are printed in one of these forms:
+#     declare -- NAME="value with \" \\ \$ and \` escaped"
+#     declare -- NAME=$'ANSI-C quoted value\n'
+#     declare -a NAME=([0]="a" [1]=$'b\n')
+#     declare -A NAME=([key]="v" ["key with spaces"]="v" [$'k\n']="v" )
+#     declare -a NAME='([0]="a" [1]="b")'     (BASH 4.3 and older)
+#     declare -- NAME                         (declared but not set)
+################################################################################
+class DeclareParseError(Exception):
+    def __init__(self, data, pos, reason):
+        self.line = data.count(b'\n', 0, pos) + 1
+        self.reason = reason
+    def __str__(self):
+        return f"Could not parse declare output at line {self.line}: {self.reason}"
+
+_declare_re = re.compile(rb'declare (-[a-zA-Z]+|--) ([^=\n]+)(=?)')
+_double_quoted_re = re.compile(rb'"([^"\\]*(?:\\.[^"\\]*)*)"', re.DOTALL)
+_ansi_c_re = re.compile(rb"\$'([^'\\]*(?:\\.[^'\\]*)*)'", re.DOTALL)
+_single_quoted_re = re.compile(rb"'((?:[^']|'\\'')*)'", re.DOTALL)
+_bare_word_re = re.compile(rb'[^\s()]*')
+_bare_key_re = re.compile(rb'[^\]]*')
+_double_quote_escape_re = re.compile(rb'\\([\\"$`])')
+_ansi_c_escape_re = re.compile(rb'\\(x[0-9a-fA-F]{1,2}|u[0-9a-fA-F]{1,4}|U[0-9a-fA-F]{1,8}|[0-7]{1,3}|c.|.)', re.DOTALL)
+_ansi_c_simple_escapes = {
+    b'a': b'\a', b'b': b'\b', b'e': b'\x1b', b'E': b'\x1b', b'f': b'\f',
+    b'n': b'\n', b'r': b'\r', b't': b'\t', b'v': b'\v',
+    b'\\': b'\\', b"'": b"'", b'"': b'"', b'?': b'?',
+}
+
+def _decode(value: bytes):
+    return value.decode('utf-8', 'backslashreplace')
+
+def _ansi_c_unescape(match):
+    esc = match.group(1)
+    c = esc[:1]
+    if c in _ansi_c_simple_escapes and len(esc) == 1:
+        return _ansi_c_simple_escapes[c]
+    if c == b'x' and len(esc) > 1:
+        return bytes([int(esc[1:], 16)])
+    if c in (b'u', b'U') and len(esc) > 1:
+        return chr(int(esc[1:], 16)).encode('utf-8', 'surrogatepass')
+    if c == b'c' and len(esc) > 1:
+        return bytes([esc[1] & 0x1f])
+    if c.isdigit() and c < b'8':
+        return bytes([int(esc, 8) & 0xff])
+    # Unknown escapes are kept as is by BASH
+    return b'\\' + esc
+
+def _parse_word(data, pos):
+    """
+    Parse one quoted or unquoted word starting at pos.  Return the value of
+    the word as bytes and the position just after it.
+    """
+    c = data[pos:pos+1]
+    if c == b'"':
+        m = _double_quoted_re.match(data, pos)
+        if m is None:
+            raise DeclareParseError(data, pos, "unterminated double quoted string")
+        return _double_quote_escape_re.sub(rb'\1', m.group(1)), m.end()
+    if c == b'$' and data[pos+1:pos+2] == b"'":
+        m = _ansi_c_re.match(data, pos)
+        if m is None:
+            raise DeclareParseError(data, pos, "unterminated ANSI-C quoted string")
+        return _ansi_c_escape_re.sub(_ansi_c_unescape, m.group(1)), m.end()
+    if c == b"'":
+        m = _single_quoted_re.match(data, pos)
+        if m is None:
+            raise DeclareParseError(data, pos, "unterminated single quoted string")
+        return m.group(1).replace(b"'\\''", b"'"), m.end()
+    m = _bare_word_re.match(data, pos)
+    return m.group(0), m.end()
+
+def _parse_compound(data, pos):
+    """
+    Parse a compound array assignment '([k]=v [k]=v ...)' starting at pos.
+    Return a dictionary of keys to values and the position just after it.
+    """
+    array = {}
+    pos += 1
+    while True:
+        while data[pos:pos+1] == b' ':
+            pos += 1
+        c = data[pos:pos+1]
+        if c == b')':
+            return array, pos + 1
+        if c != b'[':
+            raise DeclareParseError(data, pos, "expected '[' or ')' in array assignment")
+        pos += 1
+        if data[pos:pos+1] in (b'"', b"'") or data[pos:pos+2] == b"$'":
+            key, pos = _parse_word(data, pos)
+        else:
+            m = _bare_key_re.match(data, pos)
+            key, pos = m.group(0), m.end()
+        if data[pos:pos+2] != b']=':
+            raise DeclareParseError(data, pos, "expected ']=' after array key")
+        value, pos = _parse_word(data, pos + 2)
+        array[_decode(key)] = _decode(value)
+
+def parse_declare_p(data: bytes):
+    """
+    Split the output of `declare -p` into the same components that are saved
+    as JSON by the 'compgen' capture mode.  When a name is declared more than
+    once, the last declaration wins.
+
+    Variables that are declared but not set are omitted like they are by
+    `compgen -v` in the 'compgen' mode.
+    """
+    env_vars = {}
+    shell_vars = {}
+    assoc_arrays = {}
+    normal_arrays = {}
+    components = (env_vars, shell_vars, assoc_arrays, normal_arrays)
+    pos = 0
+    end = len(data)
+    while pos < end:
+        m = _declare_re.match(data, pos)
+        if m is None:
+            raise DeclareParseError(data, pos, "expected 'declare'")
+        flags, name, has_value = m.group(1), _decode(m.group(2)), m.group(3)
+        pos = m.end()
+        value = None
+        if has_value:
+            c = data[pos:pos+1]
+            if c == b'(':
+                value, pos = _parse_compound(data, pos)
+            else:
+                value, pos = _parse_word(data, pos)
+                if value.startswith(b'(') and (b'a' in flags or b'A' in flags):
+                    # BASH 4.3 and older quote the whole compound assignment
+                    value, _ = _parse_compound(value, 0)
+                else:
+                    value = _decode(value)
+        if data[pos:pos+1] not in (b'\n', b''):
+            raise DeclareParseError(data, pos, "expected end of line after declaration")
+        pos += 1
+
+        for c in components:
+            c.pop(name, None)
+        if value is None:
+            continue
+        if b'A' in flags:
+            assoc_arrays[name] = value
+        elif b'a' in flags:
+            normal_arrays[name] = value
+        elif b'x' in flags:
+            env_vars[name] = value
+        else:
+            shell_vars[name] = value
+
+    return {
+        'env_vars': env_vars,
+        'shell_vars': shell_vars,
+        'assoc_arrays': assoc_arrays,
+        'normal_arrays': normal_arrays,
+    }
+
+
+################################################################################
+# Splitting of the saved functions.  All functions are saved as a single stream
+# in functions.bash where each function is a NUL byte, its name on a line and
+# the output of `declare -f NAME`:
+#     \0NAME
+#     NAME () 
+#     { 
+#         BODY
+#     }
+# Bash strings cannot contain NUL bytes so the stream is split on them and
+# nothing in a body, like a line of a here-document that looks like the header
+# of a function, can be taken for the start of another function.
+################################################################################
+def split_function_dump(data: bytes):
+    """
+    Split the contents of functions.bash (see above) into a dictionary of
+    function names to the lines of their bodies, the header line 'NAME () '
+    being excluded.
+    """
+    if data and not data.startswith(b'\0'):
+        raise ValueError("The saved functions do not start with a NUL byte")
+    functions = {}
+    for record in data.split(b'\0')[1:]:
+        name, _, definition = record.partition(b'\n')
+        header_end = definition.find(b'\n')
+        if header_end == -1:
+            raise ValueError(f"Truncated definition of the saved function '{_decode(name)}'")
+        functions[_decode(name)] = [_decode(l) for l in definition[header_end+1:].splitlines()]
+    return functions
+
+
+def parse_trap_p(data: bytes):
+    """
+    Parse the output of `trap -p` into a dictionary of signal names to
+    commands.  Each trap is printed as "trap -- 'COMMAND' SIGNAL" where COMMAND
+    is single quoted and may span multiple lines.
+    """
+    words = shlex.split(_decode(data), comments=False, posix=True)
+    if len(words) % 4 != 0:
+        raise ValueError(f"Could not parse output of trap -p: {len(words)} words is not a multiple of 4")
+    traps = {}
+    for i in range(0, len(words), 4):
+        if words[i] != 'trap' or words[i+1] != '--':
+            raise ValueError(f"Could not parse output of trap -p at word {i}: '{words[i]}'")
+        traps[words[i+3]] = words[i+2]
+    return traps
+
+
+class SnapshotDirectory:
+    """
+    Components of an environment saved by env-diff-save as a directory of
+    files.  Environments saved by older versions with one JSON file per kind of
+    variable, one file per function and traps in JSON are also supported.
     """
     def __init__(self, data_dir):
-        if not os.path.isdir(data_dir):
-            raise FileNotFoundError(2, "No such directory", data_dir)
+        self.path = data_dir
+        self._variables = None
+        self._variables_lock = None
 
+    def load(self, component):
         try:
-            with open(os.path.join(data_dir, f"env_vars.json")) as f:
-                self.env_vars = json.load(f)
-            with open(os.path.join(data_dir, f"shell_vars.json")) as f:
-                self.shell_vars = json.load(f)
-            with open(os.path.join(data_dir, f"assoc_arrays.json")) as f:
-                self.assoc_arrays = json.load(f)
-            with open(os.path.join(data_dir, f"normal_arrays.json")) as f:
-                self.normal_arrays = json.load(f)
-            self.shopt = {}
-            with open(os.path.join(data_dir, f"shopt.txt")) as f:
-                for line in f:
-                    opt, val = line.split()
-                    self.shopt[opt] = val
-            self.functions = {}
-            self.shopt_set = {}
-            with open(os.path.join(data_dir, f"shopt_set.txt")) as f:
-                for line in f:
-                    opt, val = line.split()
-                    self.shopt_set[opt] = val
-            with open(os.path.join(data_dir, f"func_names.txt")) as f:
-                for name in f.read().splitlines():
-                    with open(os.path.join(data_dir, f"functions", f"BASH_FUNC_{name}.bash"), 'rb') as func:
-                        lines = func.read().splitlines()[1:]
-                        self.functions[name] = [l.decode('utf-8', 'backslashreplace') for l in lines]
-            with open(os.path.join(data_dir, f"traps.json")) as f:
-                self.traps = json.load(f)
+            return getattr(self, f"_load_{component}")()
         except FileNotFoundError as e:
-            raise EnvDiffError(data_dir, e.filename)
+            raise EnvDiffError(self.path, e.filename)
+
+    def _file(self, filename):
+        return os.path.join(self.path, filename)
+
+    def digests(self):
+        """ Digests written by env-diff-save or None for older saves """
+        try:
+            with open(self._file("digests.json")) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def _load_variables(self, component):
+        if os.path.isfile(self._file("declare.txt")):
+            # Saved with 'env-diff-save --capture declare'.  The four kinds of
+            # variables come from the same file which is parsed only once.
+            if self._variables_lock is None:
+                self._variables_lock = _lock()
+            with self._variables_lock:
+                if self._variables is None:
+                    with open(self._file("declare.txt"), 'rb') as f:
+                        self._variables = parse_declare_p(f.read())
+            return self._variables[component]
+        with open(self._file(f"{component}.json")) as f:
+            return json.load(f)
+
+    def _load_env_vars(self):
+        return self._load_variables('env_vars')
+    def _load_shell_vars(self):
+        return self._load_variables('shell_vars')
+    def _load_assoc_arrays(self):
+        return self._load_variables('assoc_arrays')
+    def _load_normal_arrays(self):
+        return self._load_variables('normal_arrays')
+
+    def _load_options(self, filename):
+        options = {}
+        with open(self._file(filename)) as f:
+            for line in f:
+                opt, val = line.split()
+                options[opt] = val
+        return options
+
+    def _load_shopt(self):
+        return self._load_options("shopt.txt")
+    def _load_shopt_set(self):
+        return self._load_options("shopt_set.txt")
+
+    def _load_functions(self):
+        if os.path.isfile(self._file("functions.bash")):
+            with open(self._file("functions.bash"), 'rb') as f:
+                return split_function_dump(f.read())
+        # Environments saved with one file per function
+        with open(self._file("func_names.txt")) as f:
+            names = f.read().splitlines()
+        contents = read_files([os.path.join(self.path, "functions", f"BASH_FUNC_{name}.bash") for name in names])
+        return {name: [l.decode('utf-8', 'backslashreplace') for l in data.splitlines()[1:]]
+                for name, data in zip(names, contents)}
+
+    def _load_traps(self):
+        if os.path.isfile(self._file("traps.txt")):
+            with open(self._file("traps.txt"), 'rb') as f:
+                return parse_trap_p(f.read())
+        with open(self._file("traps.json")) as f:
+            return json.load(f)
+
+
+################################################################################
+# Concurrent loading.  On network filesystems, the time to open each file
+# dominates the time to load a saved environment.  The components of the
+# environments being compared are loaded by the threads of component_pool()
+# and many small files like the objects of a store or the functions of old
+# saves are read by the threads of a separate pool so that a component waiting
+# for its files can never take all the threads that would read them.
+################################################################################
+DEFAULT_LOAD_THREADS = 8
+_pools = {}
+
+def load_threads():
+    """ Maximum number of threads of each pool (ENV_DIFF_LOAD_THREADS) """
+    try:
+        return max(1, int(os.environ.get('ENV_DIFF_LOAD_THREADS', DEFAULT_LOAD_THREADS)))
+    except ValueError:
+        raise ValueError(f"ENV_DIFF_LOAD_THREADS must be an integer, not '{os.environ['ENV_DIFF_LOAD_THREADS']}'")
+
+def _pool(kind, threads):
+    # concurrent.futures takes a few milliseconds to import and is only
+    # needed when there is something to load
+    import concurrent.futures
+    if (kind, threads) not in _pools:
+        _pools[(kind, threads)] = concurrent.futures.ThreadPoolExecutor(max_workers=threads, thread_name_prefix=f"env-diff-{kind}")
+    return _pools[(kind, threads)]
+
+def component_pool(threads):
+    return _pool('component', threads)
+
+def _lock():
+    import threading
+    return threading.Lock()
+
+def _read_file(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+def read_files(paths, threads=None):
+    """
+    Contents of the files paths as a list of bytes in the same order, read
+    concurrently by up to threads threads (default load_threads())
+    """
+    threads = load_threads() if threads is None else threads
+    if threads <= 1 or len(paths) <= 1:
+        return [_read_file(p) for p in paths]
+    return list(_pool('file', threads).map(_read_file, paths))
+
+
+def canonical_json(value):
+    """ Encoding of value that is hashed to get its digest """
+    return json.dumps(value, sort_keys=True, separators=(',', ':')).encode('utf-8')
+
+def digest(data: bytes):
+    # Importing hashlib takes a few milliseconds that programs that don't
+    # compute digests should not pay
+    import hashlib
+    return hashlib.sha1(data).hexdigest()
+
+def compute_digests(source):
+    """
+    Compute a digest of each entry of each component of a saved environment
+    and a digest of each component from those of its entries:
+
+        {"components": {COMPONENT: DIGEST}, "entries": {COMPONENT: {NAME: DIGEST}}}
+
+    The digests are computed on the loaded values so they are the same for
+    every capture mode and storage format.
+    """
+    digests = {'components': {}, 'entries': {}}
+    for c in COMPONENTS:
+        entries = {name: digest(canonical_json(value)) for name, value in source.load(c).items()}
+        digests['entries'][c] = entries
+        digests['components'][c] = digest(canonical_json(sorted(entries.items())))
+    return digests
+
+def write_digests(data_dir):
+    """
+    Write the digests of the environment saved in the directory data_dir to
+    digests.json in that directory.
+    """
+    digests = compute_digests(SnapshotDirectory(data_dir))
+    path = os.path.join(data_dir, "digests.json")
+    tmp = f"{path}.{os.getpid()}"
+    with open(tmp, 'w') as f:
+        json.dump(digests, f, separators=(',', ':'))
+    os.replace(tmp, path)
+
+
+def open_snapshot(path, depth=0):
+    """
+    Return an object whose load(component) method gives the components of the
+    environment saved at path by env-diff-save which can be a directory, a
+    single file, the manifest of a snapshot in a store or a delta.  The depth
+    is the number of deltas that lead to path.
+    """
+    if os.path.isdir(path):
+        return SnapshotDirectory(path)
+    if os.path.isfile(path):
+        with open(path, 'rb') as f:
+            magic = f.readline().split(b' ', 1)[0]
+        if magic == b"envdiff-manifest":
+            import store
+            return store.Manifest(path)
+        if magic == b"envdiff-delta":
+            import delta
+            return delta.DeltaFile(path, depth=depth)
+        import snapshot
+        return snapshot.SnapshotFile(path)
+    raise FileNotFoundError(2, "No such file or directory", path)
+
+
+class ShellEnvironmentData:
+    """
+    Class ShellEnvironmentData holds the all the data saved into the temp files
+
+    Each component (see COMPONENTS) is loaded the first time it is accessed so
+    that a program that only looks at environment variables never parses the
+    saved functions.
+    """
+    def __init__(self, data_dir):
+        self.source = open_snapshot(data_dir)
+        # Name of the environment in the phases of timings
+        self.label = os.path.basename(os.path.normpath(str(data_dir)))
+        self._digests = False
+        self._pending = {}
+
+    def prefetch(self, components, pool):
+        """
+        Start loading components that have not been loaded yet in the threads
+        of pool (a concurrent.futures.Executor).  Accessing one of them waits
+        for its load to finish.
+        """
+        for c in components:
+            if c not in self.__dict__ and c not in self._pending:
+                self._pending[c] = pool.submit(self._load, c, True)
+
+    def digests(self):
+        """ Digests saved with the environment (see compute_digests) or None """
+        if self._digests is False:
+            self._digests = self.source.digests()
+        return self._digests
+
+    def __getattr__(self, name):
+        # Only called when the attribute has not been set yet
+        if name not in COMPONENTS:
+            raise AttributeError(f"'{type(self).__name__}' object has no attribute '{name}'")
+        future = self._pending.pop(name, None)
+        value = future.result() if future is not None else self._load(name)
+        setattr(self, name, value)
+        return value
+
+    def _load(self, component, concurrent=False):
+        with timings.phase(f"load {component} {self.label}", concurrent):
+            return self.source.load(component)
+
+_glob_re = re.compile(r'[A-Za-z0-9_*?-]*[*?][A-Za-z0-9_*?-]*')
+
+class DiffConfig:
+    """
+    Entries of the environment that are left out of a diff
+
+    ignored maps components to lists of names of entries to ignore.  A name
+    made of the characters of variable and function names and '*' or '?' is a
+    glob, other names that are not plain variable names are regular expressions
+    like the names of colon_lists in the config file.  Ignored entries are
+    removed before any value is compared.
+    """
+    def __init__(self, ignored=None):
+        self.ignored = {}
+        # Names as given which identify the config in the keys of the diff cache
+        self.names = {}
+        for c, names in (ignored or {}).items():
+            if names:
+                self.ignored[c] = NameIndex({_ignore_pattern(n): True for n in names})
+                self.names[c] = sorted(names)
+
+    @classmethod
+    def from_config(cls, config):
+        """
+        DiffConfig from the dictionary of the config file (see 'env-diff
+        --help') where the lists of ignored names that are not given have
+        default values
+        """
+        ignored = {}
+        for key, components in IGNORE_SECTIONS.items():
+            names = config[key] if key in config else DEFAULT_IGNORED.get(key, [])
+            for c in components:
+                ignored[c] = list(ignored.get(c, [])) + list(names or [])
+        return cls(ignored)
+
+    def ignore(self, component):
+        """
+        Function telling if an entry of component is ignored or None if
+        nothing is ignored
+        """
+        index = self.ignored.get(component)
+        if index is None:
+            return None
+        return lambda name: index.get(name, False)
+
+def _ignore_pattern(name):
+    if _glob_re.fullmatch(name):
+        return name.replace('?', '.').replace('*', '.*')
+    return name
+
+# Sections of the config file and the components they apply to
+IGNORE_SECTIONS = {
+    'ignored_variables': ['env_vars', 'shell_vars'],
+    'ignored_normal_arrays': ['normal_arrays'],
+    'ignored_assoc_arrays': ['assoc_arrays'],
+    'ignored_functions': ['functions'],
+}
+
+# Used for the sections that are not in the config file
+DEFAULT_IGNORED = {
+    'ignored_variables': ['BASHPID', 'BASH_SUBSHELL', 'EPOCHREALTIME',
+                          'EPOCHSECONDS', 'RANDOM', 'SRANDOM', 'SECONDS'],
+    'ignored_normal_arrays': ['BASH_LINENO'],
+}
+
 
 class EnvComponentDiff:
     """
     Differences between two components of the shell environment
+
+    The initial and final components i and f are dictionaries or functions
+    returning them.  If digests, a pair of dictionaries of names to digests of
+    the values (see compute_digests), is given, the changes are found by
+    comparing digests and i and f are only called when the attributes initial
+    or final are accessed.  The entries for which the function ignored returns
+    True are not in any of the sets of names and their values are not compared.
     """
-    def __init__(self, i: dict, f: dict):
-        # TODO:  Deal with ignored variables
+    def __init__(self, i, f, digests=None, ignored=None):
         # (we don't care about colon lists here because that's just for how
         # we display variable differences)
-        # TODO: Here we could remove from new, deleted, changed, the names that
-        # - special_variables
-        # - begin with _env_diff, env-diff, or _env-diff
-        self.initial = i
-        self.final = f
-        self.new = set(f.keys()) - set(i.keys())
-        self.deleted = set(i.keys()) - set(f.keys())
-        self.common = set(i.keys()).intersection(set(f.keys()))
+        self._initial = i
+        self._final = f
+        self._digests = digests
+        if digests is None:
+            i, f = self.initial, self.final
+        else:
+            i, f = digests
+        initial_names = set(i.keys())
+        final_names = set(f.keys())
+        if ignored is not None:
+            initial_names = {n for n in initial_names if not ignored(n)}
+            final_names = {n for n in final_names if not ignored(n)}
+        self.new = final_names - initial_names
+        self.deleted = initial_names - final_names
+        self.common = initial_names & final_names
         self.changed = set(filter(lambda v: i[v] != f[v], self.common))
 
+    @property
+    def initial(self):
+        if callable(self._initial):
+            self._initial = self._initial()
+        return self._initial
+
+    @property
+    def final(self):
+        if callable(self._final):
+            self._final = self._final()
+        return self._final
+
+    def renamed(self):
+        """
+        Dictionary of deleted names to new names having the same value.  Values
+        are compared by digest.  When several new entries have the value of a
+        deleted one, they are paired in sorted order.
+        """
+        if not self.deleted or not self.new:
+            return {}
+        if self._digests is not None:
+            initial, final = self._digests
+        else:
+            initial = {n: digest(canonical_json(self.initial[n])) for n in self.deleted}
+            final = {n: digest(canonical_json(self.final[n])) for n in self.new}
+        new_by_digest = {}
+        for name in sorted(self.new):
+            new_by_digest.setdefault(final[name], []).append(name)
+        renamed = {}
+        for name in sorted(self.deleted):
+            candidates = new_by_digest.get(initial[name])
+            if candidates:
+                renamed[name] = candidates.pop(0)
+        return renamed
+
+    def to_cache(self, full=False):
+        """
+        Dictionary of the sets of names, the values needed to report the
+        changes (all values if full) and the digests of the deleted and new
+        entries for renamed() from which from_cache() makes the same diff
+        """
+        if self.new or self.deleted or self.changed or full:
+            i, f = self.initial, self.final
+        else:
+            i, f = {}, {}
+        if self._digests is not None:
+            di, df = self._digests
+        else:
+            di = {n: digest(canonical_json(i[n])) for n in self.deleted}
+            df = {n: digest(canonical_json(f[n])) for n in self.new}
+        return {
+            'new': sorted(self.new),
+            'deleted': sorted(self.deleted),
+            'common': sorted(self.common),
+            'changed': sorted(self.changed),
+            'initial': i if full else {n: i[n] for n in self.deleted | self.changed},
+            'final': f if full else {n: f[n] for n in self.new | self.changed},
+            'digests': [{n: di[n] for n in self.deleted}, {n: df[n] for n in self.new}],
+        }
+
+    @classmethod
+    def from_cache(cls, data):
+        d = cls.__new__(cls)
+        d._initial = data['initial']
+        d._final = data['final']
+        d._digests = tuple(data['digests'])
+        d.new = set(data['new'])
+        d.deleted = set(data['deleted'])
+        d.common = set(data['common'])
+        d.changed = set(data['changed'])
+        return d
+
+
+################################################################################
+# Cache of diffs.  A diff only depends on the contents of both environments,
+# the components compared and the ignored entries so it can be reused by every
+# env-diff-compare, env-diff-gencode and env-diff-load of the same pair of
+# environments.  Entries are keyed by the digests of the components so saves
+# without digests are never cached.
+################################################################################
+# Part of the keys, changed when the format of the entries changes
+DIFF_CACHE_VERSION = 1
+DEFAULT_DIFF_CACHE_SIZE = 64 << 20
+# Small components stored whole because code generation looks at entries
+# that have not changed like the final value of expand_aliases
+CACHED_IN_FULL = ('shopt', 'shopt_set', 'traps')
+
+def diff_cache():
+    """
+    DiskCache of diffs if it is enabled with ENV_DIFF_DIFF_CACHE=true or None.
+    ENV_DIFF_DIFF_CACHE_SIZE is its maximum size in bytes.  The cache is off by
+    default since the diffs have the values of the variables, secrets
+    included.
+    """
+    if os.environ.get('ENV_DIFF_DIFF_CACHE') != 'true':
+        return None
+    import diskcache
+    try:
+        size = int(os.environ.get('ENV_DIFF_DIFF_CACHE_SIZE', DEFAULT_DIFF_CACHE_SIZE))
+    except ValueError:
+        logging.warning(f"ENV_DIFF_DIFF_CACHE_SIZE must be a number of bytes, not '{os.environ['ENV_DIFF_DIFF_CACHE_SIZE']}'")
+        size = DEFAULT_DIFF_CACHE_SIZE
+    return diskcache.DiskCache(os.path.join(diskcache.cache_home(), "diffs"), size)
+
+
+def identical_component(before, after, component):
+    """
+    True if both saved environments have digests and their digests for
+    component are the same.  False means that we don't know.
+    """
+    b, a = before.digests(), after.digests()
+    return b is not None and a is not None \
+        and b['components'][component] == a['components'][component]
+
 
 class ShellEnvironmentDiff:
     """
     Complete set of differences between all components of the shell environment
+
+    If components is given, only those components are loaded and compared.
+    The others are empty diffs.  When both environments have digests, the
+    components whose digests are the same are not loaded at all and the entries
+    of the others are compared by digest instead of by value.  The entries
+    ignored by config (a DiffConfig) are left out.
+
+    The components of both environments that need to be loaded are loaded
+    concurrently by up to threads threads (default load_threads()).
+
+    If cache (a DiskCache, see diff_cache()) is given and both environments
+    have digests, the diff is looked up in it with a key made from the digests
+    of the components and from config and nothing else is loaded if it is
+    found.  Otherwise save() stores it in the cache once it has been used.
     """
-    def __init__(self, before, after):
+    def __init__(self, before, after, components=None, config=None, threads=None, cache=None):
         before = before if isinstance(before, ShellEnvironmentData) else ShellEnvironmentData(before)
         after = after if isinstance(after, ShellEnvironmentData) else ShellEnvironmentData(after)
+        self.components = list(COMPONENTS) if components is None else list(components)
+        self.cached = False
+        self._cache = None
+        if cache is not None and before.digests() is not None and after.digests() is not None:
+            key = digest(canonical_json([DIFF_CACHE_VERSION, before.digests()['components'], after.digests()['components'],
+                                         self.components, config.names if config is not None else {}]))
+            with timings.phase("diff cache lookup"):
+                found = self._load_cached(cache.get(key))
+            if found:
+                return
+            self._cache, self._cache_key = cache, key
 
-        self.env_vars = EnvComponentDiff(before.env_vars, after.env_vars)
-        self.shell_vars = EnvComponentDiff(before.shell_vars, after.shell_vars)
-        self.functions = EnvComponentDiff(before.functions, after.functions)
-        self.shopt_set = EnvComponentDiff(before.shopt_set, after.shopt_set)
-        self.shopt = EnvComponentDiff(before.shopt, after.shopt)
-        self.assoc_arrays = EnvComponentDiff(before.assoc_arrays, after.assoc_arrays)
-        self.normal_arrays = EnvComponentDiff(before.normal_arrays, after.normal_arrays)
-        self.traps = EnvComponentDiff(before.traps, after.traps)
+        # Components with the same digest are not loaded.  The others are
+        # needed either to find the changes or to report them.
+        needed = [c for c in self.components if not identical_component(before, after, c)]
+        threads = load_threads() if threads is None else threads
+        if threads > 1 and len(needed) > 0:
+            pool = component_pool(threads)
+            before.prefetch(needed, pool)
+            after.prefetch(needed, pool)
+
+        for c in COMPONENTS:
+            if c not in self.components:
+                setattr(self, c, EnvComponentDiff({}, {}))
+                continue
+            # Components are only loaded if there are changes to look at.
+            i = lambda c=c: getattr(before, c)
+            f = lambda c=c: getattr(after, c)
+            ignored = config.ignore(c) if config is not None else None
+            with timings.phase(f"diff {c}"):
+                if identical_component(before, after, c):
+                    entries = before.digests()['entries'][c]
+                    setattr(self, c, EnvComponentDiff(i, f, digests=(entries, entries), ignored=ignored))
+                elif before.digests() is not None and after.digests() is not None:
+                    setattr(self, c, EnvComponentDiff(i, f, digests=(before.digests()['entries'][c], after.digests()['entries'][c]), ignored=ignored))
+                else:
+                    setattr(self, c, EnvComponentDiff(i, f, ignored=ignored))
+
+    def _load_cached(self, data):
+        if data is None:
+            return False
+        try:
+            cached = json.loads(data)
+            diffs = {c: EnvComponentDiff.from_cache(cached[c]) for c in self.components}
+        except (ValueError, KeyError, TypeError):
+            logging.debug("Ignoring invalid entry of the diff cache")
+            return False
+        for c in COMPONENTS:
+            setattr(self, c, diffs.get(c) or EnvComponentDiff({}, {}))
+        self.cached = True
+        return True
+
+    def save(self):
+        """
+        Store the diff in the cache given to the constructor if it was not
+        found there.  This loads the values of the changed entries so it is
+        best called after they have been used.
+        """
+        if self._cache is None:
+            return
+        with timings.phase("diff cache save"):
+            data = {c: getattr(self, c).to_cache(full=c in CACHED_IN_FULL) for c in self.components}
+            self._cache.put(self._cache_key, json.dumps(data, separators=(',', ':')).encode('utf-8'))
+            self._cache.close()
+        self._cache = None
+
+    def records(self):
+        """
+        Generate a dictionary for each deleted, new or changed entry:
+
+            {"component": COMPONENT, "name": NAME, "kind": "deleted", "old": VALUE}
+            {"component": COMPONENT, "name": NAME, "kind": "new", "new": VALUE}
+            {"component": COMPONENT, "name": NAME, "kind": "changed", "old": VALUE, "new": VALUE}
+
+        Components are loaded one at a time as the records are generated.
+        """
+        for c in self.components:
+            d = getattr(self, c)
+            if not (d.deleted or d.new or d.changed):
+                continue
+            for name in sorted(d.deleted):
+                yield {'component': c, 'name': name, 'kind': 'deleted', 'old': d.initial[name]}
+            for name in sorted(d.new):
+                yield {'component': c, 'name': name, 'kind': 'new', 'new': d.final[name]}
+            for name in sorted(d.changed):
+                yield {'component': c, 'name': name, 'kind': 'changed', 'old': d.initial[name], 'new': d.final[name]}
 
     def deleted_env_var_moved(self, name):
         return name in self.shell_vars.new or name in self.normal_arrays.new or name in self.assoc_arrays.new
@@ -94,3 +885,83 @@ class ShellEnvironmentDiff:
         return name in self.env_vars.new or name in self.shell_vars.new or name in self.assoc_arrays.new
     def deleted_assoc_array_moved(self, name):
         return  name in self.env_vars.new or name in self.shell_vars.new or name in self.normal_arrays.new
+
+
+class ShellEnvironmentTimeline:
+    """
+    Changes along a sequence of saved environments S0, S1, ..., Sn like one
+    snapshot taken after each `module load`
+
+    Each environment is loaded once: the ShellEnvironmentData of Sk is the
+    final environment of the diff of Sk-1 and Sk and the initial one of the
+    diff of Sk and Sk+1, and an environment given more than once is the same
+    ShellEnvironmentData.  Adjacent environments are compared with a
+    ShellEnvironmentDiff made with components, config, threads and cache and a
+    pair of environments that comes back is only compared once.
+
+    history() gives the steps at which each entry changed and
+    element_history() those of the elements of a list variable like PATH.
+    """
+    def __init__(self, snapshots, components=None, config=None, threads=None, cache=None):
+        loaded = {}
+        self.environments = []
+        for s in snapshots:
+            key = os.path.realpath(str(s))
+            if key not in loaded:
+                loaded[key] = s if isinstance(s, ShellEnvironmentData) else ShellEnvironmentData(s)
+            self.environments.append(loaded[key])
+        diffs = {}
+        self.diffs = []
+        for step, (before, after) in enumerate(zip(self.environments, self.environments[1:]), 1):
+            key = (id(before), id(after))
+            if key not in diffs:
+                with timings.phase(f"step {step}"):
+                    diffs[key] = ShellEnvironmentDiff(before, after, components=components, config=config,
+                                                      threads=threads, cache=cache)
+            self.diffs.append(diffs[key])
+        self._unique_diffs = list(diffs.values())
+        self._history = None
+
+    def history(self):
+        """
+        Dictionary of (component, name) to the list of (step, kind) of each
+        entry that changed where step k is the change from Sk-1 to Sk and kind
+        is 'new', 'deleted' or 'changed' like in ShellEnvironmentDiff.records()
+        """
+        if self._history is None:
+            history = {}
+            for step, diff in enumerate(self.diffs, 1):
+                for c in diff.components:
+                    d = getattr(diff, c)
+                    for kind, names in (('deleted', d.deleted), ('new', d.new), ('changed', d.changed)):
+                        for name in names:
+                            history.setdefault((c, name), []).append((step, kind))
+            for steps in history.values():
+                steps.sort()
+            self._history = history
+        return self._history
+
+    def element_history(self, component, name, separator):
+        """
+        Dictionary of the elements of the list variable name (its values split
+        on separator) to the list of (step, kind) where kind is 'added' or
+        'removed'.  All the elements of a new variable are added and those of
+        a deleted one are removed.  Elements are in the order in which they
+        first changed.
+        """
+        import linediff
+        elements = {}
+        for step, kind in self.history().get((component, name), []):
+            d = getattr(self.diffs[step - 1], component)
+            initial = d.initial[name].split(separator) if kind != 'new' else []
+            final = d.final[name].split(separator) if kind != 'deleted' else []
+            changes = linediff.ListDiff(initial, final)
+            for change, changed in (('removed', changes.removed), ('added', changes.added)):
+                for e in dict.fromkeys(e for _, e in changed):
+                    elements.setdefault(e, []).append((step, change))
+        return elements
+
+    def save(self):
+        """ Store the diffs that were not found in the cache (see ShellEnvironmentDiff.save) """
+        for diff in self._unique_diffs:
+            diff.save()
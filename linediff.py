@@ -0,0 +1,203 @@
+"""
+Line diff for the bodies of functions and for lists
+
+difflib.SequenceMatcher looks for the longest matching blocks by trying every
+position which makes it slow on long functions with many identical lines like
+'fi', 'done' or '}'.  This is a patience diff: lines are interned as integers,
+the common prefix and suffix are matched, then lines that appear exactly once
+on each side are used as anchors (keeping the longest sequence of them that
+is in the same order on both sides) and the regions between anchors are
+diffed the same way.  When a region has no unique common line, the common
+line that is the least frequent is used as the anchor like in a histogram
+diff.
+"""
+import bisect
+
+def _intern(a, b):
+    ids = {}
+    return [ids.setdefault(l, len(ids)) for l in a], [ids.setdefault(l, len(ids)) for l in b]
+
+def _longest_increasing(pairs):
+    """
+    Longest subsequence of pairs (i, j) sorted by i whose j are increasing
+    (patience sorting)
+    """
+    tails = []
+    tail_index = []
+    previous = [None] * len(pairs)
+    for n, (_, j) in enumerate(pairs):
+        k = bisect.bisect_left(tails, j)
+        if k > 0:
+            previous[n] = tail_index[k - 1]
+        if k == len(tails):
+            tails.append(j)
+            tail_index.append(n)
+        else:
+            tails[k] = j
+            tail_index[k] = n
+    result = []
+    n = tail_index[-1] if tail_index else None
+    while n is not None:
+        result.append(pairs[n])
+        n = previous[n]
+    result.reverse()
+    return result
+
+def _anchors(a, alo, ahi, b, blo, bhi):
+    """ Matching positions to split the region a[alo:ahi], b[blo:bhi] """
+    count_a = {}
+    for i in range(alo, ahi):
+        count_a[a[i]] = count_a.get(a[i], 0) + 1
+    count_b = {}
+    first_b = {}
+    for j in range(blo, bhi):
+        count_b[b[j]] = count_b.get(b[j], 0) + 1
+        first_b.setdefault(b[j], j)
+
+    unique = [(i, first_b[a[i]]) for i in range(alo, ahi)
+              if count_a[a[i]] == 1 and count_b.get(a[i]) == 1]
+    if unique:
+        return _longest_increasing(unique)
+
+    rarest = None
+    for i in range(alo, ahi):
+        if a[i] in count_b:
+            count = count_a[a[i]] + count_b[a[i]]
+            if rarest is None or count < rarest[0]:
+                rarest = (count, i, first_b[a[i]])
+    return [] if rarest is None else [rarest[1:]]
+
+def matching_blocks(a, b):
+    """
+    Sorted list of triples (i, j, n) meaning a[i:i+n] == b[j:j+n] like
+    difflib.SequenceMatcher.get_matching_blocks() without the final dummy
+    """
+    a, b = _intern(a, b)
+    blocks = []
+    regions = [(0, len(a), 0, len(b))]
+    while regions:
+        alo, ahi, blo, bhi = regions.pop()
+        n = 0
+        while alo + n < ahi and blo + n < bhi and a[alo + n] == b[blo + n]:
+            n += 1
+        if n:
+            blocks.append((alo, blo, n))
+            alo += n
+            blo += n
+        n = 0
+        while alo < ahi - n and blo < bhi - n and a[ahi - n - 1] == b[bhi - n - 1]:
+            n += 1
+        if n:
+            ahi -= n
+            bhi -= n
+            blocks.append((ahi, bhi, n))
+        if alo == ahi or blo == bhi:
+            continue
+        i0, j0 = alo, blo
+        for i, j in _anchors(a, alo, ahi, b, blo, bhi):
+            blocks.append((i, j, 1))
+            regions.append((i0, i, j0, j))
+            i0, j0 = i + 1, j + 1
+        if (i0, j0) != (alo, blo):
+            regions.append((i0, ahi, j0, bhi))
+    blocks.sort()
+    merged = []
+    for i, j, n in blocks:
+        if merged and merged[-1][0] + merged[-1][2] == i and merged[-1][1] + merged[-1][2] == j:
+            merged[-1] = (merged[-1][0], merged[-1][1], merged[-1][2] + n)
+        else:
+            merged.append((i, j, n))
+    return merged
+
+def opcodes(a, b):
+    """
+    List of (tag, i1, i2, j1, j2) like difflib.SequenceMatcher.get_opcodes()
+    """
+    result = []
+    i = j = 0
+    for mi, mj, n in matching_blocks(a, b) + [(len(a), len(b), 0)]:
+        if i < mi and j < mj:
+            result.append(('replace', i, mi, j, mj))
+        elif i < mi:
+            result.append(('delete', i, mi, j, mj))
+        elif j < mj:
+            result.append(('insert', i, mi, j, mj))
+        if n:
+            result.append(('equal', mi, mi + n, mj, mj + n))
+        i, j = mi + n, mj + n
+    return result
+
+def unified_diff(a, b, n=3):
+    """
+    Lines of the differences between the lists of strings a and b with n lines
+    of context, each starting with '-', '+' or ' ' like the lines of
+    difflib.unified_diff() without the header lines and hunk markers.
+    """
+    codes = opcodes(a, b)
+    if all(tag == 'equal' for tag, *_ in codes):
+        return
+    for k, (tag, i1, i2, j1, j2) in enumerate(codes):
+        if tag == 'equal':
+            if k == 0:
+                i1 = max(i1, i2 - n)
+                yield from (' ' + l for l in a[i1:i2])
+            elif k == len(codes) - 1:
+                yield from (' ' + l for l in a[i1:min(i2, i1 + n)])
+            elif i2 - i1 > 2 * n:
+                yield from (' ' + l for l in a[i1:i1 + n])
+                yield from (' ' + l for l in a[i2 - n:i2])
+            else:
+                yield from (' ' + l for l in a[i1:i2])
+            continue
+        yield from ('-' + l for l in a[i1:i2])
+        yield from ('+' + l for l in b[j1:j2])
+
+class ListDiff:
+    """
+    Changes between two lists like the elements of colon separated lists
+    before and after.  Elements that stay in the same order are found with
+    matching_blocks() and the others are reported with their positions (indices
+    in the initial and final lists):
+
+        added       [(FINAL_POSITION, ELEMENT)]
+        removed     [(INITIAL_POSITION, ELEMENT)]
+        moved       [(ELEMENT, INITIAL_POSITION, FINAL_POSITION)]
+        duplicated  [(ELEMENT, [FINAL_POSITIONS])] for elements that are more
+                    than once in the final list
+
+    An element that is in both lists but not with the elements around it is
+    moved.  When an element is more times in one list than in the other, the
+    extra occurrences are added or removed.
+    """
+    def __init__(self, initial, final):
+        self.initial = initial
+        self.final = final
+        kept_initial = bytearray(len(initial))
+        kept_final = bytearray(len(final))
+        for i, j, n in matching_blocks(initial, final):
+            kept_initial[i:i+n] = b'\1' * n
+            kept_final[j:j+n] = b'\1' * n
+
+        # Positions of the elements of initial that are not kept, last first
+        # so that pop() gives the first one
+        unmatched = {}
+        for i in range(len(initial) - 1, -1, -1):
+            if not kept_initial[i]:
+                unmatched.setdefault(initial[i], []).append(i)
+
+        self.added = []
+        self.moved = []
+        positions = {}
+        for j, e in enumerate(final):
+            positions.setdefault(e, []).append(j)
+            if kept_final[j]:
+                continue
+            if unmatched.get(e):
+                self.moved.append((e, unmatched[e].pop(), j))
+            else:
+                self.added.append((j, e))
+        self.removed = sorted((i, e) for e, p in unmatched.items() for i in p)
+        self.duplicated = [(e, p) for e, p in positions.items() if len(p) > 1]
+
+    def __bool__(self):
+        return bool(self.added or self.removed or self.moved)
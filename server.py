@@ -0,0 +1,235 @@
+"""
+Resident process running the python scripts of env-diff
+
+Starting python3 and importing yaml, pygments and the modules of env-diff
+takes longer than comparing two environments.  The server does that once and
+forks a child for each request which calls the main function of the script
+with the arguments, environment and working directory of the client.  The
+config and the pygments formatter of env-diff-compare.py are cached in the
+server.  The client passes its
+standard input, output and error with the request so the report is written
+directly to the terminal of the client.
+
+Protocol on the socket, one request per connection:
+
+- Client sends one byte with its file descriptors 0, 1 and 2 attached and then
+  a JSON object {"script": NAME, "argv": [...], "env": {...}, "cwd": DIR}
+  before shutting down its side of the connection for writing.
+- Server replies {"pid": PID} once the child has accepted the request and
+  {"status": N} when the script has finished.
+
+If the connection is closed without a reply, the request was not run and the
+client runs the script itself.  This is what happens when the modules of
+env-diff have changed since the server was started: the server refuses the
+request and exits so that the next 'env-diff-server start' loads the new code.
+"""
+import importlib.util
+import json
+import logging
+import os
+import signal
+import socket
+import socketserver
+import struct
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+# Function of each script taking the arguments and returning the exit code
+SCRIPTS = {
+    'env-diff-compare.py': 'run',
+    'env-diff-generate-code.py': 'main',
+}
+modules = {}
+
+logger = logging.getLogger('env-diff-server')
+
+def socket_path():
+    """
+    Path of the socket of the server of the current user which is
+    ENV_DIFF_SOCKET or server.sock in a directory only accessible by the user
+    """
+    if 'ENV_DIFF_SOCKET' in os.environ:
+        return os.environ['ENV_DIFF_SOCKET']
+    runtime_dir = os.environ.get('XDG_RUNTIME_DIR') or tempfile.gettempdir()
+    return os.path.join(runtime_dir, f"env-diff-{os.getuid()}", "server.sock")
+
+def source_mtime():
+    """ Most recent modification time of the python modules of env-diff """
+    return max(os.stat(os.path.join(ROOT, f)).st_mtime for f in os.listdir(ROOT) if f.endswith('.py'))
+
+def load_script(script):
+    spec = importlib.util.spec_from_file_location(script[:-3].replace('-', '_'), os.path.join(ROOT, script))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def preload():
+    """
+    Import the scripts and everything they may need and prepare what they
+    cache so that forked children find it ready.
+    """
+    import pathlib
+    import envdiff, envdifflogging, snapshot, store, delta, linediff, codegen
+    # Optional packages
+    for name in ('yaml', 'pygments'):
+        try:
+            __import__(name)
+        except ImportError:
+            pass
+    for script in SCRIPTS:
+        modules[script] = load_script(script)
+    compare = modules['env-diff-compare.py']
+    try:
+        compare.get_pygments_highlighter()
+    except ImportError:
+        pass
+    compare.load_config(os.path.expanduser("~/.config/env-diff.yml"))
+
+
+class RequestHandler(socketserver.BaseRequestHandler):
+    """
+    Runs in the child forked for the request
+    """
+    def handle(self):
+        uid = struct.unpack('3i', self.request.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize('3i')))[1]
+        if uid != os.getuid():
+            logger.warning(f"Refusing request from uid {uid}")
+            return
+        msg, fds, _, _ = socket.recv_fds(self.request, 1, 3)
+        if not msg:
+            # Connection only checking that the server is running
+            return
+        if len(fds) != 3:
+            logger.warning("Request without file descriptors")
+            return
+        data = []
+        while chunk := self.request.recv(1 << 16):
+            data.append(chunk)
+        request = json.loads(b''.join(data))
+        if request['script'] not in SCRIPTS:
+            logger.warning(f"Refusing to run '{request['script']}'")
+            return
+
+        self.request.sendall(json.dumps({'pid': os.getpid()}).encode('utf-8') + b'\n')
+        for fd, target in zip(fds, (0, 1, 2)):
+            os.dup2(fd, target)
+            os.close(fd)
+        signal.signal(signal.SIGINT, signal.default_int_handler)
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        os.chdir(request['cwd'])
+        os.environ.clear()
+        os.environ.update(request['env'])
+        sys.argv = request['argv']
+        sys.stdout.reconfigure(line_buffering=sys.stdout.isatty())
+        # Let the script configure logging as if it was run directly
+        for handler in list(logging.root.handlers):
+            logging.root.removeHandler(handler)
+        logging.root.setLevel(logging.WARNING)
+        status = 0
+        try:
+            status = getattr(modules[request['script']], SCRIPTS[request['script']])(request['argv'][1:])
+            # Like sys.exit(None) when the script is run directly
+            if status is None:
+                status = 0
+        except SystemExit as e:
+            status = e.code if isinstance(e.code, int) else (0 if e.code is None else 1)
+        except KeyboardInterrupt:
+            status = 130
+        except BaseException:
+            logging.exception(f"Error in {request['script']}")
+            status = 1
+        finally:
+            sys.stdout.flush()
+            sys.stderr.flush()
+        self.request.sendall(json.dumps({'status': status}).encode('utf-8') + b'\n')
+
+
+class Server(socketserver.ForkingMixIn, socketserver.UnixStreamServer):
+    def __init__(self, path):
+        self.started = source_mtime()
+        self.stale = False
+        super().__init__(path, RequestHandler)
+
+    def verify_request(self, request, client_address):
+        # Runs in the server before forking
+        if source_mtime() > self.started:
+            logger.info("Modules of env-diff have changed, exiting")
+            self.stale = True
+            return False
+        return True
+
+    def serve(self):
+        while not self.stale:
+            self.handle_request()
+
+
+def serve(path):
+    """
+    Run the server on the socket path until it is killed or the code of
+    env-diff changes.
+    """
+    directory = os.path.dirname(path)
+    os.makedirs(directory, mode=0o700, exist_ok=True)
+    os.chmod(directory, 0o700)
+    if os.path.exists(path):
+        os.unlink(path)
+    preload()
+    pidfile = path + ".pid"
+    server = Server(path)
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        with open(pidfile, 'w') as f:
+            f.write(f"{os.getpid()}\n")
+        logger.info(f"Listening on {path}")
+        server.serve()
+    finally:
+        server.server_close()
+        for p in (path, pidfile):
+            try:
+                os.unlink(p)
+            except FileNotFoundError:
+                pass
+
+
+# Returned by run() when the server did not run the script
+NOT_HANDLED = object()
+
+def run(script, argv, path=None):
+    """
+    Run script (one of SCRIPTS) with argv through the server listening on path.
+    Return the exit status of the script or NOT_HANDLED if the server is not
+    running or refused the request, in which case nothing has been run.
+    """
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path or socket_path())
+        socket.send_fds(sock, [b'\0'], [0, 1, 2])
+        sock.sendall(json.dumps({
+            'script': script,
+            'argv': argv,
+            'env': dict(os.environ),
+            'cwd': os.getcwd(),
+        }).encode('utf-8'))
+        sock.shutdown(socket.SHUT_WR)
+        replies = sock.makefile('rb')
+        line = replies.readline()
+    except OSError:
+        sock.close()
+        return NOT_HANDLED
+    if not line:
+        sock.close()
+        return NOT_HANDLED
+
+    pid = json.loads(line)['pid']
+    try:
+        line = replies.readline()
+    except KeyboardInterrupt:
+        # The child is not in the process group of the terminal
+        os.kill(pid, signal.SIGINT)
+        line = replies.readline()
+    finally:
+        sock.close()
+    if not line:
+        return 1
+    return json.loads(line)['status']
@@ -0,0 +1,153 @@
+"""
+Single file format for saved environments
+
+Directories created by env-diff-save hold more than a dozen files.  When many
+saved environments are kept on a shared filesystem, opening all these files is
+what makes loading them slow.  This format puts all the components of an
+environment in one file:
+
+    envdiff-snapshot VERSION
+    {"components": {"env_vars": [OFFSET, LENGTH], ...}}
+    DATA
+
+The first line identifies the format and its version.  The second line is the
+table of contents giving, for each component, the offset and length of its
+JSON encoding relative to the start of DATA.  The file is mapped in memory and
+only the components that are asked for are decoded.  The table of contents also
+has an entry "digests" for the digests of the components and their entries (see
+envdiff.compute_digests).
+
+Version 2 adds compression: the table of contents has a key "codec" naming one
+of CODECS and each component is compressed separately.  Components are
+decompressed in chunks read directly from the mapped file so the compressed
+bytes are never copied.  Files without compression are still written as
+version 1.
+"""
+import bz2
+import json
+import lzma
+import mmap
+import os
+import zlib
+
+import envdiff
+
+MAGIC = b"envdiff-snapshot"
+VERSION = 2
+
+# Functions returning a compressor and a decompressor object for each codec.
+# For zlib, wbits=31 selects the gzip container.
+CODECS = {
+    'gzip': (lambda: zlib.compressobj(wbits=31), lambda: zlib.decompressobj(wbits=31)),
+    'zlib': (lambda: zlib.compressobj(), lambda: zlib.decompressobj()),
+    'lzma': (lambda: lzma.LZMACompressor(format=lzma.FORMAT_XZ), lambda: lzma.LZMADecompressor(format=lzma.FORMAT_XZ)),
+    'bz2': (lambda: bz2.BZ2Compressor(), lambda: bz2.BZ2Decompressor()),
+}
+
+CHUNK_SIZE = 1 << 20
+
+class SnapshotFile:
+    """
+    Read access to an environment saved as a single file
+    """
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            try:
+                self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                # Empty files cannot be mapped
+                raise envdiff.EnvDiffError(path, "snapshot header")
+        header_end = self._map.find(b'\n')
+        magic, _, version = self._map[:header_end].partition(b' ')
+        if header_end == -1 or magic != MAGIC or not version.isdigit():
+            raise envdiff.EnvDiffError(path, "snapshot header")
+        self.version = int(version)
+        if self.version > VERSION:
+            raise envdiff.EnvDiffError(path, f"support for format version {self.version} (this version of env-diff reads up to {VERSION})")
+        toc_end = self._map.find(b'\n', header_end + 1)
+        if toc_end == -1:
+            raise envdiff.EnvDiffError(path, "table of contents")
+        self.toc = json.loads(self._map[header_end+1:toc_end])
+        self.codec = self.toc.get('codec')
+        if self.codec is not None and self.codec not in CODECS:
+            raise envdiff.EnvDiffError(path, f"support for codec '{self.codec}'")
+        self._data = toc_end + 1
+
+    def load(self, component):
+        try:
+            offset, length = self.toc['components'][component]
+        except KeyError:
+            raise envdiff.EnvDiffError(self.path, component)
+        start = self._data + offset
+        if self.codec is None:
+            return json.loads(self._map[start:start+length])
+        return json.loads(self._decompress(start, length))
+
+    def _decompress(self, start, length):
+        decompressor = CODECS[self.codec][1]()
+        view = memoryview(self._map)
+        try:
+            chunks = []
+            for pos in range(start, start + length, CHUNK_SIZE):
+                chunks.append(decompressor.decompress(view[pos:min(pos + CHUNK_SIZE, start + length)]))
+            if hasattr(decompressor, 'flush'):
+                chunks.append(decompressor.flush())
+            return b''.join(chunks)
+        except (zlib.error, lzma.LZMAError, OSError) as e:
+            raise envdiff.EnvDiffError(self.path, f"valid {self.codec} data ({e})")
+        finally:
+            view.release()
+
+    def digests(self):
+        if 'digests' not in self.toc['components']:
+            return None
+        return self.load('digests')
+
+
+def write_snapshot(path, components, codec=None):
+    """
+    Write the dictionary components of component names to values to path,
+    compressing each one with codec if it is not None.  The file is written
+    under a temporary name and renamed so that readers never see a partial
+    file.
+    """
+    toc = {}
+    blobs = []
+    offset = 0
+    for name, value in components.items():
+        blob = json.dumps(value, separators=(',', ':')).encode('utf-8')
+        if codec is not None:
+            compressor = CODECS[codec][0]()
+            blob = compressor.compress(blob) + compressor.flush()
+        toc[name] = [offset, len(blob)]
+        offset += len(blob)
+        blobs.append(blob)
+
+    tmp = f"{path}.tmp{os.getpid()}"
+    try:
+        with open(tmp, 'wb') as f:
+            if codec is None:
+                f.write(MAGIC + b" 1\n")
+                f.write(json.dumps({'components': toc}).encode('utf-8') + b'\n')
+            else:
+                f.write(MAGIC + f" {VERSION}\n".encode('utf-8'))
+                f.write(json.dumps({'codec': codec, 'components': toc}).encode('utf-8') + b'\n')
+            for blob in blobs:
+                f.write(blob)
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+        raise
+
+
+def pack(source_path, path, codec=None):
+    """
+    Write the environment saved at source_path (a directory or a file) as a
+    single file at path with its components compressed with codec.
+    """
+    source = envdiff.open_snapshot(source_path)
+    components = {c: source.load(c) for c in envdiff.COMPONENTS}
+    components['digests'] = source.digests() or envdiff.compute_digests(source)
+    write_snapshot(path, components, codec=codec)
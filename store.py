@@ -0,0 +1,178 @@
+"""
+Content addressed store of saved environments
+
+When many environments are saved, most functions and arrays are the same in
+all of them.  A store keeps each distinct value once:
+
+    STORE/objects/AB/CDEF...    Value of an entry named by its digest
+    STORE/snapshots/NAME        Manifest of a saved environment
+
+The digest of an entry is the one computed by envdiff.compute_digests and the
+object holds the encoding that was hashed.  A manifest is
+
+    envdiff-manifest VERSION
+    {"digests": DIGESTS, "inline": {"env_vars": {NAME: VALUE}, ...}}
+
+where DIGESTS is the output of envdiff.compute_digests.  Values whose encoding
+is smaller than INLINE_SIZE are kept in the manifest rather than in objects.
+
+Objects are never modified.  Saving writes the objects before the manifest that
+references them and 'gc' only removes unreferenced objects older than a grace
+period so that it can run while environments are being saved.
+"""
+import json
+import os
+import time
+
+import envdiff
+
+MAGIC = b"envdiff-manifest"
+VERSION = 1
+INLINE_SIZE = 128
+
+class Store:
+    """
+    Objects and manifests of a store at path
+    """
+    def __init__(self, path):
+        self.path = path
+        self.objects = os.path.join(path, "objects")
+        self.snapshots = os.path.join(path, "snapshots")
+
+    def object_path(self, digest):
+        return os.path.join(self.objects, digest[:2], digest[2:])
+
+    def snapshot_path(self, name):
+        if not name or '/' in name or name.startswith('.'):
+            raise ValueError(f"Invalid snapshot name '{name}'")
+        return os.path.join(self.snapshots, name)
+
+    def read_object(self, digest):
+        try:
+            with open(self.object_path(digest), 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            raise envdiff.EnvDiffError(self.path, f"object {digest}")
+
+    def write_object(self, digest, data: bytes):
+        """
+        Write data as the object digest unless it is already there.  An
+        existing object gets its modification time updated so that a 'gc'
+        running at the same time considers it recent.
+        """
+        path = self.object_path(digest)
+        try:
+            os.utime(path)
+            return
+        except FileNotFoundError:
+            pass
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.tmp{os.getpid()}"
+        with open(tmp, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, path)
+
+    def add(self, source_path, name):
+        """
+        Store the environment saved at source_path (a directory or a file) as
+        the snapshot name and return the path of its manifest.
+        """
+        manifest_path = self.snapshot_path(name)
+        if os.path.exists(manifest_path):
+            raise FileExistsError(17, "File exists", manifest_path)
+        source = envdiff.open_snapshot(source_path)
+        digests = {'components': {}, 'entries': {}}
+        inline = {}
+        for c in envdiff.COMPONENTS:
+            entries = {}
+            inline[c] = {}
+            for entry, value in source.load(c).items():
+                data = envdiff.canonical_json(value)
+                digest = envdiff.digest(data)
+                entries[entry] = digest
+                if len(data) < INLINE_SIZE:
+                    inline[c][entry] = value
+                else:
+                    self.write_object(digest, data)
+            digests['entries'][c] = entries
+            digests['components'][c] = envdiff.digest(envdiff.canonical_json(sorted(entries.items())))
+
+        os.makedirs(self.snapshots, exist_ok=True)
+        # Names starting with '.' are not snapshots
+        tmp = os.path.join(self.snapshots, f".{name}.tmp{os.getpid()}")
+        with open(tmp, 'wb') as f:
+            f.write(MAGIC + f" {VERSION}\n".encode('utf-8'))
+            f.write(json.dumps({'digests': digests, 'inline': inline}, separators=(',', ':')).encode('utf-8'))
+        os.replace(tmp, manifest_path)
+        return manifest_path
+
+    def manifests(self):
+        """ Names of the snapshots in the store """
+        try:
+            return sorted(n for n in os.listdir(self.snapshots) if not n.startswith('.'))
+        except FileNotFoundError:
+            return []
+
+    def gc(self, grace=3600):
+        """
+        Remove objects that no manifest references and that were not written
+        in the last grace seconds.  Return the number of objects kept and
+        removed.
+        """
+        referenced = set()
+        for name in self.manifests():
+            manifest = Manifest(os.path.join(self.snapshots, name))
+            for c in envdiff.COMPONENTS:
+                inline = manifest.inline.get(c, {})
+                referenced.update(d for e, d in manifest.digests()['entries'][c].items() if e not in inline)
+
+        limit = time.time() - grace
+        kept = removed = 0
+        for prefix in sorted(os.listdir(self.objects)) if os.path.isdir(self.objects) else []:
+            directory = os.path.join(self.objects, prefix)
+            for filename in os.listdir(directory):
+                path = os.path.join(directory, filename)
+                if prefix + filename in referenced or os.stat(path).st_mtime > limit:
+                    kept += 1
+                    continue
+                os.unlink(path)
+                removed += 1
+        return kept, removed
+
+
+class Manifest:
+    """
+    Read access to an environment saved in a store.  The store is the one
+    containing the directory of the manifest.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.store = Store(os.path.dirname(os.path.dirname(os.path.abspath(path))))
+        with open(path, 'rb') as f:
+            header = f.readline()
+            magic, _, version = header.rstrip(b'\n').partition(b' ')
+            if magic != MAGIC or not version.isdigit():
+                raise envdiff.EnvDiffError(path, "manifest header")
+            if int(version) > VERSION:
+                raise envdiff.EnvDiffError(path, f"support for manifest version {int(version)} (this version of env-diff reads up to {VERSION})")
+            try:
+                manifest = json.loads(f.read())
+            except ValueError:
+                raise envdiff.EnvDiffError(path, "manifest contents")
+        self._digests = manifest['digests']
+        self.inline = manifest['inline']
+
+    def digests(self):
+        return self._digests
+
+    def load(self, component):
+        inline = self.inline[component]
+        entries = self._digests['entries'][component]
+        # Objects are read concurrently (see envdiff.read_files)
+        stored = [(entry, digest) for entry, digest in entries.items() if entry not in inline]
+        try:
+            contents = envdiff.read_files([self.store.object_path(digest) for _, digest in stored])
+        except FileNotFoundError as e:
+            raise envdiff.EnvDiffError(self.store.path, f"object {os.path.basename(os.path.dirname(e.filename))}{os.path.basename(e.filename)}")
+        values = {entry: json.loads(data) for (entry, _), data in zip(stored, contents)}
+        return {entry: inline[entry] if entry in inline else values[entry] for entry in entries}
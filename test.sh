@@ -34,6 +34,29 @@ _env-diff-test(){
     PATH=BANANNA:${PATH}:APPLE:;
     shopt -so errexit;
     shopt -u sourcepath;'
+    printf "\n\033[1;35m------------------ TEST 5: --format json and --format ndjson\033[0m\n"
+    TEST_CHANGED=old
+    TEST_REMOVED=old
+    local expected='[["shell_vars","TEST_ADDED","new",null,"added"],["shell_vars","TEST_CHANGED","changed","old","new"],["shell_vars","TEST_REMOVED","deleted","old",null]]'
+    local records='map(select(.name | startswith("TEST_"))) | sort_by(.name) | map([.component, .name, .kind, .old, .new])'
+    local format result
+    for format in json ndjson ; do
+        if [[ ${format} == json ]] ; then
+            result=$(env-diff -F ${this_dir}/dot-config-env-diff.yml --format json \
+                'TEST_ADDED=added ; TEST_CHANGED=new ; unset TEST_REMOVED' \
+                | jq -c "if (.initial | type) == \"string\" and (.final | type) == \"string\" then .changes | ${records} else \"no initial and final\" end")
+        else
+            result=$(env-diff -F ${this_dir}/dot-config-env-diff.yml --format ndjson \
+                'TEST_ADDED=added ; TEST_CHANGED=new ; unset TEST_REMOVED' \
+                | jq -c -s "${records}")
+        fi
+        if [[ "${result}" != "${expected}" ]] ; then
+            printf "\033[1;31mFAILURE: --format ${format} gave the records\n%s\ninstead of\n%s\033[0m\n" "${result}" "${expected}"
+            return 1
+        fi
+        echo "--format ${format}: ${result}"
+    done
+    unset TEST_CHANGED TEST_REMOVED
 }
 
 _env-diff-test
@@ -0,0 +1,62 @@
+#!/usr/bin/env bash
+#
+# Save the same environment with each capture mode of env-diff-save and check
+# that the saved variables are the same.  Variables that differ because of how
+# they are saved (BASH_COMMAND, FUNCNAME, _env_diff_capture, ...) are ignored
+# and so are the BASH_FUNC_name%% variables of exported functions which only
+# the 'compgen' mode saves.
+#
+set -uEo pipefail
+shopt -s inherit_errexit
+
+source ./env-diff-cmd.bash
+
+tmpdir=$(mktemp -d tmp.test-capture.XXXXXX)
+
+test_log(){
+    printf "\033[1;35m$0: %s\033[0m\n" "$*" >&2
+}
+
+double_quoted="x\"y\$z\`w\\v"
+ansi_c=$'line1\nline2\ttab\001ctl'
+declare -A assoc=([k]=v ["k w"]="x y" [$'n\nl']=$'a\nb' ["q\"t"]="\$")
+sparse=(a "b c" $'d\ne'); sparse[10]=z
+declare -a empty_array=()
+declare declared_not_set
+utf8=$'\xc3\xa9'
+export EXPORTED=val
+export EXPORTED_ANSI_C=$'a\nb\xff'
+exported_function(){ echo exported ; }
+export -f exported_function
+
+test_log "saving ${tmpdir}/compgen"
+env-diff-save --capture compgen ${tmpdir}/compgen
+test_log "saving ${tmpdir}/declare"
+env-diff-save --capture declare ${tmpdir}/declare
+
+diff="$(python3 - ${tmpdir}/compgen ${tmpdir}/declare <<-'PYEOF'
+	import re
+	import sys
+	import envdiff
+	ignored = {'BASH_COMMAND', 'BASH_SOURCE', 'BASH_LINENO', 'FUNCNAME',
+	           'LINENO', '_', '_env_diff_capture', 'BASHPID', 'BASH_SUBSHELL',
+	           'EPOCHREALTIME', 'EPOCHSECONDS', 'RANDOM', 'SRANDOM', 'SECONDS',
+	           'BASH_CMDS'}
+	d = envdiff.ShellEnvironmentDiff(sys.argv[1], sys.argv[2])
+	for c in ['env_vars', 'shell_vars', 'assoc_arrays', 'normal_arrays']:
+	    component = getattr(d, c)
+	    for name in sorted((component.new | component.deleted | component.changed) - ignored):
+	        if c == 'env_vars' and re.fullmatch(r'BASH_FUNC_.*%%', name):
+	            continue
+	        print(f"{c}: {name}")
+	if 'BASH_FUNC_exported_function%%' not in d.env_vars.deleted:
+	    print("env_vars: BASH_FUNC_exported_function%% not saved by the compgen mode")
+	PYEOF
+)"
+if [[ -n "${diff}" ]] ; then
+    test_log "FAILURE: the capture modes saved different variables:"
+    test_log "${diff}"
+    exit 1
+fi
+test_log "SUCCESS: No differences"
+rm -rf ${tmpdir}
@@ -0,0 +1,72 @@
+#!/usr/bin/env bash
+#
+# Save a chain of deltas longer than ENV_DIFF_MAX_DELTA_DEPTH and check that a
+# complete snapshot is written when the chain would get too long and that each
+# delta loads the same environment as the directory it was made from, before
+# and after 'compact'.
+#
+set -uEo pipefail
+shopt -s inherit_errexit
+
+source ./env-diff-cmd.bash
+
+tmpdir=$(mktemp -d tmp.test-delta.XXXXXX)
+export ENV_DIFF_MAX_DELTA_DEPTH=3
+
+test_log(){
+    printf "\033[1;35m$0: %s\033[0m\n" "$*" >&2
+}
+
+test_log "saving a chain of 6 environments"
+env-diff-save ${tmpdir}/direct0
+cp ${tmpdir}/direct0 -r ${tmpdir}/delta0
+declare -A chain_assoc=([step]=0)
+for step in 1 2 3 4 5 6 ; do
+    export CHAIN_STEP=${step}
+    chain_assoc[step]=${step}
+    eval "chain_function_${step}(){ echo ${step} ; }"
+    if (( step == 3 )) ; then
+        unset -f chain_function_1
+    fi
+    env-diff-save ${tmpdir}/direct${step}
+    env-diff-snapshot delta ${tmpdir}/direct${step} ${tmpdir}/delta$((step-1)) ${tmpdir}/delta${step} 2>/dev/null
+done
+
+result="$(python3 - ${tmpdir} <<-'PYEOF'
+	import json
+	import os
+	import sys
+	import delta
+	import envdiff
+	tmpdir = sys.argv[1]
+	def path(kind, step):
+	    return os.path.join(tmpdir, f"{kind}{step}")
+	def load(p):
+	    data = envdiff.ShellEnvironmentData(p)
+	    return json.dumps({c: getattr(data, c) for c in envdiff.COMPONENTS}, sort_keys=True)
+	def check(when):
+	    for step in range(1, 7):
+	        if load(path('delta', step)) != load(path('direct', step)):
+	            print(f"{when}: delta{step} does not load like direct{step}")
+
+	# delta4 would be the fourth delta of the chain
+	deltas = [isinstance(envdiff.open_snapshot(path('delta', s)), delta.DeltaFile) for s in range(1, 7)]
+	if deltas != [True, True, True, False, True, True]:
+	    print(f"deltas of the chain are {deltas}")
+	check("before compact")
+
+	delta.compact(path('delta', 2))
+	delta.compact(path('delta', 5))
+	if isinstance(envdiff.open_snapshot(path('delta', 2)), delta.DeltaFile):
+	    print("delta2 is still a delta after compact")
+	check("after compact")
+	PYEOF
+)"
+if [[ -n "${result}" ]] ; then
+    test_log "FAILURE:"
+    test_log "${result}"
+    exit 1
+fi
+
+test_log "SUCCESS"
+rm -rf ${tmpdir}
@@ -0,0 +1,63 @@
+#!/usr/bin/env bash
+#
+# Save functions whose bodies look like the saved stream (here-documents with
+# lines that are headers of other functions) and check that each one is loaded
+# with the same lines as `declare -f NAME` prints after the header.
+#
+set -uEo pipefail
+shopt -s inherit_errexit
+
+source ./env-diff-cmd.bash
+
+tmpdir=$(mktemp -d tmp.test-functions.XXXXXX)
+
+test_log(){
+    printf "\033[1;35m$0: %s\033[0m\n" "$*" >&2
+}
+
+f(){
+    cat <<'X'
+g () 
+{ 
+X
+}
+g(){ echo g ; }
+h(){
+    cat <<'X'
+declare -fx h
+X
+}
+export -f h
+
+test_log "saving ${tmpdir}/saved"
+env-diff-save ${tmpdir}/saved
+
+for func in f g h ; do
+    declare -f ${func} | tail -n +2 > ${tmpdir}/${func}.expected
+done
+diff="$(python3 - ${tmpdir} <<-'PYEOF'
+	import os
+	import sys
+	import envdiff
+	tmpdir = sys.argv[1]
+	functions = envdiff.ShellEnvironmentData(os.path.join(tmpdir, "saved")).functions
+	for name in ['f', 'g', 'h']:
+	    with open(os.path.join(tmpdir, f"{name}.expected")) as f:
+	        expected = f.read().splitlines()
+	    if functions.get(name) != expected:
+	        print(f"{name}: {functions.get(name)} instead of {expected}")
+	try:
+	    envdiff.split_function_dump(b'f () \n{ \n    :\n}\n')
+	    print("functions without a leading NUL byte were accepted")
+	except ValueError:
+	    pass
+	PYEOF
+)"
+if [[ -n "${diff}" ]] ; then
+    test_log "FAILURE: functions were not split correctly:"
+    test_log "${diff}"
+    exit 1
+fi
+
+test_log "SUCCESS"
+rm -rf ${tmpdir}
@@ -56,3 +56,60 @@ fi
 
 
 
+test_log "loading ${tmpdir}/target with env-diff-load (compact code)"
+(
+    A=B
+    export -n HOME
+    f(){ echo "hello" ; }
+    declare -A assoc=([x y]=1 [z]=$'a\nb' ["quote'd"]='$(not run)')
+    declare -a normal=(1 "2 3" "")
+    declare -a sparse=([3]=a [10]=b)
+    declare -i integer=5
+    declare -l lower=abc
+    declare -x exported_lower=def
+    declare -l exported_lower
+    to_delete_later=1
+    shopt -s extglob
+    shopt -u sourcepath
+    set -o noclobber
+    trap 'echo "USR1 '\''quoted'\''"' USR1
+    trap ': second
+: line' USR2
+
+    test_log "saving ${tmpdir}/target"
+    env-diff-save ${tmpdir}/target
+
+    test_log "Changing environment"
+    A=C
+    unset f assoc normal to_delete_later
+    declare -a assoc=(not associative)
+    sparse=(x)
+    unset integer ; integer=abc
+    declare +l lower
+    declare +x exported_lower
+    export HOME X=Y
+    new_variable=1
+    declare -A new_assoc=([k]=v)
+    declare -a new_normal=(v)
+    g(){ echo "This is new G" ; }
+    shopt -u extglob
+    shopt -s sourcepath
+    set +o noclobber
+    trap - USR1
+    trap 'echo changed' USR2
+    trap 'echo new' HUP
+
+    env-diff-load ${tmpdir}/target
+    env-diff-save ${tmpdir}/after-load
+) || { test_log "FAILURE: could not save and load" ; exit 1 ; }
+
+# env-diff-load runs programs that bash remembers in BASH_CMDS
+echo 'ignored_assoc_arrays: [BASH_CMDS]' > ${tmpdir}/config.yml
+diff="$(env-diff-compare -F ${tmpdir}/config.yml ${tmpdir}/target ${tmpdir}/after-load)"
+if [[ -n "${diff}" ]] ; then
+    test_log "FAILURE: there were some differences after env-diff-load:"
+    test_log "${diff}"
+    exit 1
+fi
+test_log "SUCCESS: No differences after env-diff-load"
+rm -rf ${tmpdir}
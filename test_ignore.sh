@@ -0,0 +1,99 @@
+#!/usr/bin/env bash
+#
+# Ignored entries of the config file (envdiff.DiffConfig) through env-diff -F:
+# globs and regular expressions, sections that apply to several components,
+# sections of the config file replacing the defaults of envdiff.DEFAULT_IGNORED
+# and --no-ignore.
+#
+set -uEo pipefail
+shopt -s inherit_errexit
+
+source ./env-diff-cmd.bash
+
+tmpdir=$(mktemp -d tmp.test-ignore.XXXXXX)
+
+test_log(){
+    printf "\033[1;35m$0: %s\033[0m\n" "$*" >&2
+}
+
+cat > ${tmpdir}/config.yml <<'EOF'
+ignored_variables:
+  - 'IGN_*'
+  - 'Q?'
+  - 'RE_[0-9]+'
+ignored_normal_arrays:
+  - 'ARR_.*'
+ignored_functions:
+  - 'f_*'
+EOF
+echo '{}' > ${tmpdir}/defaults.yml
+
+IGN_A=a
+export IGN_ENV=a
+QA=a
+QAB=a
+RE_12=a
+RE_X=a
+ARR_1=(a)
+OTHER=(a)
+f_one(){ : ; }
+g_one(){ : ; }
+command='IGN_A=b ; IGN_ENV=b ; QA=b ; QAB=b ; RE_12=b ; RE_X=b ; ARR_1=(b) ; OTHER=(b) ;
+         f_one(){ echo ; } ; g_one(){ echo ; }'
+
+# Changed entries except the variables of bash that may or may not change
+# between the two snapshots.  EPOCHREALTIME always changes.
+changes(){
+    env-diff "$@" --format ndjson "${command}" 2>/dev/null \
+        | jq -r 'select(.name | test("^(RANDOM|SRANDOM|SECONDS|EPOCHSECONDS|BASH_LINENO)$") | not)
+                 | "\(.component) \(.name)"'
+}
+
+check(){
+    local description=$1 expected=$2 ; shift 2
+    test_log "${description}"
+    local result
+    result="$(changes "$@")"
+    if [[ "${result}" != "${expected}" ]] ; then
+        test_log "FAILURE: ${description}: changes are"
+        test_log "${result}"
+        test_log "instead of"
+        test_log "${expected}"
+        exit 1
+    fi
+}
+
+check "globs and regular expressions replacing the defaults" \
+"shell_vars EPOCHREALTIME
+shell_vars QAB
+shell_vars RE_X
+normal_arrays OTHER
+functions g_one" -F ${tmpdir}/config.yml
+
+check "default ignored entries" \
+"env_vars IGN_ENV
+shell_vars IGN_A
+shell_vars QA
+shell_vars QAB
+shell_vars RE_12
+shell_vars RE_X
+normal_arrays ARR_1
+normal_arrays OTHER
+functions f_one
+functions g_one" -F ${tmpdir}/defaults.yml
+
+check "--no-ignore" \
+"env_vars IGN_ENV
+shell_vars EPOCHREALTIME
+shell_vars IGN_A
+shell_vars QA
+shell_vars QAB
+shell_vars RE_12
+shell_vars RE_X
+normal_arrays ARR_1
+normal_arrays OTHER
+functions f_one
+functions g_one" -F ${tmpdir}/config.yml --no-ignore
+
+test_log "SUCCESS"
+rm -rf ${tmpdir}
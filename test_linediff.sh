@@ -0,0 +1,113 @@
+#!/usr/bin/env bash
+#
+# Opcodes and unified diffs of linediff and functions reported as renamed by
+# EnvComponentDiff.renamed() instead of being deleted and added.
+#
+set -uEo pipefail
+shopt -s inherit_errexit
+
+source ./env-diff-cmd.bash
+
+test_log(){
+    printf "\033[1;35m$0: %s\033[0m\n" "$*" >&2
+}
+
+test_log "linediff.opcodes() and linediff.unified_diff()"
+diff="$(python3 - <<-'PYEOF'
+	import random
+	import envdiff
+	import linediff
+
+	def check(label, result, expected):
+	    if result != expected:
+	        print(f"{label}: {result!r} instead of {expected!r}")
+
+	# The opcodes rebuild b from a and cover both lists without gaps
+	rng = random.Random(0)
+	lines = ["{ ", "    fi;", "    done;", "}", "    echo a;", "    echo b;", "    local x;"]
+	for n in range(300):
+	    a = rng.choices(lines + [f"line {k}" for k in range(rng.randint(0, 20))], k=rng.randint(0, 40))
+	    b = list(a)
+	    for _ in range(rng.randint(0, 8)):
+	        k = rng.randint(0, len(b))
+	        op = rng.choice(['insert', 'delete', 'replace'])
+	        if op == 'insert' or not b:
+	            b.insert(k, rng.choice(lines + ["new line"]))
+	        elif op == 'delete':
+	            del b[min(k, len(b) - 1)]
+	        else:
+	            b[min(k, len(b) - 1)] = rng.choice(lines + ["changed line"])
+	    rebuilt = []
+	    i = j = 0
+	    for tag, i1, i2, j1, j2 in linediff.opcodes(a, b):
+	        if (i1, j1) != (i, j) or tag not in ('equal', 'insert', 'delete', 'replace') \
+	                or (tag == 'equal' and a[i1:i2] != b[j1:j2]):
+	            print(f"pair {n}: bad opcode {(tag, i1, i2, j1, j2)}")
+	            break
+	        rebuilt += b[j1:j2]
+	        i, j = i2, j2
+	    check(f"pair {n}: end of the opcodes", (i, j), (len(a), len(b)))
+	    check(f"pair {n}: b rebuilt from the opcodes", rebuilt, b)
+
+	a = [f"l{k}" for k in range(1, 11)]
+	check("identical opcodes", linediff.opcodes(a, a), [('equal', 0, 10, 0, 10)])
+	check("identical diff", list(linediff.unified_diff(a, a)), [])
+	check("empty opcodes", linediff.opcodes([], []), [])
+	check("empty diff", list(linediff.unified_diff([], [])), [])
+	check("diff from empty", list(linediff.unified_diff([], ["x"])), ["+x"])
+
+	# Changes on the first and the last lines: no context before the first
+	# change or after the last one and context of 3 lines on each side of
+	# the unchanged lines in the middle
+	b = ["x1"] + a[1:9] + ["x10"]
+	check("changes at the start and at the end", list(linediff.unified_diff(a, b)),
+	      ["-l1", "+x1", " l2", " l3", " l4", " l7", " l8", " l9", "-l10", "+x10"])
+	# A change in the middle: the last lines of the leading context and the
+	# first lines of the trailing context
+	b = a[:4] + ["x5"] + a[5:]
+	check("change in the middle", list(linediff.unified_diff(a, b)),
+	      [" l2", " l3", " l4", "-l5", "+x5", " l6", " l7", " l8"])
+	check("change in the middle with n=1", list(linediff.unified_diff(a, b, n=1)),
+	      [" l4", "-l5", "+x5", " l6"])
+	# Unchanged lines between two changes that are not more than 2*n lines
+	# are all shown
+	b = ["x1"] + a[1:7] + ["x8"] + a[8:]
+	check("close changes", list(linediff.unified_diff(a, b)),
+	      ["-l1", "+x1", " l2", " l3", " l4", " l5", " l6", " l7", "-l8", "+x8", " l9", " l10"])
+
+	# Renamed functions are paired in sorted order with and without digests
+	initial = {'old_a': ["    echo same;"], 'old_b': ["    echo same;"], 'gone': ["    echo gone;"],
+	           'kept': ["    :"]}
+	final = {'new_b': ["    echo same;"], 'new_a': ["    echo same;"], 'added': ["    echo added;"],
+	         'kept': ["    :"]}
+	expected = {'old_a': 'new_a', 'old_b': 'new_b'}
+	check("renamed", envdiff.EnvComponentDiff(initial, final).renamed(), expected)
+	digests = tuple({n: envdiff.digest(envdiff.canonical_json(v)) for n, v in d.items()} for d in (initial, final))
+	check("renamed with digests", envdiff.EnvComponentDiff(initial, final, digests=digests).renamed(), expected)
+	check("nothing renamed", envdiff.EnvComponentDiff(initial, initial).renamed(), {})
+	PYEOF
+)"
+if [[ -n "${diff}" ]] ; then
+    test_log "FAILURE: wrong line diffs:"
+    test_log "${diff}"
+    exit 1
+fi
+
+test_log "renamed function in the report of env-diff"
+old_name(){ echo "same body" ; }
+deleted_function(){ echo "deleted" ; }
+report="$(env-diff -F ./dot-config-env-diff.yml \
+    'unset -f old_name deleted_function ; new_name(){ echo "same body" ; }' 2>/dev/null \
+    | sed 's/\x1b\[[0-9;]*m//g')"
+expected='================= SHELL FUNCTIONS ================
+Renamed functions
+old_name() -> new_name()
+Deleted functions
+deleted_function()'
+if [[ "${report}" != "${expected}" ]] ; then
+    test_log "FAILURE: report of a renamed function:"
+    test_log "${report}"
+    exit 1
+fi
+
+test_log "SUCCESS"
@@ -0,0 +1,87 @@
+#!/usr/bin/env bash
+#
+# Changes of lists found by linediff.ListDiff (reordered lists, duplicated
+# elements and PATH-like lists with empty elements) and their report by the
+# default --list-format changes.
+#
+set -uEo pipefail
+shopt -s inherit_errexit
+
+source ./env-diff-cmd.bash
+
+test_log(){
+    printf "\033[1;35m$0: %s\033[0m\n" "$*" >&2
+}
+
+test_log "linediff.ListDiff"
+diff="$(python3 - <<-'PYEOF'
+	import random
+	import linediff
+
+	def check(label, initial, final, added=(), removed=(), moved=(), duplicated=()):
+	    d = linediff.ListDiff(initial, final)
+	    result = (d.added, d.removed, d.moved, d.duplicated, bool(d))
+	    expected = (list(added), list(removed), list(moved), list(duplicated), bool(added or removed or moved))
+	    if result != expected:
+	        print(f"{label}: {result!r} instead of {expected!r}")
+
+	check("same list", list("abcd"), list("abcd"))
+	check("empty lists", [], [])
+	check("last element moved to the front", list("abcd"), list("dabc"), moved=[('d', 3, 0)])
+	check("reversed", list("abcd"), list("dcba"), moved=[('c', 2, 1), ('b', 1, 2), ('a', 0, 3)])
+	check("element appended twice", list("abc"), list("abcb"), added=[(3, 'b')], duplicated=[('b', [1, 3])])
+	check("duplicates removed", list("abcab"), list("abc"), removed=[(3, 'a'), (4, 'b')])
+	check("duplicates kept", list("aba"), list("abac"), added=[(3, 'c')], duplicated=[('a', [0, 2])])
+
+	path = "/usr/bin:/bin:/usr/local/bin".split(':')
+	check("PATH prepended and trailing colon", path, ("/opt/x/bin:" + ':'.join(path) + ':').split(':'),
+	      added=[(0, '/opt/x/bin'), (4, '')])
+	check("PATH with an empty element and a duplicate", path, ['/usr/bin', '', '/bin', '/usr/local/bin', '/usr/bin'],
+	      added=[(1, ''), (4, '/usr/bin')], duplicated=[('/usr/bin', [0, 4])])
+	check("empty PATH set", [''], ['/x'], added=[(0, '/x')], removed=[(0, '')])
+	check("PATH emptied", path, [''], added=[(0, '')], removed=[(0, '/usr/bin'), (1, '/bin'), (2, '/usr/local/bin')])
+
+	# Every element of each list is either kept in order or reported once
+	rng = random.Random(0)
+	for n in range(300):
+	    initial = rng.choices("abcdefgh", k=rng.randint(0, 12))
+	    final = rng.choices("abcdefgh", k=rng.randint(0, 12)) if rng.random() < 0.3 else \
+	        rng.sample(initial, len(initial)) + rng.choices("abcdefgh", k=rng.randint(0, 2))
+	    d = linediff.ListDiff(initial, final)
+	    kept = sum(k for _, _, k in linediff.matching_blocks(initial, final))
+	    if len(initial) != kept + len(d.removed) + len(d.moved) \
+	            or len(final) != kept + len(d.added) + len(d.moved) \
+	            or any(initial[i] != e for i, e in d.removed) \
+	            or any(final[j] != e for j, e in d.added) \
+	            or any(initial[i] != e or final[j] != e for e, i, j in d.moved):
+	        print(f"{initial} -> {final}: added {d.added} removed {d.removed} moved {d.moved}")
+	PYEOF
+)"
+if [[ -n "${diff}" ]] ; then
+    test_log "FAILURE: wrong list changes:"
+    test_log "${diff}"
+    exit 1
+fi
+
+test_log "report of a changed PATH"
+report="$(PATH=/usr/bin:/bin:/usr/local/bin:/usr/sbin ; env-diff -F ./dot-config-env-diff.yml \
+    'PATH=/opt/x/bin:/usr/bin:/usr/local/bin:/bin:/usr/sbin::/usr/bin' 2>/dev/null \
+    | sed 's/\x1b\[[0-9;]*m//g')"
+expected='================= ENVIRONMENT VARIABLES ================
+Modified variables
+PATH (colon-separated list)
+    ADDED:
+        [0] /opt/x/bin
+        [5] (empty)
+        [6] /usr/bin
+    MOVED:
+        [1 -> 3] /bin
+    DUPLICATED:
+        [1, 6] /usr/bin'
+if [[ "${report}" != "${expected}" ]] ; then
+    test_log "FAILURE: report of the changes of PATH:"
+    test_log "${report}"
+    exit 1
+fi
+
+test_log "SUCCESS"
@@ -0,0 +1,57 @@
+#!/usr/bin/env bash
+set -uEo pipefail
+shopt -s inherit_errexit
+
+source ./env-diff-cmd.bash
+
+tmpdir=$(mktemp -d tmp.test-load-direct.XXXXXX)
+
+test_log(){
+    printf "\033[1;35m$0: %s\033[0m\n" "$*" >&2
+}
+
+(
+    A=B
+    export -n HOME
+    f(){ echo "hello" ; }
+    declare -A assoc=([x y]=1 [z]=$'a\nb')
+    declare -a normal=(1 "2 3")
+    declare -i integer=5
+    alias say-hello='echo "HELLO"'
+    shopt -s extglob
+    trap 'echo "USR1"' USR1
+    trap 'echo '\''quoted'\''
+: SIGHUP' USR2
+
+    test_log "saving ${tmpdir}/target"
+    env-diff-save --restore ${tmpdir}/target
+
+    test_log "Changing environment"
+    A=C
+    unset f assoc normal
+    declare -a assoc=(not associative)
+    unset integer ; integer=abc
+    export HOME X=Y
+    g(){ echo "This is new G" ; }
+    unalias say-hello
+    alias ls='ls --hello=world'
+    PATH=BANANNA:${PATH}:APPLE:
+    shopt -u extglob
+    shopt -so noclobber
+    trap 'echo "new trap"' HUP TERM
+    trap - USR2
+
+    test_log "loading ${tmpdir}/target with --direct"
+    env-diff-load --direct ${tmpdir}/target
+    env-diff-save --restore ${tmpdir}/after-load
+) || { test_log "FAILURE: could not save and load" ; exit 1 ; }
+
+diff="$(env-diff-compare -F /dev/null ${tmpdir}/target ${tmpdir}/after-load)"
+if [[ -z "${diff}" ]] ; then
+    test_log "SUCCESS: No differences"
+    rm -rf ${tmpdir}
+else
+    test_log "FAILURE: there were some differences:"
+    test_log "${diff}"
+    exit 1
+fi
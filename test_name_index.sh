@@ -0,0 +1,91 @@
+#!/usr/bin/env bash
+#
+# Patterns of the configuration with groups, back references and inline flags
+# like (?i) are compiled on their own by envdiff.NameIndex.  Check that each
+# name is dispatched to the value of the first key it matches, directly and
+# through the comparators of the configuration of env-diff.
+#
+set -uEo pipefail
+shopt -s inherit_errexit
+
+source ./env-diff-cmd.bash
+
+tmpdir=$(mktemp -d tmp.test-name-index.XXXXXX)
+
+test_log(){
+    printf "\033[1;35m$0: %s\033[0m\n" "$*" >&2
+}
+
+test_log "lookups of envdiff.NameIndex"
+diff="$(python3 - <<-'PYEOF'
+	import envdiff
+	index = envdiff.NameIndex({
+	    'PLAIN': 'plain',
+	    'A_.*': 'a',
+	    '(?i)path_.*': 'path',
+	    'B_.*': 'b',
+	    '(LIST)_\\1': 'list',
+	    '(X|Y)_(\\d+)': 'xy',
+	    'C_.*': 'c',
+	    '.*_PLAIN': 'suffix',
+	})
+	expected = {
+	    'PLAIN': 'plain',
+	    'A_1': 'a',
+	    'PATH_1': 'path',
+	    'Path_1': 'path',
+	    'path_A_1': 'path',
+	    'B_1': 'b',
+	    'LIST_LIST': 'list',
+	    'LIST_OTHER': None,
+	    'X_12': 'xy',
+	    'Y_1': 'xy',
+	    'X_A': None,
+	    'C_1': 'c',
+	    'C_PLAIN': 'c',
+	    'D_PLAIN': 'suffix',
+	    'a_1': None,
+	    'b_1': None,
+	}
+	for name, value in expected.items():
+	    if index.get(name) != value:
+	        print(f"{name}: {index.get(name)!r} instead of {value!r}")
+	PYEOF
+)"
+if [[ -n "${diff}" ]] ; then
+    test_log "FAILURE: wrong values looked up:"
+    test_log "${diff}"
+    exit 1
+fi
+
+test_log "comparators of env-diff -F ${tmpdir}/config.yml"
+cat > ${tmpdir}/config.yml <<'EOF'
+comparators:
+  'X_.*': plain
+  '(?i)my_.*_dirs': colon_list
+  '(LIST)_\1': space_list
+  'Y_.*': space_list
+EOF
+My_Src_Dirs=a
+MY_DIRS=a
+LIST_LIST=a
+LIST_OTHER=a
+X_A=a
+Y_A=a
+separators="$(env-diff -F ${tmpdir}/config.yml --format json \
+    'My_Src_Dirs=a:b ; MY_DIRS=a:b ; LIST_LIST="a b" ; LIST_OTHER="a b" ; X_A="a b" ; Y_A="a b"' 2>/dev/null \
+    | jq -r '.changes[] | "\(.name)=\(.separator | tojson)"')"
+expected='LIST_LIST=" "
+LIST_OTHER=null
+MY_DIRS=null
+My_Src_Dirs=":"
+X_A=null
+Y_A=" "'
+if [[ "${separators}" != "${expected}" ]] ; then
+    test_log "FAILURE: variables compared with the wrong comparators:"
+    test_log "${separators}"
+    exit 1
+fi
+
+test_log "SUCCESS"
+rm -rf ${tmpdir}
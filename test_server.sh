@@ -0,0 +1,68 @@
+#!/usr/bin/env bash
+#
+# Run env-diff-gencode and env-diff-compare through the server started with
+# 'env-diff-server start' and check that their output is the same as when they
+# are run directly, each script being run exactly once.
+#
+set -uEo pipefail
+shopt -s inherit_errexit
+
+source ./env-diff-cmd.bash
+
+tmpdir=$(mktemp -d ${PWD}/tmp.test-server.XXXXXX)
+export ENV_DIFF_SOCKET=${tmpdir}/server.sock
+
+test_log(){
+    printf "\033[1;35m$0: %s\033[0m\n" "$*" >&2
+}
+
+cleanup(){
+    env-diff-server stop
+    rm -rf ${tmpdir}
+}
+
+test_log "starting the server on ${ENV_DIFF_SOCKET}"
+env-diff-server start || { test_log "FAILURE: could not start the server" ; exit 1 ; }
+trap cleanup EXIT
+
+(
+    env-diff-save ${tmpdir}/before
+    export TEST_SERVER_VAR=value
+    env-diff-save ${tmpdir}/after
+) || { test_log "FAILURE: could not save the environments" ; exit 1 ; }
+
+for cmd in "env-diff-gencode" "env-diff-compare -F /dev/null" ; do
+    test_log "${cmd} through the server"
+    direct=$(ENV_DIFF_SERVER=false ${cmd} ${tmpdir}/before ${tmpdir}/after || echo "exit status $?")
+    served=$(ENV_DIFF_SERVER=true ${cmd} ${tmpdir}/before ${tmpdir}/after || echo "exit status $?")
+    if [[ "${served}" != "${direct}" ]] ; then
+        test_log "FAILURE: the output of ${cmd} through the server is different:"
+        test_log "${served}"
+        exit 1
+    fi
+    if (( $(grep -c TEST_SERVER_VAR <<< "${served}") != 1 )) ; then
+        test_log "FAILURE: TEST_SERVER_VAR is not in the output of ${cmd} exactly once:"
+        test_log "${served}"
+        exit 1
+    fi
+done
+
+test_log "server without the optional package pygments"
+env-diff-server stop
+mkdir ${tmpdir}/no-pygments
+echo 'raise ImportError("pygments is hidden by test_server.sh")' > ${tmpdir}/no-pygments/pygments.py
+export PYTHONPATH=${tmpdir}/no-pygments
+for _ in {1..50} ; do
+    env-diff-server status >/dev/null || break
+    sleep 0.1
+done
+env-diff-server start || { test_log "FAILURE: could not start the server without pygments" ; exit 1 ; }
+direct=$(ENV_DIFF_SERVER=false env-diff-compare -F /dev/null ${tmpdir}/before ${tmpdir}/after || echo "exit status $?")
+served=$(ENV_DIFF_SERVER=true env-diff-compare -F /dev/null ${tmpdir}/before ${tmpdir}/after || echo "exit status $?")
+if [[ "${served}" != "${direct}" ]] || ! env-diff-server status >/dev/null ; then
+    test_log "FAILURE: env-diff-compare through the server without pygments:"
+    test_log "${served}"
+    exit 1
+fi
+
+test_log "SUCCESS"
@@ -0,0 +1,16 @@
+#!/usr/bin/env bash
+#
+# Check that env-diff-compare.py starts within the budget of
+# benchmarks/bench_startup.py and does not import optional packages it does
+# not need.
+#
+set -uEo pipefail
+
+cd "$(dirname "${BASH_SOURCE[0]}")"
+
+printf "\033[1;35m$0: %s\033[0m\n" "measuring startup of env-diff-compare.py" >&2
+if ! python3 benchmarks/bench_startup.py --repeat 5 --check ; then
+    printf "\033[1;31m$0: %s\033[0m\n" "FAILED" >&2
+    exit 1
+fi
+printf "\033[1;32m$0: %s\033[0m\n" "SUCCESS" >&2
@@ -0,0 +1,74 @@
+#!/usr/bin/env bash
+#
+# Save two environments in a store, remove one of them and check that 'gc'
+# removes the objects that only it referenced, keeps those shared with the
+# other one and that the other one loads the same as before.
+#
+set -uEo pipefail
+shopt -s inherit_errexit
+
+source ./env-diff-cmd.bash
+
+tmpdir=$(mktemp -d tmp.test-store.XXXXXX)
+store=${tmpdir}/store
+
+test_log(){
+    printf "\033[1;35m$0: %s\033[0m\n" "$*" >&2
+}
+
+# Function bodies larger than store.INLINE_SIZE so that they are objects
+shared_function(){
+    echo "This function is in both snapshots and is long enough to be an object"
+    echo "rather than being kept inline in the manifests of the snapshots"
+}
+only_in_b(){
+    echo "This function is only in the second snapshot and is long enough to be"
+    echo "an object that nothing references once that snapshot is removed"
+}
+b=$(declare -f only_in_b)
+unset -f only_in_b
+
+test_log "saving snapshots 'a' and 'b' in ${store}"
+env-diff-save --store ${store} a
+(
+    eval "${b}"
+    env-diff-save --store ${store} b
+)
+
+result="$(python3 - ${store} <<-'PYEOF'
+	import json
+	import os
+	import sys
+	import envdiff
+	import store
+	s = store.Store(sys.argv[1])
+	def load(name):
+	    data = envdiff.ShellEnvironmentData(s.snapshot_path(name))
+	    return json.dumps({c: getattr(data, c) for c in envdiff.COMPONENTS}, sort_keys=True)
+	def digest(name, function):
+	    return store.Manifest(s.snapshot_path(name)).digests()['entries']['functions'][function]
+	before = load('a')
+	shared, only_b = digest('a', 'shared_function'), digest('b', 'only_in_b')
+	for d in (shared, only_b):
+	    if not os.path.exists(s.object_path(d)):
+	        print(f"object {d} was not written")
+	os.unlink(s.snapshot_path('b'))
+	kept, removed = s.gc(grace=0)
+	if not os.path.exists(s.object_path(shared)):
+	    print("the object shared with 'a' was removed")
+	if os.path.exists(s.object_path(only_b)):
+	    print("the object only referenced by 'b' was kept")
+	if removed == 0:
+	    print("nothing was removed")
+	if load('a') != before:
+	    print("'a' loads differently after gc")
+	PYEOF
+)"
+if [[ -n "${result}" ]] ; then
+    test_log "FAILURE:"
+    test_log "${result}"
+    exit 1
+fi
+
+test_log "SUCCESS"
+rm -rf ${tmpdir}
@@ -0,0 +1,83 @@
+#!/usr/bin/env bash
+set -uEo pipefail
+shopt -s inherit_errexit
+
+source ./env-diff-cmd.bash
+
+tmpdir=$(mktemp -d tmp.test-timeline.XXXXXX)
+# Keep the caches of env-diff away from those of the user
+export XDG_CACHE_HOME=${PWD}/${tmpdir}/cache
+
+test_log(){
+    printf "\033[1;35m$0: %s\033[0m\n" "$*" >&2
+}
+
+# History of an entry or of an element of a list variable as 'KIND SNAPSHOT ...'
+history(){
+    jq -r --arg name "$1" --arg element "${2:-}" \
+        '.entries[] | select(.name == $name)
+         | if $element == "" then .history else (.elements[] | select(.value == $element) | .history) end
+         | map("\(.kind) \(.snapshot)") | join(" ")' ${tmpdir}/timeline.json
+}
+
+expect(){
+    local expected=$1 ; shift
+    local result
+    result=$(history "$@")
+    if [[ "${result}" != "${expected}" ]] ; then
+        test_log "FAILURE: history of '$*' is '${result}' instead of '${expected}'"
+        exit 1
+    fi
+}
+
+test_log "Saving a sequence of environments"
+(
+    env-diff-save ${tmpdir}/s0
+    export TIMELINE_VAR=1 PATH=/timeline/a:${PATH}
+    env-diff-save ${tmpdir}/s1
+    timeline_func(){ : ; }
+    TIMELINE_VAR=2 PATH=/timeline/b:${PATH}
+    env-diff-save ${tmpdir}/s2
+    unset TIMELINE_VAR
+    PATH=${PATH#/timeline/b:}
+    env-diff-save ${tmpdir}/s3
+) || { test_log "FAILURE: could not save the environments" ; exit 1 ; }
+
+test_log "env-diff-compare --timeline --format json"
+env-diff-compare -F /dev/null --timeline --format json ${tmpdir}/s{0,1,2,3} > ${tmpdir}/timeline.json
+expect "new 1 changed 2 deleted 3" TIMELINE_VAR
+expect "new 2" timeline_func
+expect "added 1" PATH /timeline/a
+expect "added 2 removed 3" PATH /timeline/b
+
+test_log "Same report with each environment loaded once"
+env-diff-compare -F /dev/null --timings ${tmpdir}/timings.json \
+    --timeline ${tmpdir}/s{0,1,2,3} > ${tmpdir}/nocache.txt 2>/dev/null
+# Only environments with digests are cached
+for s in ${tmpdir}/s{0,1,2,3} ; do
+    env-diff-snapshot digest ${s}
+done
+for run in 1 2 ; do
+    ENV_DIFF_DIFF_CACHE=true env-diff-compare -F /dev/null --timeline ${tmpdir}/s{0,1,2,3} > ${tmpdir}/cache.txt
+    if ! diff ${tmpdir}/nocache.txt ${tmpdir}/cache.txt ; then
+        test_log "FAILURE: the report is different with the diff cache (run ${run})"
+        exit 1
+    fi
+done
+if [[ -z "$(ls ${XDG_CACHE_HOME}/env-diff/diffs)" ]] ; then
+    test_log "FAILURE: no diff in the cache with ENV_DIFF_DIFF_CACHE=true"
+    exit 1
+fi
+if jq -r '.. | objects | .name? // empty' ${tmpdir}/timings.json | grep '^load ' | sort | uniq -d | grep . ; then
+    test_log "FAILURE: components were loaded more than once"
+    exit 1
+fi
+
+test_log "More than two environments need --timeline"
+if env-diff-compare -F /dev/null ${tmpdir}/s{0,1,2} >/dev/null 2>&1 ; then
+    test_log "FAILURE: three environments were accepted without --timeline"
+    exit 1
+fi
+
+test_log "SUCCESS"
+rm -rf ${tmpdir}
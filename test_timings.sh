@@ -0,0 +1,77 @@
+#!/usr/bin/env bash
+set -uEo pipefail
+shopt -s inherit_errexit
+
+source ./env-diff-cmd.bash
+
+tmpdir=$(mktemp -d tmp.test-timings.XXXXXX)
+# Keep the caches of env-diff away from those of the user
+export XDG_CACHE_HOME=${PWD}/${tmpdir}/cache
+
+test_log(){
+    printf "\033[1;35m$0: %s\033[0m\n" "$*" >&2
+}
+
+# Names of the phases of a trace at each depth as 'parent/name'
+phases(){
+    jq -r 'def names($parent): .[] | ($parent + .name), (.name as $n | .phases | names($parent + $n + "/")) ;
+           .phases | names("")' "$1"
+}
+
+expect(){
+    local trace=$1 ; shift
+    local phase
+    for phase in "$@" ; do
+        if ! phases ${trace} | grep -qx "${phase}" ; then
+            test_log "FAILURE: no phase '${phase}' in ${trace}"
+            exit 1
+        fi
+    done
+}
+
+f(){ export NEWVAR=1 ; }
+
+test_log "env-diff --timings"
+with=$(env-diff --timings ${tmpdir}/env-diff.json -F /dev/null f 2>/dev/null)
+without=$(env-diff -F /dev/null f 2>/dev/null)
+if [[ "${with}" != "${without}" ]] ; then
+    test_log "FAILURE: the report is different with --timings:"
+    test_log "${with}"
+    exit 1
+fi
+expect ${tmpdir}/env-diff.json save_before save_before/variables save_before/functions \
+    command save_after compare compare/diff "compare/diff/diff env_vars" compare/report
+if (( $(jq .processes ${tmpdir}/env-diff.json) < 3 )) ; then
+    test_log "FAILURE: external programs were not counted"
+    exit 1
+fi
+
+test_log "ENV_DIFF_TIMINGS with env-diff-save and env-diff-load"
+(
+    env-diff-save ${tmpdir}/target
+    export ENV_DIFF_TIMINGS=${tmpdir}/save.json
+    env-diff-save ${tmpdir}/other 2>/dev/null
+    export ENV_DIFF_TIMINGS=${tmpdir}/load.json
+    env-diff-load ${tmpdir}/target 2>/dev/null
+) || { test_log "FAILURE: could not save and load" ; exit 1 ; }
+expect ${tmpdir}/save.json save save/variables save/functions save/traps
+expect ${tmpdir}/load.json save gencode gencode/diff gencode/gencode source
+
+test_log "No diff cache by default"
+if [[ -e ${XDG_CACHE_HOME}/env-diff/diffs ]] ; then
+    test_log "FAILURE: diffs were written to ${XDG_CACHE_HOME}/env-diff/diffs"
+    exit 1
+fi
+
+test_log "Concurrent phases ending after the phase that started them"
+printf '%s\t%s\t%s\t%s\t%s\n' \
+    begin compare 1.0 '' '' \
+    phase diff 1.1 1.5 '' \
+    phase 'load env_vars a' 1.15 1.6 '&' \
+    phase 'diff env_vars' 1.3 1.4 '' \
+    end compare 2.0 '' '' > ${tmpdir}/concurrent.log
+python3 env-diff-snapshot.py timings ${tmpdir}/concurrent.log ${tmpdir}/concurrent.json 2>/dev/null
+expect ${tmpdir}/concurrent.json "compare/diff/load env_vars a" "compare/diff/diff env_vars"
+
+test_log "SUCCESS"
+rm -rf ${tmpdir}
@@ -0,0 +1,55 @@
+#!/usr/bin/env bash
+#
+# Parse the output of `trap -p` for traps with quotes, several lines, several
+# signals and the special conditions of BASH and check that each command is
+# loaded as it was given to `trap`.
+#
+set -uEo pipefail
+shopt -s inherit_errexit
+
+tmpdir=$(mktemp -d tmp.test-traps.XXXXXX)
+
+test_log(){
+    printf "\033[1;35m$0: %s\033[0m\n" "$*" >&2
+}
+
+# The commands of DEBUG, RETURN and ERR run in this subshell so they do
+# nothing
+(
+    trap "echo 'single quoted' \"double quoted\"" USR1
+    trap ': first line
+: second line' USR2
+    trap ': same command' HUP TERM
+    trap ': debug' DEBUG
+    trap ': return' RETURN
+    trap ': err' ERR
+    trap -p > ${tmpdir}/traps.txt
+)
+
+diff="$(python3 - ${tmpdir}/traps.txt <<-'PYEOF'
+	import sys
+	import envdiff
+	expected = {
+	    'SIGUSR1': "echo 'single quoted' \"double quoted\"",
+	    'SIGUSR2': ': first line\n: second line',
+	    'SIGHUP': ': same command',
+	    'SIGTERM': ': same command',
+	    'DEBUG': ': debug',
+	    'RETURN': ': return',
+	    'ERR': ': err',
+	}
+	with open(sys.argv[1], 'rb') as f:
+	    traps = envdiff.parse_trap_p(f.read())
+	for signal in sorted(set(expected) | set(traps)):
+	    if traps.get(signal) != expected.get(signal):
+	        print(f"{signal}: {traps.get(signal)!r} instead of {expected.get(signal)!r}")
+	PYEOF
+)"
+if [[ -n "${diff}" ]] ; then
+    test_log "FAILURE: traps were not parsed correctly:"
+    test_log "${diff}"
+    exit 1
+fi
+
+test_log "SUCCESS"
+rm -rf ${tmpdir}
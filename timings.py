@@ -0,0 +1,196 @@
+"""
+Timings of the phases of env-diff (--timings and ENV_DIFF_TIMINGS)
+
+The bash functions and the python scripts append events to a log, one per
+line with tab separated fields:
+
+    begin NAME TIME [JOB]   start of the phase NAME in bash
+    end NAME TIME           end of the last phase NAME started in bash
+    exec PROGRAM TIME PID   external program run by bash
+    phase NAME START END [&]
+                            phase of a python script
+
+Times are seconds since the epoch like $EPOCHREALTIME.  The bash functions
+write the start and the end of a phase separately because keeping the start
+in a variable would put it in the saved environment.  The python scripts find
+the log in the environment variable _env_diff_timings_log.  When they are run
+directly with --timings, they keep their events in memory.
+
+Phases are nested by time: a phase is in the innermost phase that contains
+it.  Phases that run concurrently with others, background jobs of bash (JOB
+is their $BASHPID) and threads of python (marked with '&'), overlap in
+any order so they never contain other phases, they are in the innermost phase
+that contains their start even if they end after it and the programs of a job
+are those run by its PID.  trace() turns the events into
+
+    {"version": 1, "command": COMMAND, "host": HOST, "start": TIME,
+     "wall": SECONDS, "processes": N, "phases": [PHASE, ...]}
+
+where each PHASE is
+
+    {"name": NAME, "start": SECONDS, "wall": SECONDS, "processes": N,
+     "phases": [PHASE, ...]}
+
+with start relative to the start of the trace and processes the number of
+external programs run during the phase including those of its phases.
+summary() formats a trace for humans.
+"""
+import contextlib
+import json
+import os
+import socket
+import sys
+import threading
+import time
+
+LOG_VARIABLE = '_env_diff_timings_log'
+TRACE_VERSION = 1
+
+_log_fd = None
+_events = None
+_trace_path = None
+_lock = threading.Lock()
+
+def start(trace_path=None):
+    """
+    Start recording the phases of this process.  If the bash functions have a
+    log (see LOG_VARIABLE), the events are appended to it.  Otherwise, if
+    trace_path is given, they are kept for finish() to write the trace.
+    """
+    global _log_fd, _events, _trace_path
+    if os.environ.get(LOG_VARIABLE):
+        _log_fd = os.open(os.environ[LOG_VARIABLE], os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600)
+    elif trace_path:
+        _events = []
+        _trace_path = trace_path
+
+def enabled():
+    return _log_fd is not None or _events is not None
+
+def _record(fields):
+    if _log_fd is not None:
+        # A single write of a line with O_APPEND is not mixed with the writes
+        # of other threads and processes
+        os.write(_log_fd, ('\t'.join(fields) + '\n').encode('utf-8'))
+    else:
+        with _lock:
+            _events.append(fields)
+
+@contextlib.contextmanager
+def phase(name, concurrent=False):
+    """
+    Record the time of the code of the with block as the phase name.  It is
+    concurrent if it runs in a thread alongside other phases.
+    """
+    if not enabled():
+        yield
+        return
+    begin = time.time()
+    try:
+        yield
+    finally:
+        _record(['phase', name, f"{begin:.6f}", f"{time.time():.6f}"] + (['&'] if concurrent else []))
+
+def finish(command):
+    """
+    Write the trace of the phases recorded in memory and print its summary
+    on stderr.  Nothing is done when the events went to the log of the bash
+    functions since they write the trace.
+    """
+    global _events
+    if _events is None:
+        return
+    events, _events = _events, None
+    write_trace(trace(events, command), _trace_path)
+
+def read_log(path):
+    """ Events of the log at path as lists of fields """
+    with open(path, encoding='utf-8', errors='replace') as f:
+        return [l.rstrip('\n').split('\t') for l in f if l.strip()]
+
+def _intervals(events):
+    """
+    Phases as [name, start, end, job] and programs run as (time, pid) where
+    job is None for phases that do not run concurrently, the PID of a
+    background job or '&' for a thread
+    """
+    phases = []
+    execs = []
+    started = {}
+    # $EPOCHREALTIME has the decimal point of the locale
+    seconds = lambda field: float(field.replace(',', '.'))
+    for e in events:
+        try:
+            if e[0] == 'begin':
+                interval = [e[1], seconds(e[2]), None, e[3] if len(e) > 3 and e[3] else None]
+                started.setdefault(e[1], []).append(interval)
+                phases.append(interval)
+            elif e[0] == 'end' and started.get(e[1]):
+                started[e[1]].pop()[2] = seconds(e[2])
+            elif e[0] == 'exec':
+                execs.append((seconds(e[2]), e[3] if len(e) > 3 else None))
+            elif e[0] == 'phase':
+                phases.append([e[1], seconds(e[2]), seconds(e[3]), e[4] if len(e) > 4 and e[4] else None])
+        except (IndexError, ValueError):
+            continue
+    # A phase of bash that failed has no end
+    last = max([p[2] or p[1] for p in phases] + [t for t, _ in execs], default=0.0)
+    for interval in phases:
+        if interval[2] is None:
+            interval[2] = last
+    return phases, sorted(execs)
+
+def trace(events, command):
+    """ Trace (see above) of the events of a log """
+    phases, execs = _intervals(events)
+    times = [p[1] for p in phases] + [t for t, _ in execs]
+    origin = min(times, default=time.time())
+    end = max([p[2] for p in phases] + times, default=origin)
+    root = {'phases': []}
+    stack = [(root, float('-inf'), float('inf'))]
+    # Longer phases first when they start at the same time so that they
+    # contain the shorter ones
+    for name, begin, stop, job in sorted(phases, key=lambda p: (p[1], -p[2])):
+        processes = sum(1 for t, pid in execs if begin <= t <= stop and job in (None, pid))
+        node = {'name': name, 'start': round(begin - origin, 6), 'wall': round(stop - begin, 6),
+                'processes': processes, 'phases': []}
+        if job is None:
+            while not (stack[-1][1] <= begin and stop <= stack[-1][2]):
+                stack.pop()
+            stack[-1][0]['phases'].append(node)
+            stack.append((node, begin, stop))
+        else:
+            # A concurrent phase may end after the phase that started it so
+            # it goes in the innermost phase containing its start and the
+            # stack is left alone for the phases that follow
+            parent = next(p for p, b, e in reversed(stack) if b <= begin <= e)
+            parent['phases'].append(node)
+    return {
+        'version': TRACE_VERSION,
+        'command': command,
+        'host': socket.gethostname(),
+        'start': origin,
+        'wall': round(end - origin, 6),
+        'processes': len(execs),
+        'phases': root['phases'],
+    }
+
+def summary(data):
+    """ Lines of the summary of a trace """
+    lines = [f"{'phase':<40} {'wall (ms)':>10} {'processes':>10}"]
+    def add(phases, depth):
+        for p in phases:
+            lines.append(f"{'  ' * depth + p['name']:<40} {p['wall'] * 1000:>10.1f} {p['processes']:>10}")
+            add(p['phases'], depth + 1)
+    add(data['phases'], 0)
+    lines.append(f"{'total':<40} {data['wall'] * 1000:>10.1f} {data['processes']:>10}")
+    return lines
+
+def write_trace(data, path):
+    """ Write the trace data to path and its summary to stderr """
+    with open(path, 'w') as f:
+        json.dump(data, f, indent=1)
+        f.write('\n')
+    print(f"Timings of '{data['command']}' (trace in {path}):", file=sys.stderr)
+    for line in summary(data):
+        print(f"    {line}", file=sys.stderr)